@@ -1,4 +1,5 @@
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
 
 def get_mysql_db_config():
@@ -9,4 +10,22 @@ def get_mysql_db_config():
         'password': default.get('PASSWORD'),
         'port': int(default.get('PORT', 3306)),
         'database': default.get('NAME'),
-    }
\ No newline at end of file
+    }
+
+
+def get_sandbox_readonly_db_config():
+    """
+    Connection settings for the low-privilege, SELECT-only account used to run
+    student queries against shared problem schemas (SQL_SANDBOX_MODE == "shared").
+    Same server as the default database, different credentials and no default schema.
+
+    Raises:
+        ImproperlyConfigured: If SANDBOX_READONLY_PASSWORD is not set.
+    """
+    if not settings.SANDBOX_READONLY_PASSWORD:
+        raise ImproperlyConfigured("SANDBOX_READONLY_PASSWORD is not set; see the sandbox_reader account in dbDDL.sql.")
+    config = get_mysql_db_config()
+    config['user'] = settings.SANDBOX_READONLY_USER
+    config['password'] = settings.SANDBOX_READONLY_PASSWORD
+    config.pop('database')
+    return config
\ No newline at end of file
@@ -159,6 +159,48 @@ CREATE TABLE StudentBadge (
 
 
 
+-- Grading job queue (GRADING_QUEUE_ENABLED=True).
+-- Workers claim the oldest queued job with SELECT ... FOR UPDATE SKIP LOCKED (MySQL 8.0+).
+CREATE TABLE GradingJob (
+    job_id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    problem_id INT NOT NULL,
+    user_query TEXT NOT NULL,
+    hints_used INT DEFAULT 0,
+    time_taken INT COMMENT 'Time taken in seconds',
+    status ENUM('queued', 'running', 'done', 'failed') NOT NULL DEFAULT 'queued',
+    verdict VARCHAR(32),
+    feedback TEXT,
+    score DECIMAL(5,2),
+    attempt_id INT,
+    worker_id VARCHAR(64),
+    tries INT NOT NULL DEFAULT 0,
+    created_at DATETIME(6) DEFAULT CURRENT_TIMESTAMP(6),
+    started_at DATETIME(6),
+    finished_at DATETIME(6),
+    FOREIGN KEY (user_id) REFERENCES User(user_id) ON DELETE CASCADE,
+    FOREIGN KEY (problem_id) REFERENCES SQLProblem(problem_id) ON DELETE CASCADE,
+    FOREIGN KEY (attempt_id) REFERENCES Attempt(attempt_id) ON DELETE SET NULL,
+    INDEX idx_gradingjob_status (status, job_id)
+);
+
+-- Problem ID allocation for uploads (utils/problem_catalog.py). The single 'problem' row
+-- is locked and incremented per upload; it is seeded on the first upload.
+CREATE TABLE ProblemIdSequence (
+    name VARCHAR(32) PRIMARY KEY,
+    next_id INT NOT NULL
+);
+
+-- Read-only account for grading in SQL_SANDBOX_MODE=shared.
+-- Student queries run as this user against the persistent problem_data_<id>_<hash>
+-- schemas materialized by utils/problem_schema.py; it can only SELECT from them.
+-- No password is set here: the operator must choose one before grading in shared mode,
+--   ALTER USER 'sandbox_reader'@'%' IDENTIFIED BY '<password>' ACCOUNT UNLOCK;
+-- and give it to the backend as SANDBOX_READONLY_PASSWORD. The account stays locked
+-- until then, and the backend refuses to start in shared mode without it.
+CREATE USER IF NOT EXISTS 'sandbox_reader'@'%' ACCOUNT LOCK;
+GRANT SELECT ON `problem\_data\_%`.* TO 'sandbox_reader'@'%';
+
 -- Create a user index table for tracking user count
 CREATE TABLE UserIndex (
     current_index INT NOT NULL DEFAULT 0
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 import os
 from datetime import timedelta
@@ -99,6 +100,182 @@ AUTH_USER_MODEL = 'users.User'
 # Should match the environment variable GCS_PROBLEM_BUCKET set in app.yaml or .env.
 GCS_PROBLEM_BUCKET = "sql-problems-bucket-group7"
 
+# Where uploaded problems are stored (utils.problem_storage):
+#   - "gcs" (default): the GCS_PROBLEM_BUCKET bucket
+#   - "local": the PROBLEM_STORAGE_DIR directory (BASE_DIR when empty), for development,
+#              tests and benchmarks without GCS credentials
+PROBLEM_STORAGE = os.environ.get("PROBLEM_STORAGE", "gcs")
+PROBLEM_STORAGE_DIR = os.environ.get("PROBLEM_STORAGE_DIR", "")
+
+# How grading sandboxes are provisioned (see utils.sql_sandbox.problem_sandbox):
+#   - "ephemeral": create a schema, replay problem.sql and drop it for every submission
+#   - "clone": create a schema and copy the tables of the problem's golden template
+#              schema into it server-side (CREATE TABLE ... LIKE + INSERT ... SELECT)
+#   - "pool": hand out pre-populated schemas kept warm by utils.sandbox_pool
+#   - "shared": run student queries on one persistent schema per problem version
+#               (utils.problem_schema) through a SELECT-only MySQL account
+SQL_SANDBOX_MODE = os.environ.get("SQL_SANDBOX_MODE", "ephemeral")
+
+# Default engine that grades student queries (see utils.sql_sandbox.check_user_query);
+# a problem can pick its own with "engine" in metadata.json:
+#   - "mysql": always grade in a MySQL sandbox
+#   - "sqlite": grade on an in-memory SQLite copy of the problem (utils.sqlite_engine)
+#               and fall back to MySQL when the query does not transpile losslessly
+#   - "duckdb": grade on an in-memory DuckDB database (utils.duckdb_engine), meant for
+#               analytic problems with large datasets
+# With CONFIRM_ON_MYSQL, "wrong" verdicts from SQLite/DuckDB are re-checked on MySQL,
+# since dialect differences can make a correct MySQL query fail there; queries either
+# engine raises an error on are always graded on MySQL. Queries SQLite is
+# more lenient with (e.g. columns outside GROUP BY) always go to MySQL, and verdicts
+# given by SQLite alone are never cached.
+GRADING_ENGINE = os.environ.get("GRADING_ENGINE", "mysql")
+SQLITE_ENGINE_CONFIRM_ON_MYSQL = os.environ.get("SQLITE_ENGINE_CONFIRM_ON_MYSQL", "True") == "True"
+SQLITE_ENGINE_CACHE_SIZE = int(os.environ.get("SQLITE_ENGINE_CACHE_SIZE", "128"))
+DUCKDB_ENGINE_CONFIRM_ON_MYSQL = os.environ.get("DUCKDB_ENGINE_CONFIRM_ON_MYSQL", "True") == "True"
+DUCKDB_ENGINE_CACHE_SIZE = int(os.environ.get("DUCKDB_ENGINE_CACHE_SIZE", "8"))
+
+# Credentials of the low-privilege account used in "shared" mode.
+# It only needs SELECT on the problem_data_% schemas (see dbDDL.sql). There is no
+# default password: set the one chosen when the account was created.
+SANDBOX_READONLY_USER = os.environ.get("SANDBOX_READONLY_USER", "sandbox_reader")
+SANDBOX_READONLY_PASSWORD = os.environ.get("SANDBOX_READONLY_PASSWORD")
+if SQL_SANDBOX_MODE == "shared" and not SANDBOX_READONLY_PASSWORD:
+    raise ImproperlyConfigured('SQL_SANDBOX_MODE "shared" requires SANDBOX_READONLY_PASSWORD to be set.')
+
+# Sandbox pool sizing (only used when SQL_SANDBOX_MODE == "pool").
+# SIZE_PER_PROBLEM ready schemas are kept for each hot problem, at most MAX_PROBLEMS
+# problems are kept warm (least recently used are evicted), and MAX_SCHEMAS caps the
+# total number of pooled schemas across all problems.
+SANDBOX_POOL_SIZE_PER_PROBLEM = int(os.environ.get("SANDBOX_POOL_SIZE_PER_PROBLEM", "4"))
+SANDBOX_POOL_MAX_PROBLEMS = int(os.environ.get("SANDBOX_POOL_MAX_PROBLEMS", "20"))
+SANDBOX_POOL_MAX_SCHEMAS = int(os.environ.get("SANDBOX_POOL_MAX_SCHEMAS", "60"))
+SANDBOX_POOL_REFILL_WORKERS = int(os.environ.get("SANDBOX_POOL_REFILL_WORKERS", "2"))
+
+# Problem files (metadata.json, problem.sql, solution.sql, hidden datasets) cached per
+# process by utils.problem_loader, with their parsed JSON. Local files are revalidated
+# by mtime on every read; GCS objects by generation number, at most every
+# PROBLEM_CONTENT_GCS_REVALIDATE_SECONDS (so an edited GCS object is picked up within that time).
+PROBLEM_CONTENT_CACHE_SIZE = int(os.environ.get("PROBLEM_CONTENT_CACHE_SIZE", "1024"))
+PROBLEM_CONTENT_GCS_REVALIDATE_SECONDS = float(os.environ.get("PROBLEM_CONTENT_GCS_REVALIDATE_SECONDS", "5"))
+
+# Problem catalog (utils.problem_catalog): problems/catalog.json in problem storage
+# records every uploaded problem's files with their generation, SHA-256 and size.
+# Each process checks it for changes at most every PROBLEM_CATALOG_REVALIDATE_SECONDS;
+# cataloged files are then read and versioned without per-file requests.
+PROBLEM_CATALOG_REVALIDATE_SECONDS = float(os.environ.get("PROBLEM_CATALOG_REVALIDATE_SECONDS", "5"))
+
+# How the upload endpoint stores a new problem (utils.gcs_uploader):
+#   - "bundle" (default): one problems/<id>/problem.bundle object with every file, the
+#     compiled setup statements and the expected results (utils.problem_bundle)
+#   - "folder": one object per file
+# Both layouts are always accepted when loading problems.
+PROBLEM_UPLOAD_FORMAT = os.environ.get("PROBLEM_UPLOAD_FORMAT", "bundle")
+
+# Local mirror of the problems/ prefix of problem storage (utils.problem_mirror).
+# When set, problem files missing from BASE_DIR/problems are read from this directory,
+# which a background thread in each process syncs every PROBLEM_MIRROR_SYNC_SECONDS
+# (only objects whose generation changed are downloaded). Processes on one host
+# can share the directory. Empty: problem storage is read directly.
+PROBLEM_MIRROR_DIR = os.environ.get("PROBLEM_MIRROR_DIR", "")
+PROBLEM_MIRROR_SYNC_SECONDS = float(os.environ.get("PROBLEM_MIRROR_SYNC_SECONDS", "60"))
+
+# Number of compiled problem.sql scripts cached per process, and the size of the
+# multi-row INSERTs that consecutive single-row INSERTs are merged into.
+SETUP_SCRIPT_CACHE_SIZE = int(os.environ.get("SETUP_SCRIPT_CACHE_SIZE", "256"))
+SANDBOX_SETUP_BATCH_ROWS = int(os.environ.get("SANDBOX_SETUP_BATCH_ROWS", "1000"))
+SANDBOX_SETUP_BATCH_BYTES = int(os.environ.get("SANDBOX_SETUP_BATCH_BYTES", str(1024 * 1024)))
+
+# Number of problem versions whose expected (solution.sql) result is cached per process.
+EXPECTED_RESULT_CACHE_SIZE = int(os.environ.get("EXPECTED_RESULT_CACHE_SIZE", "256"))
+
+# Number of (problem version, normalized query) verdicts cached per process.
+VERDICT_CACHE_SIZE = int(os.environ.get("VERDICT_CACHE_SIZE", "4096"))
+
+# Rows fetched per round trip when streaming sandbox results (cursor.fetchmany).
+SANDBOX_FETCH_BATCH_SIZE = int(os.environ.get("SANDBOX_FETCH_BATCH_SIZE", "500"))
+
+# Caps on any single query result read by the backend (student queries, solution.sql
+# and the instructor query endpoint). Byte counts are estimated from string/binary
+# lengths. A student result over the cap gets the "output_limit_exceeded" verdict.
+QUERY_RESULT_MAX_ROWS = int(os.environ.get("QUERY_RESULT_MAX_ROWS", "10000"))
+QUERY_RESULT_MAX_BYTES = int(os.environ.get("QUERY_RESULT_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Default per-statement time budget (ms) for student queries; a problem can override it
+# with "time_limit_ms" in its metadata.json. SELECTs are stopped by MySQL's
+# max_execution_time; anything still running GRACE_MS later is killed by the query
+# watchdog (KILL QUERY from a side connection) and graded "time limit exceeded".
+SANDBOX_QUERY_TIME_LIMIT_MS = int(os.environ.get("SANDBOX_QUERY_TIME_LIMIT_MS", "5000"))
+SANDBOX_WATCHDOG_GRACE_MS = int(os.environ.get("SANDBOX_WATCHDOG_GRACE_MS", "1000"))
+
+# Asynchronous grading. When enabled, the submit endpoint stores the submission in the
+# GradingJob table and returns its job id (HTTP 202); the client polls
+# /api/grading-jobs/<job_id>/ for the verdict. Up to GRADING_QUEUE_WORKERS jobs are
+# graded at once per process running workers: the web processes themselves, unless
+# GRADING_QUEUE_IN_PROCESS_WORKERS is False and scripts/run_grading_workers.py runs them.
+# A job left 'running' longer than GRADING_JOB_TIMEOUT_SECONDS (its worker died) is
+# requeued, and marked failed after GRADING_JOB_MAX_TRIES claims.
+GRADING_QUEUE_ENABLED = os.environ.get("GRADING_QUEUE_ENABLED", "False") == "True"
+GRADING_QUEUE_IN_PROCESS_WORKERS = os.environ.get("GRADING_QUEUE_IN_PROCESS_WORKERS", "True") == "True"
+GRADING_QUEUE_WORKERS = int(os.environ.get("GRADING_QUEUE_WORKERS", "4"))
+GRADING_QUEUE_POLL_SECONDS = float(os.environ.get("GRADING_QUEUE_POLL_SECONDS", "1.0"))
+GRADING_JOB_TIMEOUT_SECONDS = int(os.environ.get("GRADING_JOB_TIMEOUT_SECONDS", "120"))
+GRADING_JOB_MAX_TRIES = int(os.environ.get("GRADING_JOB_MAX_TRIES", "3"))
+GRADING_QUEUE_METRICS_WINDOW_SECONDS = int(os.environ.get("GRADING_QUEUE_METRICS_WINDOW_SECONDS", "300"))
+
+# Grader service (scripts/run_grader_service.py): a separately launched pool of
+# GRADER_SERVICE_PROCESSES processes that grade submissions for the web workers over the
+# Unix socket GRADER_SERVICE_SOCKET. Leave the socket empty to grade in-process.
+# Connections are authenticated with GRADER_SERVICE_AUTHKEY (defaults to SECRET_KEY).
+# A grader process is recycled after GRADER_SERVICE_MAX_REQUESTS submissions. If the
+# service cannot be reached, submissions are graded locally unless
+# GRADER_SERVICE_FALLBACK_LOCAL is False.
+GRADER_SERVICE_SOCKET = os.environ.get("GRADER_SERVICE_SOCKET", "")
+GRADER_SERVICE_PROCESSES = int(os.environ.get("GRADER_SERVICE_PROCESSES", "4"))
+GRADER_SERVICE_MAX_REQUESTS = int(os.environ.get("GRADER_SERVICE_MAX_REQUESTS", "1000"))
+GRADER_SERVICE_TIMEOUT_SECONDS = float(os.environ.get("GRADER_SERVICE_TIMEOUT_SECONDS", "60"))
+GRADER_SERVICE_AUTHKEY = os.environ.get("GRADER_SERVICE_AUTHKEY", SECRET_KEY)
+GRADER_SERVICE_FALLBACK_LOCAL = os.environ.get("GRADER_SERVICE_FALLBACK_LOCAL", "True") == "True"
+
+# Connections per event loop in the aiomysql pool used by the async endpoints
+# (sql_app/async_views.py, served under ASGI); each in-flight submission holds one.
+ASYNC_SANDBOX_POOL_SIZE = int(os.environ.get("ASYNC_SANDBOX_POOL_SIZE", "200"))
+
+# MySQL servers used only for grading sandboxes (utils.sandbox_hosts), so sandbox DDL
+# stays off the application database. Comma-separated "host:port" entries, each with an
+# optional "=N" concurrency limit (default SANDBOX_HOST_MAX_CONCURRENCY), e.g.
+#   SANDBOX_HOSTS="10.0.0.5:3306,10.0.0.6:3306=32"
+# or, for local testing with several MySQL instances on different ports:
+#   SANDBOX_HOSTS="127.0.0.1:3307,127.0.0.1:3308,127.0.0.1:3309"
+# Empty: sandboxes are created on the application database server. Applies to the
+# "ephemeral" and "clone" sandbox modes. SANDBOX_HOST_USER needs CREATE/DROP on
+# sandbox_% and problem_data_% schemas and defaults to the application account.
+# A host is ejected after SANDBOX_HOST_FAILURE_THRESHOLD consecutive connection-level
+# failures, for SANDBOX_HOST_EJECT_SECONDS (doubling on every failed re-admission probe,
+# up to SANDBOX_HOST_MAX_EJECT_SECONDS).
+SANDBOX_HOSTS = os.environ.get("SANDBOX_HOSTS", "")
+SANDBOX_HOST_USER = os.environ.get("SANDBOX_HOST_USER", "")
+SANDBOX_HOST_PASSWORD = os.environ.get("SANDBOX_HOST_PASSWORD", "")
+SANDBOX_HOST_MAX_CONCURRENCY = int(os.environ.get("SANDBOX_HOST_MAX_CONCURRENCY", "16"))
+SANDBOX_HOST_ACQUIRE_TIMEOUT_SECONDS = float(os.environ.get("SANDBOX_HOST_ACQUIRE_TIMEOUT_SECONDS", "5"))
+SANDBOX_HOST_CONNECT_TIMEOUT_SECONDS = int(os.environ.get("SANDBOX_HOST_CONNECT_TIMEOUT_SECONDS", "3"))
+SANDBOX_HOST_FAILURE_THRESHOLD = int(os.environ.get("SANDBOX_HOST_FAILURE_THRESHOLD", "3"))
+SANDBOX_HOST_EJECT_SECONDS = float(os.environ.get("SANDBOX_HOST_EJECT_SECONDS", "10"))
+SANDBOX_HOST_MAX_EJECT_SECONDS = float(os.environ.get("SANDBOX_HOST_MAX_EJECT_SECONDS", "300"))
+
+# Instructor batch grading (utils.batch_grading): maximum submissions per request, and
+# how many Attempt rows are written per bulk insert/update when a batch is saved.
+BATCH_GRADING_MAX_ITEMS = int(os.environ.get("BATCH_GRADING_MAX_ITEMS", "10000"))
+BATCH_GRADING_WRITE_CHUNK = int(os.environ.get("BATCH_GRADING_WRITE_CHUNK", "500"))
+
+# Threads (process-wide) that grade a submission's datasets concurrently, for problems
+# with hidden test datasets (problems/<id>/tests/*.sql); each holds one sandbox connection.
+DATASET_GRADING_WORKERS = int(os.environ.get("DATASET_GRADING_WORKERS", "8"))
+
+# Send the per-stage grading timings (utils.grading_timings) to the client in a
+# Server-Timing header on submit responses. The timings are always recorded in the
+# per-problem latency histograms (GET /api/grading-latency/metrics/).
+GRADING_SERVER_TIMING = os.environ.get("GRADING_SERVER_TIMING", "true").lower() == "true"
+
 # Middleware components for request/response lifecycle
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",  # Enables CORS
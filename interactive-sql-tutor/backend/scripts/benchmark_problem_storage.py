@@ -0,0 +1,63 @@
+import os
+import statistics
+import sys
+import time
+import django
+
+# Ensure the project root directory is in the Python path
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+# Explicitly specify the Django settings module
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "final_project.settings")
+
+# Initialize the Django application environment
+django.setup()
+
+from django.conf import settings
+from google.cloud import storage
+from utils.problem_storage import PROBLEM_PREFIX, get_problem_storage
+
+# This script measures problem I/O against the configured problem storage backend:
+# - building a GCS client per request (what the upload and load paths used to do)
+#   versus reusing the process-wide one, and
+# - generation lookups, reads and prefix listings through `utils.problem_storage`.
+
+# Usage:
+#   python scripts/benchmark_problem_storage.py [iterations]
+#   PROBLEM_STORAGE=local PROBLEM_STORAGE_DIR=/tmp/problems python scripts/benchmark_problem_storage.py
+
+# Assumptions:
+# - The store holds at least one problem under problems/ (e.g. uploaded, or copied
+#   into PROBLEM_STORAGE_DIR for the local backend).
+
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+
+def timed(func):
+    samples = []
+    for _ in range(ITERATIONS):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+problem_storage = get_problem_storage()
+objects = problem_storage.list(PROBLEM_PREFIX)
+if not objects:
+    sys.exit(f"No objects under {PROBLEM_PREFIX} in {problem_storage.location}")
+name = objects[0][0]
+print(f"{problem_storage.location}: {len(objects)} objects, reading {name} x {ITERATIONS}")
+
+results = [
+    ("generation", lambda: problem_storage.generation(name)),
+    ("get", lambda: problem_storage.get(name)),
+    ("list problem", lambda: problem_storage.list(name.rsplit("/", 1)[0] + "/")),
+]
+if settings.PROBLEM_STORAGE.lower() == "gcs":
+    results.insert(0, ("new client", lambda: storage.Client().bucket(settings.GCS_PROBLEM_BUCKET)))
+
+print(f"{'operation':<14} {'p50 ms':>9} {'max ms':>9}")
+for label, func in results:
+    p50, worst = timed(func)
+    print(f"{label:<14} {p50:>9.2f} {worst:>9.2f}")
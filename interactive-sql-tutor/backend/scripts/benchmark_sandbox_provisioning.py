@@ -0,0 +1,108 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import django
+import mysql.connector
+
+# Ensure the project root directory is in the Python path
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+# Explicitly specify the Django settings module
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "final_project.settings")
+
+# Initialize the Django application environment
+django.setup()
+
+from django.conf import settings
+from config.db_config import get_mysql_db_config
+from utils.problem_schema import ensure_problem_schema
+from utils.sql_sandbox import run_problem_setup, sandbox_schema
+
+# This script compares two ways of provisioning a populated grading sandbox:
+# - replay: CREATE SCHEMA, then execute the (compiled) problem.sql from Python
+# - clone:  CREATE SCHEMA, then CREATE TABLE ... LIKE + INSERT ... SELECT from the
+#           problem's golden template schema (built once, not timed per sandbox)
+
+# Usage:
+#   python scripts/benchmark_sandbox_provisioning.py [iterations]
+
+# Assumptions:
+# - The MySQL account from get_mysql_db_config() may create and drop schemas.
+# - Problems are read from a temporary copy of `problems/`, extended with a synthetic
+#   problem 999 whose Orders table holds 100,000 rows.
+
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+SYNTHETIC_PROBLEM_ID = 999
+SYNTHETIC_ROWS = 100_000
+
+PROBLEMS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "problems")
+
+
+def write_synthetic_problem(base_dir):
+    # One single-row INSERT per order, the way bundled problems are written
+    rng = random.Random(42)
+    lines = [
+        "DROP TABLE IF EXISTS Orders;",
+        "CREATE TABLE Orders (order_id INT PRIMARY KEY, customer_id INT, "
+        "amount DECIMAL(10, 2), order_date DATE, note VARCHAR(64));",
+    ]
+    for order_id in range(1, SYNTHETIC_ROWS + 1):
+        lines.append(
+            "insert into Orders (order_id, customer_id, amount, order_date, note) values "
+            f"({order_id}, {rng.randint(1, 5000)}, {rng.randint(100, 99999) / 100:.2f}, "
+            f"'2024-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}', 'order #{order_id}');"
+        )
+    folder = os.path.join(base_dir, "problems", str(SYNTHETIC_PROBLEM_ID).zfill(3))
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "problem.sql"), "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+
+def time_provisioning(problem_id, template_schema):
+    db_config = get_mysql_db_config()
+    replay, clone = [], []
+    for _ in range(ITERATIONS):
+        start = time.perf_counter()
+        with sandbox_schema(db_config) as (conn, cursor, _):
+            run_problem_setup(cursor, problem_id)
+            conn.commit()
+        replay.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with sandbox_schema(db_config, template_schema=template_schema) as (conn, cursor, _):
+            conn.commit()
+        clone.append(time.perf_counter() - start)
+    return sorted(replay)[len(replay) // 2], sorted(clone)[len(clone) // 2]
+
+
+base_dir = tempfile.mkdtemp(prefix="sandbox_bench_")
+synthetic_schema = None
+try:
+    shutil.copytree(PROBLEMS_DIR, os.path.join(base_dir, "problems"))
+    write_synthetic_problem(base_dir)
+    settings.BASE_DIR = base_dir
+
+    problem_ids = sorted(int(name) for name in os.listdir(os.path.join(base_dir, "problems")) if name.isdigit())
+    print(f"median of {ITERATIONS} runs, milliseconds")
+    print(f"{'problem':<8} {'template':>9} {'replay':>9} {'clone':>9} {'speedup':>8}")
+    for problem_id in problem_ids:
+        start = time.perf_counter()
+        template_schema = ensure_problem_schema(problem_id)
+        build = time.perf_counter() - start
+        if problem_id == SYNTHETIC_PROBLEM_ID:
+            synthetic_schema = template_schema
+        replay, clone = time_provisioning(problem_id, template_schema)
+        print(
+            f"{problem_id:<8} {build * 1000:>9.1f} {replay * 1000:>9.1f} "
+            f"{clone * 1000:>9.1f} {replay / clone:>7.1f}x"
+        )
+finally:
+    shutil.rmtree(base_dir, ignore_errors=True)
+    # The synthetic problem's template is not a real problem; don't leave it behind
+    if synthetic_schema:
+        conn = mysql.connector.connect(**get_mysql_db_config())
+        conn.cursor().execute(f"DROP SCHEMA IF EXISTS `{synthetic_schema}`")
+        conn.close()
@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+
+# This script compares the synchronous (WSGI) and asyncio (ASGI) submit paths under load.
+
+# Usage:
+#   1. Start both servers with the same number of worker processes, e.g. 4:
+#        gunicorn final_project.wsgi -w 4 -b 127.0.0.1:8001
+#        gunicorn final_project.asgi -k uvicorn.workers.UvicornWorker -w 4 -b 127.0.0.1:8002
+#   2. Get an access token (POST /api/auth/login/) for a test account.
+#   3. python scripts/compare_submit_load.py --token <jwt> --problem 1 \
+#          --query "SELECT product_id FROM Products WHERE low_fats = 'Y' AND recyclable = 'Y'" \
+#          --wsgi http://127.0.0.1:8001 --asgi http://127.0.0.1:8002 \
+#          --requests 400 --concurrency 200
+
+# Notes:
+# - The WSGI server is hit on /api/problems/<id>/attempt/, the ASGI server on
+#   /api/problems/<id>/attempt/async/; both grade and record an Attempt.
+# - By default every request wraps --query in a distinct always-true filter, so the
+#   verdict cache cannot answer it and each submission is graded in a sandbox
+#   (--query must then be a single SELECT). Pass --no-cache-bust to measure cache hits.
+# - Both servers must use the same database and settings; only the serving path differs.
+# - Run it against a staging database: every request records an Attempt.
+
+
+def build_query(query, i, cache_bust):
+    if not cache_bust:
+        return query
+    # A distinct, always-true predicate per request defeats the verdict cache
+    return f"SELECT * FROM ({query}) AS load_{i} WHERE {i} = {i}"
+
+
+async def run_load(base_url, path, token, problem_id, query, total, concurrency, cache_bust):
+    url = f"{base_url.rstrip('/')}{path.format(problem_id=problem_id)}"
+    headers = {"Authorization": f"Bearer {token}"}
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], {}
+
+    async def one(session, i):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                async with session.post(url, json={"user_query": build_query(query, i, cache_bust)}, headers=headers) as resp:
+                    await resp.read()
+                    statuses[resp.status] = statuses.get(resp.status, 0) + 1
+            except aiohttp.ClientError as e:
+                statuses[type(e).__name__] = statuses.get(type(e).__name__, 0) + 1
+            latencies.append(time.perf_counter() - start)
+
+    timeout = aiohttp.ClientTimeout(total=300)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(session, i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "throughput": total / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p95": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "max": latencies[-1] * 1000,
+        "statuses": statuses,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare WSGI and ASGI submit throughput and latency.")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--problem", type=int, default=1)
+    parser.add_argument("--query", required=True)
+    parser.add_argument("--wsgi", default="http://127.0.0.1:8001")
+    parser.add_argument("--asgi", default="http://127.0.0.1:8002")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--no-cache-bust", dest="cache_bust", action="store_false")
+    args = parser.parse_args()
+
+    targets = [
+        ("wsgi", args.wsgi, "/api/problems/{problem_id}/attempt/"),
+        ("asgi", args.asgi, "/api/problems/{problem_id}/attempt/async/"),
+    ]
+    print(f"{args.requests} submissions, {args.concurrency} concurrent")
+    print(f"{'path':<6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}  statuses")
+    for name, base_url, path in targets:
+        stats = await run_load(base_url, path, args.token, args.problem, args.query,
+                               args.requests, args.concurrency, args.cache_bust)
+        print(f"{name:<6} {stats['throughput']:>8.1f} {stats['p50']:>9.1f} {stats['p95']:>9.1f} "
+              f"{stats['max']:>9.1f}  {stats['statuses']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
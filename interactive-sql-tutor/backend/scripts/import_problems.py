@@ -16,6 +16,7 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "final_project.settings")
 django.setup()
 
 from config.db_config import get_mysql_db_config
+from utils.problem_bundle import BUNDLE_FILE, ProblemBundle, pack_problem_bundle, read_problem_folder
 print("DJANGO_SETTINGS_MODULE:", os.environ.get('DJANGO_SETTINGS_MODULE'))
 
 # This script imports SQL problem metadata into the database by reading JSON files 
@@ -24,17 +25,45 @@ print("DJANGO_SETTINGS_MODULE:", os.environ.get('DJANGO_SETTINGS_MODULE'))
 # Purpose:
 # - Insert or update SQLProblem records based on metadata.json files.
 # - Delete and reinsert associated hints from the same metadata file.
+# - With --pack, also pack each problem folder into `problem.bundle` (utils/problem_bundle.py):
+#   all files, the compiled setup statements and, when the grading sandbox is reachable,
+#   the expected results, in one file the loader reads with a single read.
+
+# Usage:
+#   python scripts/import_problems.py
+#   python scripts/import_problems.py --pack
 
 # Assumptions:
 # - Each subfolder in `problems/` represents one problem (e.g., 001/, 002/).
-# - Each folder contains a `metadata.json` file with the problem's info and hints.
+# - Each folder contains a `metadata.json` file with the problem's info and hints, or a
+#   `problem.bundle` holding it (a packed folder may contain only the bundle).
 # - The MySQL database contains tables: SQLProblem and Hint.
 # - `ON DUPLICATE KEY UPDATE` is used to ensure idempotent imports.
 
 # Folder containing problem definitions
 PROBLEMS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "problems")
+PACK = "--pack" in sys.argv[1:]
 db_config = get_mysql_db_config()
 
+
+def pack_problem_folder(folder_path, problem_id):
+    # Expected results need the grading sandbox; without it the bundle is packed
+    # without them and they are computed on first use
+    from utils.expected_output import cached_expected_results
+    from utils.problem_loader import list_problem_datasets
+    from utils.sql_sandbox import warm_expected_result
+
+    try:
+        warm_expected_result(problem_id)
+        expected_results = cached_expected_results(problem_id, list_problem_datasets(problem_id))
+    except Exception as e:
+        print(f"Packing problem {problem_id} without expected results: {e}")
+        expected_results = None
+    tmp_path = os.path.join(folder_path, f".{BUNDLE_FILE}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(pack_problem_bundle(read_problem_folder(folder_path), expected_results))
+    os.replace(tmp_path, os.path.join(folder_path, BUNDLE_FILE))
+
 # Connect to the database
 conn = mysql.connector.connect(**db_config)
 cursor = conn.cursor()
@@ -43,44 +72,53 @@ cursor = conn.cursor()
 for problem_folder in sorted(os.listdir(PROBLEMS_DIR)):
     folder_path = os.path.join(PROBLEMS_DIR, problem_folder)
     metadata_path = os.path.join(folder_path, "metadata.json")
+    bundle_path = os.path.join(folder_path, BUNDLE_FILE)
 
+    data = None
     if os.path.isfile(metadata_path):
         with open(metadata_path, "r", encoding="utf-8") as f:
             data = json.load(f)
+        if PACK:
+            pack_problem_folder(folder_path, data["problem_id"])
+    elif os.path.isfile(bundle_path):
+        metadata = ProblemBundle.open(bundle_path).file("metadata.json")
+        if metadata is not None:
+            data = json.loads(metadata.content)
+
+    if data is not None:
+        ## Insert or update the SQLProblem record
+        insert_sqlproblem = """
+            INSERT INTO SQLProblem (problem_id, title, description, difficulty_level, topic_id)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                title = VALUES(title),
+                description = VALUES(description),
+                difficulty_level = VALUES(difficulty_level),
+                topic_id = VALUES(topic_id)
+        """
+        cursor.execute(insert_sqlproblem, (
+            data["problem_id"],
+            data["title"],
+            data["description"],
+            data["difficulty_level"],
+            data["topic_id"]
+        ))
 
-            ## Insert or update the SQLProblem record
-            insert_sqlproblem = """
-                INSERT INTO SQLProblem (problem_id, title, description, difficulty_level, topic_id)
-                VALUES (%s, %s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE
-                    title = VALUES(title),
-                    description = VALUES(description),
-                    difficulty_level = VALUES(difficulty_level),
-                    topic_id = VALUES(topic_id)
-            """
-            cursor.execute(insert_sqlproblem, (
+        # Clear old hints for this problem
+        delete_hints = "DELETE FROM Hint WHERE problem_id = %s"
+        cursor.execute(delete_hints, (data["problem_id"],))
+        # Insert new hints (ordered)
+        insert_hint = """
+            INSERT INTO Hint (problem_id, hint_text, hint_order)
+            VALUES (%s, %s, %s)
+        """
+        for i, hint in enumerate(data.get("hints", []), start=1):
+            cursor.execute(insert_hint, (
                 data["problem_id"],
-                data["title"],
-                data["description"],
-                data["difficulty_level"],
-                data["topic_id"]
+                hint,
+                i
             ))
 
-            # Clear old hints for this problem
-            delete_hints = "DELETE FROM Hint WHERE problem_id = %s"
-            cursor.execute(delete_hints, (data["problem_id"],))
-            # Insert new hints (ordered)
-            insert_hint = """
-                INSERT INTO Hint (problem_id, hint_text, hint_order)
-                VALUES (%s, %s, %s)
-            """
-            for i, hint in enumerate(data.get("hints", []), start=1):
-                cursor.execute(insert_hint, (
-                    data["problem_id"],
-                    hint,
-                    i
-                ))
-
 # Commit changes and close the connection
 conn.commit()
 cursor.close()
@@ -0,0 +1,31 @@
+import os
+import sys
+import django
+
+# Ensure the project root directory is in the Python path
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+# Explicitly specify the Django settings module
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "final_project.settings")
+
+# Initialize the Django application environment
+django.setup()
+
+from utils.problem_catalog import CATALOG_OBJECT, rebuild_problem_catalog
+from utils.problem_storage import get_problem_storage
+
+# This script rebuilds the problem catalog (problems/catalog.json) from a full listing
+# of problem storage. Run it once to catalog problems uploaded before the catalog
+# existed, and after editing problem files in the bucket directly.
+
+# Usage:
+#   python scripts/rebuild_problem_catalog.py
+
+# Notes:
+# - Every problem file is downloaded to hash it; the upload endpoint keeps the
+#   catalog up to date on its own.
+# - Uncataloged problems still load (by per-file generation checks), just without
+#   the catalog's savings.
+
+count = rebuild_problem_catalog()
+print(f"Cataloged {count} problems in {get_problem_storage().location}/{CATALOG_OBJECT}")
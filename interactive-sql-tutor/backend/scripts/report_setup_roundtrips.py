@@ -0,0 +1,46 @@
+import os
+import sys
+import django
+
+# Ensure the project root directory is in the Python path
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+# Explicitly specify the Django settings module
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "final_project.settings")
+
+# Initialize the Django application environment
+django.setup()
+
+from utils.setup_compiler import compile_setup_script
+
+# This script reports how many MySQL round trips it takes to load each problem's
+# dataset into a sandbox, before and after setup-script compilation.
+
+# Purpose:
+# - "before": one cursor.execute per `;`-separated chunk of problem.sql (the old naive split).
+# - "after": one cursor.execute per statement of the compiled script
+#   (tokenizer split, consecutive INSERTs merged into multi-row INSERTs).
+# - No database connection is needed.
+
+# Folder containing problem definitions
+PROBLEMS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "problems")
+
+print(f"{'problem':<8} {'before':>7} {'after':>6}")
+total_before = total_after = 0
+
+# Iterate through each problem folder (e.g., "001", "002", etc.)
+for problem_folder in sorted(os.listdir(PROBLEMS_DIR)):
+    setup_path = os.path.join(PROBLEMS_DIR, problem_folder, "problem.sql")
+    if not os.path.isfile(setup_path):
+        continue
+
+    with open(setup_path, "r", encoding="utf-8") as f:
+        sql = f.read()
+
+    before = len([stmt for stmt in sql.split(";") if stmt.strip()])
+    after = compile_setup_script(sql).round_trips
+    total_before += before
+    total_after += after
+    print(f"{problem_folder:<8} {before:>7} {after:>6}")
+
+print(f"{'total':<8} {total_before:>7} {total_after:>6}")
@@ -0,0 +1,41 @@
+import os
+import sys
+import django
+
+# Ensure the project root directory is in the Python path
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+# Explicitly specify the Django settings module
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "final_project.settings")
+
+# Initialize the Django application environment
+django.setup()
+
+from django.conf import settings
+from utils.grader_service import GraderService
+
+# This script launches the grader service: a pool of processes that run submissions
+# in MySQL sandboxes on behalf of the web workers.
+
+# Usage:
+#   GRADER_SERVICE_SOCKET=/run/sql-tutor/grader.sock python scripts/run_grader_service.py [processes]
+#   GRADER_SERVICE_SOCKET=/run/sql-tutor/grader.sock gunicorn final_project.wsgi ...
+
+# Notes:
+# - The web processes and this script must share GRADER_SERVICE_SOCKET and
+#   GRADER_SERVICE_AUTHKEY (or SECRET_KEY), and run on the same host.
+# - Scale grading capacity with the process count, independently of gunicorn workers.
+#   Each grader process grades one submission at a time.
+# - SIGTERM/SIGINT stop all grader processes and remove the socket.
+
+if not settings.GRADER_SERVICE_SOCKET:
+    sys.exit("GRADER_SERVICE_SOCKET is not set.")
+
+PROCESSES = int(sys.argv[1]) if len(sys.argv) > 1 else settings.GRADER_SERVICE_PROCESSES
+
+print(f"Grader service: {PROCESSES} processes on {settings.GRADER_SERVICE_SOCKET}")
+GraderService(
+    settings.GRADER_SERVICE_SOCKET,
+    processes=PROCESSES,
+    max_requests=settings.GRADER_SERVICE_MAX_REQUESTS,
+).serve_forever()
@@ -0,0 +1,43 @@
+import os
+import signal
+import sys
+import threading
+import django
+
+# Ensure the project root directory is in the Python path
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+# Explicitly specify the Django settings module
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "final_project.settings")
+
+# Initialize the Django application environment
+django.setup()
+
+from django.conf import settings
+from utils.grading_queue import GradingWorkerPool
+
+# This script runs grading workers outside the web processes.
+
+# Usage:
+#   GRADING_QUEUE_ENABLED=True GRADING_QUEUE_IN_PROCESS_WORKERS=False gunicorn ...   (web)
+#   python scripts/run_grading_workers.py [workers]                                  (workers)
+
+# Notes:
+# - Workers claim jobs from the GradingJob table (see dbDDL.sql), so any number of these
+#   processes, on any host, can share one queue.
+# - On SIGTERM/SIGINT, workers finish their current job and exit; a job interrupted
+#   harder than that is requeued after GRADING_JOB_TIMEOUT_SECONDS.
+
+WORKERS = int(sys.argv[1]) if len(sys.argv) > 1 else settings.GRADING_QUEUE_WORKERS
+
+stop = threading.Event()
+signal.signal(signal.SIGTERM, lambda *_: stop.set())
+signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+pool = GradingWorkerPool(WORKERS, settings.GRADING_QUEUE_POLL_SECONDS)
+pool.start()
+print(f"Grading workers started: {WORKERS}")
+while not stop.wait(1):
+    pass
+pool.stop()
+print("Grading workers stopped")
@@ -0,0 +1,34 @@
+import os
+import sys
+import django
+
+# Ensure the project root directory is in the Python path
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+# Explicitly specify the Django settings module
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "final_project.settings")
+
+# Initialize the Django application environment
+django.setup()
+
+from django.conf import settings
+from utils.problem_mirror import ProblemMirror
+from utils.problem_storage import get_problem_storage
+
+# This script fills the local problem mirror once, e.g. when a host or container is
+# provisioned, so the first requests of the web and grader processes read from disk.
+
+# Usage:
+#   PROBLEM_MIRROR_DIR=/var/cache/sql-tutor python scripts/sync_problem_mirror.py
+
+# Notes:
+# - The processes keep the mirror in sync on their own (PROBLEM_MIRROR_SYNC_SECONDS);
+#   this is only needed to avoid a cold start.
+
+if not settings.PROBLEM_MIRROR_DIR:
+    sys.exit("PROBLEM_MIRROR_DIR is not set")
+
+mirror = ProblemMirror(settings.PROBLEM_MIRROR_DIR, get_problem_storage(), settings.PROBLEM_MIRROR_SYNC_SECONDS)
+result = mirror.sync()
+print(f"Problem mirror synced: {result['downloaded']} downloaded, {result['deleted']} deleted, "
+      f"{mirror.stats()['objects']} objects in {settings.PROBLEM_MIRROR_DIR}")
@@ -0,0 +1,159 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponseNotAllowed, JsonResponse
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .models import SQLProblem
+from .serializers import AttemptSerializer, SQLQuerySerializer
+from .views import InstructorQueryAPIView
+from utils import async_sandbox
+from utils.grading import GradingResult
+from utils.grading_queue import enqueue_grading_job
+from utils.grading_timings import grading_timer, record_grading_timings, server_timing_header
+from utils.result_limits import ResultLimitExceeded
+from utils.verdict_cache import acached_check_user_query
+
+# Asyncio variants of the submit and instructor query endpoints, for deployments
+# served by an ASGI server (final_project/asgi.py), e.g.:
+#   gunicorn final_project.asgi -k uvicorn.workers.UvicornWorker -w 4
+# They accept the same requests and return the same payloads as their synchronous
+# counterparts in views.py, but MySQL round trips are awaited (aiomysql, see
+# utils/async_sandbox.py) instead of holding a worker thread each.
+
+
+async def _authenticate(request):
+    """
+    Authenticates the request with the same JWT scheme as the DRF views.
+
+    Returns:
+        User or None if the request is not (validly) authenticated.
+    """
+    try:
+        auth = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed:
+        return None
+    return auth[0] if auth else None
+
+
+def _json_body(request):
+    try:
+        return json.loads(request.body or b"{}")
+    except ValueError:
+        return None
+
+
+async def attempt_submit_async(request, problem_id):
+    """
+    Asyncio variant of `AttemptSubmitView`.
+
+    Endpoint: POST /api/problems/<problem_id>/attempt/async/
+
+    Request body, responses and permissions are the same as `AttemptSubmitView`
+    (including the 202 job response when GRADING_QUEUE_ENABLED is set). Grading goes
+    through `acached_check_user_query`, so the event loop keeps serving other
+    requests while this submission's sandbox round trips are in flight. Stage timings
+    go to the latency histograms and the `Server-Timing` header, as in `GradingPipeline`.
+    """
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    user = await _authenticate(request)
+    if user is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided."},
+                            status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        problem = await SQLProblem.objects.aget(problem_id=problem_id)
+    except SQLProblem.DoesNotExist:
+        return JsonResponse({"error": "Problem not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    body = _json_body(request)
+    if body is None:
+        return JsonResponse({"error": "Invalid JSON body."}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = AttemptSerializer(data=body, partial=True)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    data = serializer.validated_data
+    user_query = data.get("user_query")
+    hints_used = data.get("hints_used", 0)
+    time_taken = data.get("time_taken", None)
+
+    if settings.GRADING_QUEUE_ENABLED:
+        job = await sync_to_async(enqueue_grading_job)(user, problem, user_query, hints_used, time_taken)
+        return JsonResponse({
+            "job_id": job.job_id,
+            "status": job.status,
+            "status_url": reverse("grading_job_status", args=[job.job_id]),
+        }, status=status.HTTP_202_ACCEPTED)
+
+    with grading_timer() as timer:
+        check = await acached_check_user_query(problem_id, user_query)
+    timings = timer.as_dict()
+    record_grading_timings(problem_id, timings)
+    result = GradingResult(check.verdict, check.message, timings)
+
+    await sync_to_async(serializer.save)(
+        user=user,
+        problem=problem,
+        grading_result=result,
+        hints_used=hints_used,
+        time_taken=time_taken,
+    )
+    response = JsonResponse(result.as_response(), status=status.HTTP_200_OK)
+    if settings.GRADING_SERVER_TIMING:
+        response["Server-Timing"] = server_timing_header(timings)
+    return response
+
+
+async def instructor_query_async(request):
+    """
+    Asyncio variant of `InstructorQueryAPIView` (same validation, caps and responses).
+
+    Endpoint: POST /api/instructor/query-sql/async/
+    """
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    user = await _authenticate(request)
+    if user is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided."},
+                            status=status.HTTP_401_UNAUTHORIZED)
+    if getattr(user, "role", None) not in ["Admin", "Instructor"]:
+        return JsonResponse({"detail": "You do not have permission to perform this action."},
+                            status=status.HTTP_403_FORBIDDEN)
+
+    body = _json_body(request)
+    serializer = SQLQuerySerializer(data=body if body is not None else {})
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+
+    query = serializer.validated_data["query"]
+    view = InstructorQueryAPIView()
+    if not view.is_safe_query(query):
+        return JsonResponse({"error": "Only safe SELECT queries are allowed."}, status=400)
+    if not view.are_selected_columns_allowed(query, view.ALLOWED_COLUMNS):
+        return JsonResponse({"error": "Some columns are not allowed."}, status=403)
+
+    try:
+        if async_sandbox.aiomysql is not None:
+            columns, rows = await async_sandbox.async_run_readonly_query(query)
+        else:
+            columns, rows = await sync_to_async(view.run_query)(query)
+        return JsonResponse({"columns": columns, "rows": rows}, status=200)
+    except ResultLimitExceeded as e:
+        return JsonResponse(
+            {"error": str(e), "limit": e.limit, "rows_transferred": e.rows_transferred},
+            status=400,
+        )
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+
+# Django 4.2's csrf_exempt decorator is not async-aware; these are token-authenticated
+# APIs, exempt from CSRF like the DRF views.
+attempt_submit_async.csrf_exempt = True
+instructor_query_async.csrf_exempt = True
@@ -176,4 +176,109 @@ class Attempt(models.Model):
         ]
 
     def __str__(self):
-        return f"Attempt {self.attempt_id} - User {self.user_id} - Problem {self.problem_id}"
\ No newline at end of file
+        return f"Attempt {self.attempt_id} - User {self.user_id} - Problem {self.problem_id}"
+
+class GradingJob(models.Model):
+    """
+    A submission waiting to be graded, or already graded, by the grading workers.
+
+    When the grading queue is enabled (GRADING_QUEUE_ENABLED), `AttemptSubmitView`
+    stores the submission here and returns the job id immediately; a worker from
+    `utils.grading_queue` claims the job, grades it and records the Attempt.
+    Because the queue is a table, queued jobs survive a restart of the web or
+    worker processes.
+
+    Fields:
+        job_id (AutoField): Primary key, returned to the client for polling.
+        user (ForeignKey): The user who submitted the query.
+        problem (ForeignKey): The problem being attempted.
+        user_query (TextField): The submitted SQL.
+        hints_used (IntegerField): Hints used, copied to the Attempt.
+        time_taken (IntegerField): Optional. Time taken in seconds, copied to the Attempt.
+        status (CharField): One of:
+            - 'queued': Waiting for a worker.
+            - 'running': Claimed by `worker_id` at `started_at`.
+            - 'done': Graded; `verdict`, `feedback`, `score` and `attempt` are set.
+            - 'failed': Grading raised an unexpected error `max_tries` times.
+        verdict (CharField): 'correct', 'wrong', 'time_limit_exceeded' or 'output_limit_exceeded'.
+        feedback (TextField): Message returned by the checker.
+        score (DecimalField): Score of the recorded Attempt.
+        attempt (ForeignKey): The Attempt recorded for this job.
+        worker_id (CharField): Worker that claimed the job last.
+        tries (IntegerField): Number of times the job was claimed.
+        created_at / started_at / finished_at (DateTimeField): Queue timestamps;
+            `started_at - created_at` is the time the job waited in the queue.
+
+    Meta:
+        db_table: Maps the model to the "GradingJob" table in the database.
+        managed: False to indicate Django won't create or manage this table.
+        indexes: (status, job_id) so workers find the oldest queued job quickly.
+
+    Example:
+        GradingJob(user=some_user, problem=some_problem, user_query="SELECT ...")
+    """
+    job_id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(User, db_column='user_id', on_delete=models.CASCADE)
+    problem = models.ForeignKey(SQLProblem, db_column='problem_id', on_delete=models.CASCADE)
+    user_query = models.TextField()
+    hints_used = models.IntegerField(default=0)
+    time_taken = models.IntegerField(null=True, blank=True, help_text="Time taken in seconds")
+    status = models.CharField(
+        max_length=10,
+        choices=[
+            ('queued', 'queued'),
+            ('running', 'running'),
+            ('done', 'done'),
+            ('failed', 'failed'),
+        ],
+        default='queued'
+    )
+    verdict = models.CharField(max_length=32, null=True, blank=True)
+    feedback = models.TextField(default='', blank=True)
+    score = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    attempt = models.ForeignKey(Attempt, db_column='attempt_id', null=True, blank=True, on_delete=models.SET_NULL)
+    worker_id = models.CharField(max_length=64, null=True, blank=True)
+    tries = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'GradingJob'
+        managed = False
+        indexes = [
+            models.Index(fields=['status', 'job_id'], name='idx_gradingjob_status')
+        ]
+
+    def __str__(self):
+        return f"GradingJob {self.job_id} - {self.status}"
+
+class ProblemIdSequence(models.Model):
+    """
+    Counter that new problem IDs are allocated from (see
+    `utils.problem_catalog.allocate_problem_id`).
+
+    The upload endpoint locks the row (SELECT ... FOR UPDATE) and increments it, so
+    concurrent uploads always get distinct IDs, without listing problem storage.
+    The row is created on the first upload, seeded from the problems that already exist.
+
+    Fields:
+        name (CharField): Primary key; the sequence name ("problem").
+        next_id (IntegerField): The ID the next upload receives.
+
+    Meta:
+        db_table: Maps the model to the "ProblemIdSequence" table in the database.
+        managed: False to indicate Django won't create or manage this table.
+
+    Example:
+        ProblemIdSequence.objects.get(name="problem").next_id   # e.g. 43
+    """
+    name = models.CharField(max_length=32, primary_key=True)
+    next_id = models.IntegerField()
+
+    class Meta:
+        db_table = 'ProblemIdSequence'
+        managed = False
+
+    def __str__(self):
+        return f"{self.name}: next {self.next_id}"
@@ -3,7 +3,8 @@ from .models import SQLProblem, Topic, Hint, Attempt
 from users.models import User
 from django.conf import settings
 import os, glob, json
-from utils.sql_sandbox import run_problem_setup, get_solution_output, sandbox_schema, check_user_query
+from utils.sql_sandbox import run_problem_setup, get_solution_output, sandbox_schema
+from utils.grading import GradingPipeline
 from config.db_config import get_mysql_db_config
 import traceback
 import re
@@ -133,6 +134,8 @@ class SQLProblemDetailSerializer(serializers.ModelSerializer):
 
     Notes:
     - Table schema and order requirement are loaded from a `metadata.json` file in the problem's folder.
+    - `metadata.json` is loaded once per problem per serializer (i.e. per request) and shared by
+      every field that reads it (see `get_metadata`).
     - The expected output is dynamically generated by running the provided DDL and solution SQL in a temporary schema.
     - All helper methods handle exceptions gracefully.
 
@@ -169,10 +172,18 @@ class SQLProblemDetailSerializer(serializers.ModelSerializer):
         # Retrieve hint texts ordered by hint_order
         return list(Hint.objects.filter(problem_id=obj.problem_id).order_by('hint_order').values_list('hint_text', flat=True))
 
+    def get_metadata(self, obj):
+        # Parsed metadata.json, loaded once per problem for all fields of this serializer
+        if not hasattr(self, "_metadata"):
+            self._metadata = {}
+        if obj.problem_id not in self._metadata:
+            self._metadata[obj.problem_id] = load_problem_file(obj.problem_id, "metadata.json", parse_json=True)
+        return self._metadata[obj.problem_id]
+
     def get_tables(self, obj):
         # Load table schema definitions from metadata.json
         try:
-            metadata = load_problem_file(obj.problem_id, "metadata.json", parse_json=True)
+            metadata = self.get_metadata(obj)
             return metadata.get("tables", [])
         except Exception as e:
             return [{"error": str(e)}]
@@ -180,7 +191,7 @@ class SQLProblemDetailSerializer(serializers.ModelSerializer):
     def get_requires_order(self, obj):
         # Check whether the problem requires row order in output
         try:
-            metadata = load_problem_file(obj.problem_id, "metadata.json", parse_json=True)
+            metadata = self.get_metadata(obj)
             return metadata.get("requires_order", False)
         except Exception:
             return False
@@ -188,7 +199,7 @@ class SQLProblemDetailSerializer(serializers.ModelSerializer):
     def get_expected_output(self, obj):
         # Load expected_output from metadata.json
         try:
-            metadata = load_problem_file(obj.problem_id, "metadata.json", parse_json=True)
+            metadata = self.get_metadata(obj)
             return metadata.get("expected_output", [])
         except Exception:
             return {"error": traceback.format_exc()}
@@ -203,7 +214,7 @@ class SQLProblemDetailSerializer(serializers.ModelSerializer):
     
     def get_input_data(self, obj):
         try:
-            metadata = load_problem_file(obj.problem_id, "metadata.json", parse_json=True)
+            metadata = self.get_metadata(obj)
             return metadata.get("input_data", [])
         except Exception:
             return []
@@ -214,7 +225,9 @@ class AttemptSerializer(serializers.ModelSerializer):
 
     Features:
     - Accepts a user-submitted SQL query via the `user_query` field (write-only).
-    - Uses `check_user_query()` to validate the SQL logic and compute correctness.
+    - Accepts a precomputed `grading_result` (a `GradingResult`) via `save()`, so a
+      submission already graded by the view is not executed a second time.
+      Falls back to `GradingPipeline` when no result is supplied.
     - Automatically calculates score and status based on validation result.
     - Saves the attempt data to the database.
     - Stores additional feedback (e.g., diff message) in `self.context['check_result']`.
@@ -269,24 +282,24 @@ class AttemptSerializer(serializers.ModelSerializer):
         hints_used = validated_data.get('hints_used', 0)
         time_taken = validated_data.get('time_taken', None)
 
-        is_correct, message = check_user_query(problem.problem_id, user_query)
-
-        # Check the user's query and determine result
-        score = 100.0 if is_correct else 0.0
-        status = 'Completed' if is_correct else 'Failed'
+        # Reuse the verdict when the caller already graded the query;
+        # only grade here when the serializer is used on its own.
+        result = validated_data.pop('grading_result', None)
+        if result is None:
+            result = GradingPipeline(problem.problem_id, user_query).run()
 
         # Create and save the Attempt record
         attempt = Attempt.objects.create(
             user=user,
             problem=problem,
-            score=score,
-            status=status,
+            score=result.score,
+            status=result.status,
             hints_used=hints_used,
             time_taken=time_taken,
         )
 
         # Store the check result (e.g., diff message) in serializer context
-        self.context['check_result'] = message
+        self.context['check_result'] = result.feedback
         return attempt
 
 class AttemptHistorySerializer(serializers.ModelSerializer):
@@ -442,4 +455,50 @@ class SQLQuerySerializer(serializers.Serializer):
           that logic is handled separately in the view.
         - Designed to support future expansion (e.g. optional 'limit', 'table', etc.)
     """
-    query = serializers.CharField(required=True, max_length=5000)
\ No newline at end of file
+    query = serializers.CharField(required=True, max_length=5000)
+
+
+class BatchGradeItemSerializer(serializers.Serializer):
+    """
+    One submission of a batch grading request.
+
+    Fields:
+        user_query (str): The SQL to grade.
+        user_id (int, optional): The student it belongs to; a new Attempt is recorded
+            for them when the batch is saved.
+        attempt_id (int, optional): An existing Attempt of the same problem whose
+            score and status are overwritten when the batch is saved (regrade).
+    """
+    user_query = serializers.CharField(max_length=20000, trim_whitespace=False)
+    user_id = serializers.IntegerField(required=False)
+    attempt_id = serializers.IntegerField(required=False)
+
+
+class BatchGradeSerializer(serializers.Serializer):
+    """
+    Serializer for instructor batch grading requests (see `InstructorBatchGradeView`).
+
+    Fields:
+        items (list): Submissions to grade (`BatchGradeItemSerializer`), at most
+            BATCH_GRADING_MAX_ITEMS. Required unless `regrade_jobs` is set.
+        regrade_jobs (bool): Grade every finished queued submission of the problem
+            again (the GradingJob table keeps their SQL) instead of `items`.
+        save (bool): Record the verdicts: create Attempts for items with a `user_id`,
+            update the Attempt of items with an `attempt_id`.
+        use_cache (bool): Read and write the verdict cache (default True).
+    """
+    items = BatchGradeItemSerializer(many=True, required=False)
+    regrade_jobs = serializers.BooleanField(default=False)
+    save = serializers.BooleanField(default=False)
+    use_cache = serializers.BooleanField(default=True)
+
+    def validate(self, data):
+        items = data.get("items")
+        if data["regrade_jobs"] == (items is not None):
+            raise serializers.ValidationError("Provide either 'items' or 'regrade_jobs', not both.")
+        if items is not None:
+            if len(items) > settings.BATCH_GRADING_MAX_ITEMS:
+                raise serializers.ValidationError(f"At most {settings.BATCH_GRADING_MAX_ITEMS} items per batch.")
+            if data["save"] and any("user_id" not in item and "attempt_id" not in item for item in items):
+                raise serializers.ValidationError("Every item needs a 'user_id' or an 'attempt_id' when saving.")
+        return data
@@ -1,3 +1,1288 @@
-from django.test import TestCase
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import types
+from contextlib import contextmanager
+from decimal import Decimal
+from multiprocessing.connection import Listener
+from unittest import mock
 
-# Create your tests here.
+import mysql.connector
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, APISimpleTestCase, force_authenticate
+
+from config.db_config import get_sandbox_readonly_db_config
+from sql_app.models import Attempt, SQLProblem
+from sql_app.async_views import attempt_submit_async
+from sql_app.views import AttemptSubmitView
+from utils import (
+    async_sandbox, duckdb_engine, expected_output, grader_service, grading_queue, problem_loader, problem_schema,
+    sqlite_engine, verdict_cache,
+)
+from utils.batch_grading import grade_batch
+from utils.grading import GradingPipeline
+from utils.grading_timings import grading_latency_stats, reset_grading_latency_stats
+from utils.gcs_uploader import upload_problem_to_gcs
+from utils.problem_bundle import BUNDLE_FILE, ProblemBundle, pack_problem_bundle
+from utils.problem_catalog import catalog_file, record_problem
+from utils.problem_mirror import ProblemMirror
+from utils.problem_storage import LocalProblemStorage, StorageConflict
+from utils.expected_output import ExpectedResult
+from utils.query_watchdog import QueryWatchdog
+from utils.result_compare import MISMATCH_TOO_MANY_ROWS, compare_cursor_to_expected
+from utils.result_limits import LIMIT_BYTES, LIMIT_ROWS, BoundedFetch, ResultLimitExceeded
+from utils.result_fingerprint import canonicalize_result
+from utils.sandbox_hosts import SandboxHost, SandboxHostRouter, SandboxHostsUnavailable
+from utils.sandbox_pool import PooledSandbox, SandboxPool
+from utils.setup_compiler import compile_setup_script, get_compiled_setup
+from utils.sql_sandbox import QueryCheckResult, check_user_query, grade_in_sandbox, sandbox_schema
+
+PROBLEM_FILES = {
+    "metadata.json": {
+        "problem_id": 1,
+        "requires_order": False,
+        "tables": [{"table_name": "Products", "columns": []}],
+    },
+    "problem.sql": (
+        "CREATE TABLE Products (product_id INT, low_fats TEXT, recyclable TEXT);"
+        "INSERT INTO Products VALUES (0, 'Y', 'N');"
+        "INSERT INTO Products VALUES (1, 'Y', 'Y');"
+        "INSERT INTO Products VALUES (3, 'Y', 'Y');"
+    ),
+    "solution.sql": "SELECT product_id FROM Products WHERE low_fats = 'Y' AND recyclable = 'Y'",
+}
+
+
+def write_problem_files(base_dir, problem_id, files):
+    """
+    Writes a problem folder under `<base_dir>/problems/` the way the repo lays it out.
+    """
+    folder = os.path.join(base_dir, "problems", str(problem_id).zfill(3))
+    for filename, content in files.items():
+        os.makedirs(os.path.dirname(os.path.join(folder, filename)), exist_ok=True)
+        with open(os.path.join(folder, filename), "w", encoding="utf-8") as f:
+            f.write(json.dumps(content) if filename.endswith(".json") else content)
+
+
+class SandboxConnection:
+    """
+    SQLite connection with the `is_connected()` of a MySQL connection.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def is_connected(self):
+        return True
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class CountingSandbox:
+    """
+    Stand-in for `sandbox_schema` that counts how many sandboxes are created
+    and hands out an in-memory SQLite connection instead of a MySQL schema.
+    """
+
+    def __init__(self):
+        self.created = 0
+
+    @contextmanager
+    def __call__(self, db_config, time_limit_ms=None):
+        self.created += 1
+        conn = sqlite3.connect(":memory:")
+        cursor = conn.cursor()
+        try:
+            yield SandboxConnection(conn), cursor, f"sandbox_{self.created}"
+        finally:
+            cursor.close()
+            conn.close()
+
+
+class AsyncSQLiteCursor:
+    """
+    aiomysql-like cursor on the connection's SQLite database. Schema statements
+    (CREATE/USE/DROP SCHEMA, SET SESSION) manage that database instead of running.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._cursor = None
+
+    @property
+    def description(self):
+        return self._cursor.description if self._cursor is not None else None
+
+    async def execute(self, sql, args=None):
+        keyword = sql.split(None, 2)[:2]
+        if keyword == ["CREATE", "SCHEMA"]:
+            self.conn.pool.sandbox.created += 1
+            self.conn.db = sqlite3.connect(":memory:")
+        elif keyword == ["DROP", "SCHEMA"]:
+            self.conn.db.close()
+        elif keyword[0] not in ("USE", "SET"):
+            self._cursor = self.conn.db.execute(sql)
+
+    async def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    async def close(self):
+        pass
+
+    def __await__(self):
+        yield from []
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class AsyncSQLiteConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.db = None
+        self.closed = False
+
+    def cursor(self, cursor_class=None):
+        return AsyncSQLiteCursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+class CountingAsyncPool:
+    """
+    Stand-in for the aiomysql pool of `get_async_pool`: every connection gets its own
+    in-memory SQLite database, and CREATE SCHEMA counts on `sandbox` like `CountingSandbox`.
+    """
+
+    def __init__(self, sandbox):
+        self.sandbox = sandbox
+        self.in_use = 0
+
+    async def acquire(self):
+        self.in_use += 1
+        return AsyncSQLiteConnection(self)
+
+    def release(self, conn):
+        self.in_use -= 1
+
+
+class AttemptSubmitSandboxCountTest(APISimpleTestCase):
+    views_module = "sql_app.views"
+
+    def setUp(self):
+        self.sandbox = CountingSandbox()
+        self.factory = APIRequestFactory()
+        self.user = mock.MagicMock(is_authenticated=True)
+        self.problem = mock.MagicMock(spec=SQLProblem, problem_id=1)
+
+        base_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(base_dir.cleanup)
+        write_problem_files(base_dir.name, 1, PROBLEM_FILES)
+
+        settings_override = override_settings(BASE_DIR=base_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        patches = [
+            mock.patch("utils.sql_sandbox.sandbox_schema", self.sandbox),
+            mock.patch("utils.sql_sandbox.get_mysql_db_config", return_value={}),
+            mock.patch.object(SQLProblem.objects, "get", return_value=self.problem),
+            mock.patch.object(Attempt.objects, "create"),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        expected_output._cache.clear()
+        verdict_cache._cache.clear()
+
+    def submit(self, user_query):
+        request = self.factory.post("/api/problems/1/attempt/", {"user_query": user_query}, format="json")
+        force_authenticate(request, user=self.user)
+        return AttemptSubmitView.as_view()(request, problem_id=1)
+
+    def test_correct_submission_creates_one_sandbox(self):
+        response = self.submit("SELECT product_id FROM Products WHERE recyclable = 'Y'")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["result"], "correct")
+        self.assertEqual(self.sandbox.created, 1)
+
+        saved = Attempt.objects.create.call_args.kwargs
+        self.assertEqual(saved["score"], 100.0)
+        self.assertEqual(saved["status"], "Completed")
+
+    def test_submission_identical_to_the_solution_is_correct(self):
+        # Result columns are named after the text as written (count(*), not COUNT(*))
+        solution = "SELECT count(*) FROM Products WHERE low_fats = 'Y'"
+        write_problem_files(settings.BASE_DIR, 1, {"solution.sql": solution})
+        response = self.submit(solution)
+        self.assertEqual(response.data["result"], "correct")
+
+        response = self.submit("SELECT COUNT(*) FROM Products WHERE low_fats = 'Y'")
+        self.assertEqual(response.data["result"], "wrong")
+        self.assertEqual(self.sandbox.created, 2)
+
+    def test_wrong_submission_creates_one_sandbox(self):
+        response = self.submit("SELECT product_id FROM Products")
+        self.assertEqual(response.data["result"], "wrong")
+        self.assertEqual(response.data["score"], 0)
+        self.assertEqual(self.sandbox.created, 1)
+        self.assertEqual(Attempt.objects.create.call_args.kwargs["status"], "Failed")
+
+    def test_malformed_metadata_is_reported_not_raised(self):
+        with open(os.path.join(settings.BASE_DIR, "problems", "001", "metadata.json"), "w") as f:
+            f.write("{not json")
+        response = self.submit("SELECT product_id FROM Products")
+        self.assertEqual(response.data["result"], "wrong")
+        self.assertIn("could not load problem 1", response.data["feedback"])
+        self.assertEqual(self.sandbox.created, 0)
+
+        result = check_user_query(1, "SELECT product_id FROM Products")
+        self.assertIn("could not load problem 1", result.message)
+        self.assertFalse(result.cacheable)
+
+    def test_solution_runs_once_per_problem_version(self):
+        with mock.patch("utils.expected_output.compute_expected_result",
+                        wraps=expected_output.compute_expected_result) as compute:
+            self.submit("SELECT product_id FROM Products WHERE recyclable = 'Y'")
+            response = self.submit("SELECT product_id FROM Products WHERE low_fats = 'Y' AND recyclable = 'Y'")
+
+        self.assertEqual(response.data["result"], "correct")
+        self.assertEqual(compute.call_count, 1)
+        self.assertEqual(self.sandbox.created, 2)
+
+    def test_equivalent_resubmission_is_served_from_verdict_cache(self):
+        self.submit("SELECT p.product_id FROM Products p WHERE p.recyclable = 'Y'")
+        response = self.submit("select  q.product_id  -- same answer\nfrom Products AS q where q.recyclable='Y'")
+
+        self.assertEqual(response.data["result"], "correct")
+        self.assertEqual(self.sandbox.created, 1)
+        self.assertEqual(Attempt.objects.create.call_count, 2)
+
+        # Column aliases are graded, so they are not normalized away
+        response = self.submit("SELECT p.product_id AS id FROM Products p WHERE p.recyclable = 'Y'")
+        self.assertEqual(response.data["result"], "wrong")
+        self.assertEqual(self.sandbox.created, 2)
+
+    def test_precheck_rejects_before_provisioning_a_sandbox(self):
+        for query, error in [
+            ("SELEC product_id FROM Products", "Syntax error"),
+            ("DELETE FROM Products", "forbidden SQL operation"),
+            ("SELECT product_id FROM Product", "Unknown table(s) referenced: Product."),
+        ]:
+            response = self.submit(query)
+            self.assertEqual(response.data["result"], "wrong")
+            self.assertIn(error, response.data["feedback"])
+        self.assertEqual(self.sandbox.created, 0)
+
+        # Keywords inside identifiers are no longer mistaken for forbidden operations
+        response = self.submit(
+            "WITH updated AS (SELECT product_id FROM Products WHERE recyclable = 'Y') SELECT product_id FROM updated"
+        )
+        self.assertEqual(response.data["result"], "correct")
+
+    def test_query_sqlglot_cannot_parse_is_left_to_mysql(self):
+        for query, error in [
+            ("SELECT product_id MOD 2 FROM Products; DELETE FROM Products", "DELETE is not allowed"),
+            ("SELECT product_id MOD 2 INTO @x FROM Products", "INTO is not allowed"),
+            ("SELEC product_id MOD 2 FROM Products", "Syntax error"),
+        ]:
+            self.assertIn(error, check_user_query(1, query).message)
+        self.assertEqual(self.sandbox.created, 0)
+
+        result = check_user_query(1, "SELECT product_id FROM Products WHERE product_id MOD 2 = 1")
+        self.assertEqual(self.sandbox.created, 1)
+        self.assertFalse(result.cacheable)
+
+    @override_settings(GRADING_QUEUE_ENABLED=True)
+    def test_queued_submission_returns_job_id_without_grading(self):
+        job = mock.MagicMock(job_id=7, status="queued")
+        with mock.patch(f"{self.views_module}.enqueue_grading_job", return_value=job) as enqueue:
+            response = self.submit("SELECT product_id FROM Products")
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data, {"job_id": 7, "status": "queued", "status_url": "/api/grading-jobs/7/"})
+        enqueue.assert_called_once_with(self.user, self.problem, "SELECT product_id FROM Products", 0, None)
+        self.assertEqual(self.sandbox.created, 0)
+        Attempt.objects.create.assert_not_called()
+
+
+class AsyncSubmitTest(AttemptSubmitSandboxCountTest):
+    def setUp(self):
+        super().setUp()
+        self.async_pool = CountingAsyncPool(self.sandbox)
+        fake_aiomysql = types.SimpleNamespace(SSCursor=None, Error=sqlite3.Error)
+        for patcher in [
+            mock.patch("utils.async_sandbox.aiomysql", fake_aiomysql),
+            mock.patch("utils.async_sandbox.get_async_pool", mock.AsyncMock(return_value=self.async_pool)),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def submit(self, user_query):
+        request = APIRequestFactory().post("/api/problems/1/attempt/async/", {"user_query": user_query}, format="json")
+        with mock.patch("sql_app.async_views._authenticate", mock.AsyncMock(return_value=self.user)), \
+                mock.patch.object(SQLProblem.objects, "aget", mock.AsyncMock(return_value=self.problem)):
+            response = async_to_sync(attempt_submit_async)(request, problem_id=1)
+        response.data = json.loads(response.content)
+        return response
+
+    views_module = "sql_app.async_views"
+
+    def test_solution_runs_once_per_problem_version(self):
+        with mock.patch("utils.async_sandbox._compute_expected_result",
+                        wraps=async_sandbox._compute_expected_result) as compute:
+            self.submit("SELECT product_id FROM Products WHERE recyclable = 'Y'")
+            response = self.submit("SELECT product_id FROM Products WHERE low_fats = 'Y' AND recyclable = 'Y'")
+
+        self.assertEqual(response.data["result"], "correct")
+        self.assertEqual(compute.call_count, 1)
+        self.assertEqual(self.sandbox.created, 2)
+
+    def test_sandbox_is_driven_without_a_worker_thread(self):
+        with mock.patch("utils.async_sandbox.check_user_query") as blocking:
+            response = self.submit("SELECT product_id FROM Products WHERE low_fats = 'Y' AND recyclable = 'Y'")
+
+        self.assertEqual(response.data["result"], "correct")
+        blocking.assert_not_called()
+        self.assertEqual(self.sandbox.created, 1)
+        self.assertEqual(self.async_pool.in_use, 0)
+
+
+class AsyncSubmitThreadFallbackTest(AttemptSubmitSandboxCountTest):
+    submit = AsyncSubmitTest.submit
+    views_module = "sql_app.async_views"
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("utils.async_sandbox.aiomysql", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_blocking_grader_runs_in_a_worker_thread(self):
+        with mock.patch("utils.async_sandbox.check_user_query", wraps=check_user_query) as blocking:
+            response = self.submit("SELECT product_id FROM Products WHERE low_fats = 'Y' AND recyclable = 'Y'")
+
+        self.assertEqual(response.data["result"], "correct")
+        blocking.assert_called_once()
+
+
+class HiddenDatasetTest(APISimpleTestCase):
+    setUp = AttemptSubmitSandboxCountTest.setUp
+
+    def add_hidden_dataset(self):
+        write_problem_files(settings.BASE_DIR, 1, {"tests/edge_cases.sql": (
+            "CREATE TABLE Products (product_id INT, low_fats TEXT, recyclable TEXT);"
+            "INSERT INTO Products VALUES (1, 'N', 'Y');"
+            "INSERT INTO Products VALUES (5, 'Y', 'Y');"
+        )})
+
+    def test_query_overfitting_sample_data_fails_on_hidden_dataset(self):
+        self.add_hidden_dataset()
+        result = check_user_query(1, "SELECT product_id FROM Products WHERE product_id IN (1, 3)")
+
+        self.assertEqual(result.verdict, "wrong")
+        self.assertIn("hidden dataset 'edge_cases'", result.message)
+        self.assertEqual([d["dataset"] for d in result.datasets], ["sample", "edge_cases"])
+        self.assertEqual(self.sandbox.created, 2)
+
+    def test_correct_query_passes_every_dataset(self):
+        self.add_hidden_dataset()
+        result = check_user_query(1, "SELECT product_id FROM Products WHERE low_fats = 'Y' AND recyclable = 'Y'")
+
+        self.assertEqual(result.verdict, "correct")
+        self.assertEqual([d["verdict"] for d in result.datasets], ["correct", "correct"])
+        self.assertTrue(all(d["total_ms"] is not None for d in result.datasets))
+
+
+class GradingTimingsTest(APISimpleTestCase):
+    def setUp(self):
+        AttemptSubmitSandboxCountTest.setUp(self)
+        reset_grading_latency_stats()
+        self.addCleanup(reset_grading_latency_stats)
+
+    submit = AttemptSubmitSandboxCountTest.submit
+
+    def test_stages_reach_header_and_histograms(self):
+        response = self.submit("SELECT product_id FROM Products WHERE recyclable = 'Y'")
+        stages = [entry.split(";")[0] for entry in response["Server-Timing"].split(", ")]
+        self.assertEqual(stages, ["precheck", "setup", "solution", "query", "compare", "total"])
+
+        # Verdict cache hit: no sandbox stages
+        response = self.submit("select product_id from Products where recyclable = 'Y'")
+        self.assertEqual([e.split(";")[0] for e in response["Server-Timing"].split(", ")], ["precheck", "total"])
+
+        stats = grading_latency_stats(1)[1]
+        self.assertEqual(stats["total"]["count"], 2)
+        self.assertEqual(stats["setup"]["count"], 1)
+        self.assertEqual(sum(stats["total"]["buckets"].values()), 2)
+
+
+class BatchGradingTest(APISimpleTestCase):
+    setUp = AttemptSubmitSandboxCountTest.setUp
+
+    def test_batch_shares_one_sandbox(self):
+        correct = "SELECT product_id FROM Products WHERE recyclable = 'Y'"
+        duplicate = "select product_id\n  from Products where recyclable = 'Y'"
+        queries = [correct, "SELECT product_id FROM Products", "DELETE FROM Products", duplicate]
+        with mock.patch("utils.batch_grading.grade_in_sandbox", wraps=grade_in_sandbox) as graded:
+            results = list(grade_batch(1, queries, use_cache=False))
+
+        self.assertEqual([index for index, _ in results], [0, 1, 2, 3])
+        self.assertEqual([r.verdict for _, r in results], ["correct", "wrong", "wrong", "correct"])
+        self.assertIn("only SELECT", results[2][1].message)
+        self.assertEqual(graded.call_count, 2)   # rejected and duplicate queries never reach MySQL
+        self.assertEqual(self.sandbox.created, 1)
+
+    def test_executes_the_prechecked_statements(self):
+        # MySQL does not read "--'" as a comment, so splitting the raw text would run the DELETE
+        injected = "SELECT 1 --''; DELETE FROM Products; SELECT product_id FROM Products"
+        commented = "SELECT product_id FROM Products -- a;b\nWHERE recyclable = 'Y'"
+        with mock.patch("utils.batch_grading.grade_in_sandbox", wraps=grade_in_sandbox) as graded:
+            results = list(grade_batch(1, [injected, "SELECT 1 /*! ; DELETE FROM Products */", commented],
+                                       use_cache=False))
+
+        self.assertEqual([r.verdict for _, r in results], ["wrong", "wrong", "correct"])
+        self.assertIn("Ambiguous comment", results[0][1].message)
+        self.assertEqual(graded.call_count, 1)
+        # The statement text runs as written, split at the real terminator only
+        self.assertEqual(graded.call_args.args[2], [commented])
+
+
+class GradingWorkerPoolTest(APISimpleTestCase):
+    def test_grades_every_job_with_bounded_concurrency(self):
+        jobs = list(range(12))
+        jobs_lock = threading.Lock()
+        running = {"now": 0, "max": 0, "done": 0}
+
+        def claim(worker_id):
+            with jobs_lock:
+                return jobs.pop(0) if jobs else None
+
+        def run(job):
+            with jobs_lock:
+                running["now"] += 1
+                running["max"] = max(running["max"], running["now"])
+            time.sleep(0.02)
+            with jobs_lock:
+                running["now"] -= 1
+                running["done"] += 1
+
+        pool = grading_queue.GradingWorkerPool(workers=3, poll_interval=0.01)
+        with mock.patch("utils.grading_queue.claim_next_job", claim), \
+                mock.patch("utils.grading_queue.run_grading_job", run), \
+                mock.patch("utils.grading_queue.requeue_stale_jobs"):
+            pool.start()
+            deadline = time.monotonic() + 5
+            while running["done"] < 12 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            pool.stop(timeout=1)
+
+        self.assertEqual(running["done"], 12)
+        self.assertEqual(running["max"], 3)
+
+
+class GraderServiceTest(APISimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.socket_path = os.path.join(tmp.name, "grader.sock")
+
+    @override_settings(GRADER_SERVICE_AUTHKEY="test-key")
+    def test_submission_is_graded_by_the_service(self):
+        listener = Listener(self.socket_path, family="AF_UNIX", authkey=b"test-key")
+        self.addCleanup(listener.close)
+        server = threading.Thread(target=grader_service.serve_requests, args=(listener, 1), daemon=True)
+
+        graded = QueryCheckResult(False, "Output limit exceeded", "output_limit_exceeded", 10001, cacheable=True)
+        with mock.patch("utils.grader_service.cached_check_user_query", return_value=graded) as check, \
+                override_settings(GRADER_SERVICE_SOCKET=self.socket_path):
+            server.start()
+            result = GradingPipeline(1, "SELECT * FROM Products").run()
+            server.join(timeout=5)
+
+        check.assert_called_once_with(1, "SELECT * FROM Products")
+        self.assertEqual((result.verdict, result.feedback), ("output_limit_exceeded", "Output limit exceeded"))
+
+    def test_unreachable_service_falls_back_to_local_grading(self):
+        local = QueryCheckResult(True, "")
+        with mock.patch("utils.grading.cached_check_user_query", return_value=local) as check, \
+                override_settings(GRADER_SERVICE_SOCKET=self.socket_path):
+            self.assertEqual(GradingPipeline(1, "SELECT 1").run().verdict, "correct")
+            check.assert_called_once()
+
+            with override_settings(GRADER_SERVICE_FALLBACK_LOCAL=False):
+                with self.assertRaises(grader_service.GraderServiceUnavailable):
+                    GradingPipeline(1, "SELECT 1").run()
+
+    def test_exiting_grader_process_closes_its_sandbox_pool(self):
+        pool = mock.Mock()
+        with mock.patch("utils.sandbox_pool._pool", pool), \
+                mock.patch("utils.grader_service.connections") as connections:
+            grader_service._close_grader_process()
+        pool.close.assert_called_once_with()
+        connections.close_all.assert_called_once_with()
+
+
+class VerdictCacheSingleFlightTest(APISimpleTestCase):
+    def setUp(self):
+        verdict_cache._cache.clear()
+        self.addCleanup(verdict_cache._cache.clear)
+        for patcher in [
+            mock.patch("utils.verdict_cache.get_problem_content_hash", return_value="v1"),
+            mock.patch("utils.sql_sandbox.load_problem_metadata", return_value={}),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_concurrent_identical_submissions_run_once(self):
+        release = threading.Event()
+        calls = []
+
+        def slow_check(problem_id, user_query, precheck=None):
+            calls.append(user_query)
+            release.wait(5)
+            return QueryCheckResult(True, "", cacheable=True)
+
+        results = []
+        with mock.patch("utils.verdict_cache.check_user_query", side_effect=slow_check):
+            threads = [
+                threading.Thread(target=lambda: results.append(
+                    verdict_cache.cached_check_user_query(1, "SELECT name FROM Employee e")))
+                for _ in range(5)
+            ]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.2)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r.verdict for r in results], ["correct"] * 5)
+
+    def test_key_and_executed_sql_agree(self):
+        executed = []
+
+        def check(problem_id, user_query, precheck=None):
+            executed.append(precheck.executable)
+            return QueryCheckResult(True, "", cacheable=True)
+
+        with mock.patch("utils.verdict_cache.check_user_query", side_effect=check):
+            verdict_cache.cached_check_user_query(1, "SELECT name FROM Employee -- a;b\nWHERE id = 1")
+            verdict_cache.cached_check_user_query(1, "SELECT name FROM Employee WHERE id = 1")
+
+        self.assertEqual(executed, [["SELECT name FROM Employee -- a;b\nWHERE id = 1"]])
+
+        # MySQL names computed columns after their text, so these are graded separately
+        self.assertNotEqual(verdict_cache.canonical_query("SELECT count(*) FROM Employee"),
+                            verdict_cache.canonical_query("SELECT COUNT(*) FROM Employee"))
+        self.assertEqual(verdict_cache.canonical_query("SELECT COUNT(*) AS n FROM Employee e"),
+                         verdict_cache.canonical_query("select count(*) as n from Employee AS x"))
+
+
+class SQLiteEngineTest(APISimpleTestCase):
+    def setUp(self):
+        self.sandbox = CountingSandbox()
+        self.base_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.base_dir.cleanup)
+        self.write_problem()
+
+        settings_override = override_settings(BASE_DIR=self.base_dir.name, GRADING_ENGINE="sqlite")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        for patcher in [
+            mock.patch("utils.sql_sandbox.sandbox_schema", self.sandbox),
+            mock.patch("utils.sql_sandbox.get_mysql_db_config", return_value={}),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        expected_output._cache.clear()
+        sqlite_engine._problems.clear()
+
+    def write_problem(self, **metadata):
+        files = dict(PROBLEM_FILES)
+        files["metadata.json"] = {
+            **PROBLEM_FILES["metadata.json"],
+            "expected_output": [["product_id"], [1], [3]],
+            **metadata,
+        }
+        write_problem_files(self.base_dir.name, 1, files)
+
+    def test_correct_answer_is_graded_without_mysql(self):
+        result = check_user_query(1, "SELECT product_id FROM Products WHERE recyclable = 'y'")
+        self.assertEqual(result.verdict, "correct")
+        self.assertEqual(result.engine, "sqlite")
+        self.assertFalse(result.cacheable)   # never confirmed on MySQL
+        self.assertEqual(self.sandbox.created, 0)
+
+    def test_falls_back_to_mysql(self):
+        # Wrong on SQLite: confirmed on MySQL
+        result = check_user_query(1, "SELECT product_id FROM Products")
+        self.assertEqual((result.verdict, result.engine), ("wrong", "mysql"))
+        self.assertEqual(self.sandbox.created, 1)
+
+        # Not transpilable losslessly
+        result = check_user_query(1, "SELECT GROUP_CONCAT(product_id ORDER BY product_id) AS product_id FROM Products")
+        self.assertEqual(result.engine, "mysql")
+        self.assertEqual(self.sandbox.created, 2)
+
+        # Accepted by SQLite only: MySQL rejects columns outside GROUP BY (ONLY_FULL_GROUP_BY)
+        result = check_user_query(1, "SELECT product_id FROM Products WHERE recyclable = 'Y' GROUP BY recyclable, low_fats")
+        self.assertEqual(result.engine, "mysql")
+        self.assertEqual(self.sandbox.created, 3)
+
+        # Problem opts out
+        self.write_problem(engine="mysql")
+        result = check_user_query(1, "SELECT product_id FROM Products WHERE recyclable = 'Y'")
+        self.assertEqual((result.verdict, result.engine), ("correct", "mysql"))
+        self.assertEqual(self.sandbox.created, 4)
+
+
+class DuckDBEngineTest(APISimpleTestCase):
+    def setUp(self):
+        self.sandbox = CountingSandbox()
+        self.base_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.base_dir.cleanup)
+
+        settings_override = override_settings(BASE_DIR=self.base_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        for patcher in [
+            mock.patch("utils.sql_sandbox.sandbox_schema", self.sandbox),
+            mock.patch("utils.sql_sandbox.get_mysql_db_config", return_value={}),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        expected_output._cache.clear()
+        duckdb_engine._problems.clear()
+
+    def write_problem(self, **metadata):
+        files = dict(PROBLEM_FILES)
+        files["metadata.json"] = {**PROBLEM_FILES["metadata.json"], "engine": "duckdb", **metadata}
+        write_problem_files(self.base_dir.name, 1, files)
+
+    def test_window_query_is_graded_without_mysql(self):
+        query = (
+            "SELECT product_id FROM (SELECT product_id, ROW_NUMBER() OVER (ORDER BY product_id) AS rn "
+            "FROM Products WHERE recyclable = 'y') ranked"
+        )
+        # Loaded from problem.sql, then from typed metadata input_data
+        for metadata in [{}, {
+            "tables": [{"table_name": "Products", "columns": [
+                {"name": "product_id", "type": "int"},
+                {"name": "low_fats", "type": "ENUM('Y','N')"},
+                {"name": "recyclable", "type": "VARCHAR(1)"},
+            ]}],
+            "input_data": {"Products": [["product_id", "low_fats", "recyclable"], [0, "Y", "N"], [1, "Y", "Y"], [3, None, "Y"]]},
+        }]:
+            self.write_problem(**metadata)
+            with override_settings(DUCKDB_ENGINE_CONFIRM_ON_MYSQL=False):
+                result = check_user_query(1, query)
+            self.assertEqual((result.verdict, result.engine), ("correct" if not metadata else "wrong", "duckdb"))
+        self.assertEqual(self.sandbox.created, 0)
+
+        # "wrong" verdicts are confirmed on MySQL by default
+        result = check_user_query(1, query)
+        self.assertEqual(result.engine, "mysql")
+        self.assertEqual(self.sandbox.created, 1)
+
+        # Not transpilable to DuckDB: graded on MySQL, not reported as an error
+        result = check_user_query(1, "SELECT product_id FROM Products WHERE recyclable = 'Y' FOR UPDATE")
+        self.assertEqual(result.engine, "mysql")
+        self.assertEqual(self.sandbox.created, 2)
+
+    def test_queries_duckdb_rejects_are_left_to_mysql(self):
+        self.write_problem()
+        # MySQL casts implicitly where DuckDB raises a conversion error
+        result = check_user_query(1, "SELECT product_id FROM Products WHERE recyclable > 5")
+        self.assertEqual(result.engine, "mysql")
+        self.assertNotIn("Error in query execution", result.message)
+        self.assertEqual(self.sandbox.created, 1)
+
+    def test_submissions_cannot_read_host_files(self):
+        self.write_problem()
+        result = check_user_query(1, "SELECT * FROM read_text('/etc/hostname')")
+        self.assertIn("table function read_text is not allowed", result.message)
+
+        cursor = duckdb_engine.get_duckdb_problem(1).cursor()
+        self.addCleanup(cursor.close)
+        with self.assertRaises(duckdb_engine.duckdb.Error):
+            cursor.execute("SELECT * FROM read_text('/etc/hostname')")
+        with self.assertRaises(duckdb_engine.duckdb.Error):
+            cursor.execute("SET enable_external_access = true")
+
+
+class ProblemContentCacheTest(APISimpleTestCase):
+    def setUp(self):
+        base_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(base_dir.cleanup)
+        self.base_dir = base_dir.name
+        write_problem_files(self.base_dir, 1, PROBLEM_FILES)
+        self.metadata_path = os.path.join(self.base_dir, "problems", "001", "metadata.json")
+        os.utime(self.metadata_path, (time.time() - 60, time.time() - 60))
+
+        settings_override = override_settings(BASE_DIR=self.base_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        problem_loader._content_cache.clear()
+
+    def test_parsed_once_per_version_and_reloaded_on_change(self):
+        before = problem_loader.problem_content_cache_stats()
+        with mock.patch("utils.problem_loader.json.loads", wraps=json.loads) as parse:
+            first = problem_loader.load_problem_metadata(1)
+            self.assertIs(problem_loader.load_problem_metadata(1), first)
+            self.assertEqual(parse.call_count, 1)
+
+            write_problem_files(self.base_dir, 1, {"metadata.json": {**PROBLEM_FILES["metadata.json"], "requires_order": True}})
+            os.utime(self.metadata_path, (time.time() - 30, time.time() - 30))
+            self.assertTrue(problem_loader.load_problem_metadata(1)["requires_order"])
+
+        stats = problem_loader.problem_content_cache_stats()
+        self.assertEqual(stats["hits"] - before["hits"], 2)
+        self.assertEqual(stats["stale"] - before["stale"], 1)
+
+    def test_recently_modified_file_is_not_cached(self):
+        write_problem_files(self.base_dir, 1, {"solution.sql": "SELECT 1"})
+        self.assertEqual(problem_loader.load_problem_file(1, "solution.sql"), "SELECT 1")
+        write_problem_files(self.base_dir, 1, {"solution.sql": "SELECT 2"})
+        self.assertEqual(problem_loader.load_problem_file(1, "solution.sql"), "SELECT 2")
+
+
+class ProblemMirrorTest(APISimpleTestCase):
+    def setUp(self):
+        dirs = [tempfile.TemporaryDirectory() for _ in range(3)]
+        for d in dirs:
+            self.addCleanup(d.cleanup)
+        self.bucket_dir, mirror_dir, base_dir = (d.name for d in dirs)
+        write_problem_files(self.bucket_dir, 42, PROBLEM_FILES)
+        self.storage = LocalProblemStorage(self.bucket_dir)
+        self.mirror = ProblemMirror(mirror_dir, self.storage, sync_interval=60)
+
+        settings_override = override_settings(BASE_DIR=base_dir, PROBLEM_MIRROR_DIR=mirror_dir,
+                                              PROBLEM_STORAGE="local", PROBLEM_STORAGE_DIR=self.bucket_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch("utils.problem_mirror._mirror", self.mirror)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        problem_loader._content_cache.clear()
+
+    def test_sync_downloads_only_changed_objects(self):
+        self.assertEqual(self.mirror.sync(), {"downloaded": 3, "deleted": 0})
+        self.assertEqual(self.mirror.sync(), {"downloaded": 0, "deleted": 0})
+
+        solution = os.path.join(self.bucket_dir, "problems", "042", "solution.sql")
+        write_problem_files(self.bucket_dir, 42, {"solution.sql": "SELECT 42"})
+        os.utime(solution, ns=(1, 1))
+        os.remove(os.path.join(self.bucket_dir, "problems", "042", "problem.sql"))
+        self.assertEqual(self.mirror.sync(), {"downloaded": 1, "deleted": 1})
+
+        # Reads come from the mirror; the manifest survives a restart
+        self.assertEqual(problem_loader.load_problem_file(42, "solution.sql"), "SELECT 42")
+        self.assertEqual(self.mirror.stats()["downloads"], 4)
+        self.assertEqual(ProblemMirror(self.mirror.root, self.storage, 60).stats()["objects"], 2)
+
+    def test_miss_is_fetched_from_the_bucket(self):
+        self.assertEqual(problem_loader.load_problem_metadata(42)["problem_id"], 1)
+        with self.assertRaises(FileNotFoundError):
+            problem_loader.load_problem_file(42, "tests/missing.sql")
+        # metadata.json, then tests/missing.sql and the problem.bundle it may be packed in
+        self.assertEqual(self.mirror.stats()["misses"], 3)
+        self.assertEqual(self.mirror.stats()["objects"], 1)
+
+    def test_generation_from_a_stale_catalog_is_served(self):
+        name = "problems/042/solution.sql"
+        g1 = self.storage.put(name, "SELECT 1")
+        g2 = self.storage.put(name, "SELECT 2")
+        self.mirror.sync()
+        # Synced past the catalog: the newer mirrored copy is current
+        self.assertEqual(self.mirror.get(name, g1), (g2, self.mirror.local_path(name)))
+
+        # The cataloged generation was overwritten before the mirror fetched it: the
+        # loader reads the current one
+        g3 = self.storage.put(name, "SELECT 3")
+        self.storage.put(name, "SELECT 4")
+        with mock.patch("utils.problem_loader.catalog_file", return_value={"generation": g3, "sha256": "stale"}):
+            self.assertEqual(problem_loader.load_problem_file(42, "solution.sql"), "SELECT 4")
+
+
+class LocalProblemStorageTest(APISimpleTestCase):
+    def test_uploaded_problem_is_loaded_from_storage(self):
+        dirs = [tempfile.TemporaryDirectory() for _ in range(2)]
+        for d in dirs:
+            self.addCleanup(d.cleanup)
+        base_dir, storage_dir = (d.name for d in dirs)
+        write_problem_files(base_dir, 1, PROBLEM_FILES)
+        problem_loader._content_cache.clear()
+
+        with override_settings(BASE_DIR=base_dir, PROBLEM_STORAGE="local", PROBLEM_STORAGE_DIR=storage_dir,
+                               PROBLEM_UPLOAD_FORMAT="folder"):
+            upload_problem_to_gcs(7, {"solution.sql": "SELECT 7", "tests/ties.sql": "SELECT 1"})
+            self.assertEqual(problem_loader.load_problem_file(7, "solution.sql"), "SELECT 7")
+            self.assertEqual(problem_loader.get_next_problem_id(), 8)
+            with self.assertRaises(FileNotFoundError):
+                problem_loader.load_problem_file(7, "problem.sql")
+
+        storage = LocalProblemStorage(storage_dir)
+        self.assertEqual([name for name, _ in storage.list("problems/007/")],
+                         ["problems/007/solution.sql", "problems/007/tests/ties.sql"])
+        self.assertEqual(storage.get("problems/007/tests/ties.sql", storage.generation("problems/007/tests/ties.sql")), "SELECT 1")
+
+
+class ProblemCatalogTest(APISimpleTestCase):
+    def setUp(self):
+        dirs = [tempfile.TemporaryDirectory() for _ in range(2)]
+        for d in dirs:
+            self.addCleanup(d.cleanup)
+        base_dir, self.storage_dir = (d.name for d in dirs)
+        problem_loader._content_cache.clear()
+        overrides = override_settings(BASE_DIR=base_dir, PROBLEM_STORAGE="local", PROBLEM_STORAGE_DIR=self.storage_dir,
+                                      PROBLEM_CATALOG_REVALIDATE_SECONDS=0, PROBLEM_UPLOAD_FORMAT="folder")
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_upload_records_files_and_versions_problem(self):
+        upload_problem_to_gcs(7, {"solution.sql": "SELECT 7", "problem.sql": "CREATE TABLE t (a INT);"})
+        upload_problem_to_gcs(8, {"solution.sql": "SELECT 8"})
+        entry = catalog_file(7, "solution.sql")
+        self.assertEqual(entry["size"], 8)
+        self.assertEqual(catalog_file(8, "solution.sql")["size"], 8)
+
+        files = ("problem.sql", "solution.sql")
+        before = problem_loader.get_problem_content_hash(7, files)
+        self.assertEqual(problem_loader.load_problem_file(7, "solution.sql"), "SELECT 7")
+
+        # A re-upload changes the catalog record, which versions the cached file and hash
+        upload_problem_to_gcs(7, {"solution.sql": "SELECT 70", "problem.sql": "CREATE TABLE t (a INT);"})
+        self.assertNotEqual(problem_loader.get_problem_content_hash(7, files), before)
+        self.assertEqual(problem_loader.load_problem_file(7, "solution.sql"), "SELECT 70")
+        self.assertEqual(problem_loader.problem_content_cache_stats()["stale"], 1)
+
+    def test_conditional_write_detects_concurrent_writer(self):
+        storage = LocalProblemStorage(self.storage_dir)
+        generation = storage.put("problems/catalog.json", "{}", if_generation_match=0)
+        self.assertNotEqual(storage.put("problems/catalog.json", "{}", if_generation_match=generation), generation)
+        with self.assertRaises(StorageConflict):
+            storage.put("problems/catalog.json", "{}", if_generation_match=generation)
+
+        # record_problem re-reads a catalog written by someone else before updating it
+        storage.put("problems/catalog.json", json.dumps({"format": 1, "problems": {"005": {"files": {}}}}))
+        record_problem(6, {})
+        self.assertEqual(sorted(json.loads(storage.get("problems/catalog.json"))["problems"]), ["005", "006"])
+
+
+class ProblemBundleTest(APISimpleTestCase):
+    FILES = {
+        "metadata.json": json.dumps({"problem_id": 9, "title": "Bundled"}),
+        "problem.sql": "CREATE TABLE t (a INT);\nINSERT INTO t VALUES (1);\nINSERT INTO t VALUES (2);\n",
+        "solution.sql": "SELECT a FROM t",
+        "tests/empty.sql": "CREATE TABLE t (a INT);\n",
+    }
+
+    def setUp(self):
+        dirs = [tempfile.TemporaryDirectory() for _ in range(2)]
+        for d in dirs:
+            self.addCleanup(d.cleanup)
+        self.base_dir, self.storage_dir = (d.name for d in dirs)
+        problem_loader._content_cache.clear()
+        overrides = override_settings(BASE_DIR=self.base_dir, PROBLEM_STORAGE="local", PROBLEM_STORAGE_DIR=self.storage_dir,
+                                      PROBLEM_CATALOG_REVALIDATE_SECONDS=0, PROBLEM_UPLOAD_FORMAT="bundle")
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_uploaded_bundle_is_read_once_per_problem(self):
+        expected = ExpectedResult(("a", "b", "c"), [(1, Decimal("2.5"), None), (2, b"\x00", "x")])
+        upload_problem_to_gcs(9, self.FILES, {"problem.sql": ("v1", expected)})
+        self.assertEqual(LocalProblemStorage(self.storage_dir).list("problems/009/"), [
+            ("problems/009/problem.bundle", catalog_file(9, BUNDLE_FILE)["generation"])])
+
+        with mock.patch.object(LocalProblemStorage, "get_bytes", wraps=LocalProblemStorage(self.storage_dir).get_bytes) as get_bytes:
+            self.assertEqual(problem_loader.load_problem_metadata(9)["title"], "Bundled")
+            self.assertEqual(problem_loader.load_problem_file(9, "solution.sql"), "SELECT a FROM t")
+            self.assertEqual(problem_loader.list_problem_datasets(9), ["problem.sql", "tests/empty.sql"])
+            with mock.patch("utils.setup_compiler.compile_setup_script") as compile_setup:
+                setup = get_compiled_setup(9)
+        self.assertEqual(get_bytes.call_count, 1)
+        compile_setup.assert_not_called()
+        self.assertEqual(setup.statements, ("CREATE TABLE t (a INT)", "INSERT INTO t VALUES (1), (2)"))
+
+        bundle = problem_loader.load_problem_bundle(9)
+        restored = bundle.expected_result("problem.sql", "v1")
+        self.assertEqual((restored.columns, restored.rows), (expected.columns, expected.rows))
+        self.assertIsNone(bundle.expected_result("problem.sql", "v2"))
+
+    def test_local_bundle_hashes_like_the_folder_layout(self):
+        write_problem_files(self.base_dir, 8, {**self.FILES, "metadata.json": json.loads(self.FILES["metadata.json"])})
+        folder_hash = problem_loader.get_problem_content_hash(8)
+
+        os.makedirs(os.path.join(self.base_dir, "problems", "009"))
+        with open(os.path.join(self.base_dir, "problems", "009", BUNDLE_FILE), "wb") as f:
+            f.write(pack_problem_bundle(self.FILES))
+        self.assertEqual(problem_loader.get_problem_content_hash(9), folder_hash)
+        self.assertIsInstance(problem_loader.load_problem_bundle(9), ProblemBundle)
+        self.assertIsNone(problem_loader.load_problem_bundle(8))
+        with self.assertRaises(FileNotFoundError):
+            problem_loader.load_problem_file(9, "tests/missing.sql")
+
+
+class SetupCompilerTest(APISimpleTestCase):
+    def test_merges_consecutive_inserts_and_respects_string_literals(self):
+        compiled = compile_setup_script(
+            "CREATE TABLE t (a INT, b TEXT);\n"
+            "insert into t (a, b) values (1, 'x;y');\n"
+            "insert  into t\n(a, b) values (2, 'z'), (3, NULL); -- trailing; comment\n"
+            "insert into t (a, b) values (4, 'w');\n"
+            "INSERT INTO t (a, b) SELECT a + 10, b FROM t;\n"
+            "insert into t (a, b) values (5, 'v') ON DUPLICATE KEY UPDATE b = 'v';\n",
+            max_batch_rows=3,
+        )
+
+        self.assertEqual(compiled.source_statements, 6)
+        self.assertEqual(compiled.statements, (
+            "CREATE TABLE t (a INT, b TEXT)",
+            "insert into t (a, b) VALUES (1, 'x;y'), (2, 'z'), (3, NULL)",
+            "insert into t (a, b) VALUES (4, 'w')",
+            "INSERT INTO t (a, b) SELECT a + 10, b FROM t",
+            "insert into t (a, b) values (5, 'v') ON DUPLICATE KEY UPDATE b = 'v'",
+        ))
+
+
+class FakeMySQLServer:
+    """
+    Just enough of a MySQL server for `utils.problem_schema`: schemas and their table
+    names, named locks that are always granted, and the information_schema lookups.
+    `connect` stands in for `mysql.connector.connect`; each connection is a MagicMock
+    recording the statements it ran in `executed`.
+    """
+
+    def __init__(self):
+        self.schemas = {}
+        self.connections = []
+
+    def connect(self, **config):
+        conn = mock.MagicMock(unread_result=False)
+        conn.config, conn.executed = config, []
+        cursor = conn.cursor.return_value
+        cursor.execute.side_effect = lambda sql, params=(): self._execute(conn, sql, params)
+        cursor.fetchone.side_effect = lambda: conn.rows[0]
+        cursor.fetchall.side_effect = lambda: conn.rows
+        self.connections.append(conn)
+        return conn
+
+    def _execute(self, conn, sql, params):
+        conn.executed.append(sql)
+        conn.rows = [(1,)]
+        name = sql.split("`")[1] if "`" in sql else None
+        if sql.startswith("CREATE SCHEMA"):
+            self.schemas[name] = []
+        elif sql.startswith("DROP SCHEMA"):
+            self.schemas.pop(name, None)
+        elif sql.startswith("USE"):
+            conn.schema = name
+        elif sql.startswith("CREATE TABLE"):
+            self.schemas[conn.schema].append(name or sql.split()[2])
+        elif "information_schema.TABLES" in sql:
+            conn.rows = [(int(params[1] in self.schemas.get(params[0], [])),)]
+        elif "information_schema.SCHEMATA" in sql:
+            prefix = params[0].replace("\\_", "_").rstrip("%")
+            conn.rows = [(schema,) for schema in self.schemas if schema.startswith(prefix)]
+
+
+class ProblemSchemaTest(APISimpleTestCase):
+    def setUp(self):
+        base_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(base_dir.cleanup)
+        write_problem_files(base_dir.name, 1, PROBLEM_FILES)
+        problem_loader._content_cache.clear()
+
+        settings_override = override_settings(BASE_DIR=base_dir.name, SANDBOX_READONLY_PASSWORD="reader-secret")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.server = FakeMySQLServer()
+        app_db = {"host": "db0", "port": 3306, "user": "app", "password": "app-secret", "database": "app"}
+        for patcher in [
+            mock.patch("utils.problem_schema.mysql.connector.connect", self.server.connect),
+            mock.patch("utils.problem_schema.get_mysql_db_config", side_effect=lambda: dict(app_db)),
+            mock.patch("config.db_config.get_mysql_db_config", side_effect=lambda: dict(app_db)),
+            mock.patch.dict(problem_schema._materialized, clear=True),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_schema_is_materialized_once_per_content_hash(self):
+        db_config = {"host": "db0", "port": 3306}
+        schema_name = problem_schema.ensure_problem_schema(1, db_config)
+        self.assertEqual(problem_schema.ensure_problem_schema(1, db_config), schema_name)
+        self.assertEqual(len(self.server.connections), 1)
+
+        # The ready marker is created last, once the dataset is fully loaded
+        self.assertEqual(self.server.schemas[schema_name], ["Products", problem_schema.READY_MARKER_TABLE])
+        build = self.server.connections[0].executed
+        marker = next(i for i, sql in enumerate(build) if problem_schema.READY_MARKER_TABLE in sql and "CREATE" in sql)
+        self.assertFalse(any(sql.startswith(("CREATE TABLE Products", "INSERT")) for sql in build[marker:]))
+
+        # Another process finds the marker and does not rebuild
+        problem_schema._materialized.clear()
+        problem_schema.ensure_problem_schema(1, db_config)
+        self.assertNotIn(f"CREATE SCHEMA `{schema_name}`", self.server.connections[1].executed)
+
+        # A new dataset version gets its own schema and replaces the old one
+        write_problem_files(settings.BASE_DIR, 1, {"problem.sql": "CREATE TABLE Products (product_id INT);"})
+        os.utime(os.path.join(settings.BASE_DIR, "problems", "001", "problem.sql"), ns=(1, 1))
+        new_name = problem_schema.ensure_problem_schema(1, db_config)
+        self.assertNotEqual(new_name, schema_name)
+        self.assertEqual(list(self.server.schemas), [new_name])
+
+    def test_readonly_session_uses_the_select_only_account(self):
+        with problem_schema.readonly_problem_schema(1) as (_, _, schema_name):
+            pass
+
+        conn = self.server.connections[-1]
+        self.assertEqual(conn.config, get_sandbox_readonly_db_config())
+        self.assertEqual((conn.config["user"], conn.config["password"]), ("sandbox_reader", "reader-secret"))
+        self.assertEqual(conn.executed[:2], [f"USE `{schema_name}`", "SET SESSION TRANSACTION READ ONLY"])
+        conn.close.assert_called_once()
+
+
+class CloneModeSandboxTest(APISimpleTestCase):
+    def test_sandbox_is_cloned_from_template_server_side(self):
+        conn = mock.MagicMock()
+        cursor = conn.cursor.return_value
+        cursor.fetchall.return_value = [("Products",)]
+        with mock.patch("utils.sql_sandbox.mysql.connector.connect", return_value=conn):
+            with sandbox_schema({}, template_schema="problem_data_001_abc") as (_, _, schema_name):
+                pass
+
+        executed = [c.args[0] for c in cursor.execute.call_args_list]
+        self.assertIn("CREATE TABLE `Products` LIKE `problem_data_001_abc`.`Products`", executed)
+        self.assertIn("INSERT INTO `Products` SELECT * FROM `problem_data_001_abc`.`Products`", executed)
+        self.assertEqual(executed[-1], f"DROP SCHEMA IF EXISTS `{schema_name}`")
+
+
+class SandboxHostRouterTest(APISimpleTestCase):
+    def make_router(self, *limits, **kwargs):
+        hosts = [SandboxHost(f"db{i}:3306", {"host": f"db{i}", "port": 3306}, limit) for i, limit in enumerate(limits)]
+        options = {"acquire_timeout": 0, "failure_threshold": 2, "eject_seconds": 0.05, "max_eject_seconds": 1}
+        return SandboxHostRouter(hosts, **{**options, **kwargs})
+
+    def test_routes_to_least_loaded_host_within_limits(self):
+        router = self.make_router(2, 1)
+        with router.acquire() as first, router.acquire() as second, router.acquire() as third:
+            self.assertEqual([first.name, second.name, third.name], ["db0:3306", "db1:3306", "db0:3306"])
+            with self.assertRaises(SandboxHostsUnavailable):
+                with router.acquire():
+                    pass
+        self.assertEqual([h["in_flight"] for h in router.stats()], [0, 0])
+
+    def test_ejects_failing_host_and_readmits_after_probe(self):
+        router = self.make_router(4)
+        with self.assertRaises(mysql.connector.ProgrammingError):
+            with router.acquire():
+                raise mysql.connector.ProgrammingError(msg="Unknown column", errno=1054)
+        for _ in range(2):
+            with self.assertRaises(mysql.connector.InterfaceError):
+                with router.acquire():
+                    raise mysql.connector.InterfaceError(msg="Lost connection", errno=2013)
+
+        self.assertTrue(router.stats()[0]["ejected"])
+        with self.assertRaises(SandboxHostsUnavailable):
+            with router.acquire():
+                pass
+
+        time.sleep(0.06)
+        with mock.patch.object(router, "_probe", return_value=True) as probe:
+            with router.acquire() as host:
+                self.assertEqual(host.name, "db0:3306")
+        probe.assert_called_once()
+        self.assertFalse(router.stats()[0]["ejected"])
+
+
+class InMemorySandboxPool(SandboxPool):
+    """
+    SandboxPool whose schemas are plain objects, so pool bookkeeping can be
+    tested without MySQL.
+    """
+
+    def _build(self, problem_id):
+        with self._lock:
+            self._counters["builds"] += 1
+        return PooledSandbox(problem_id, mock.MagicMock(), mock.MagicMock(), f"sandbox_pool_{problem_id}")
+
+    def _drop(self, sandbox):
+        self.dropped.append(sandbox)
+
+
+class SandboxPoolTest(APISimpleTestCase):
+    def setUp(self):
+        self.pool = InMemorySandboxPool(size_per_problem=2, max_problems=2, max_schemas=4, refill_workers=1)
+        self.pool.dropped = []
+        self.addCleanup(self.pool.close)
+
+        patcher = mock.patch("utils.sandbox_pool.get_problem_content_hash", return_value="v1")
+        self.content_hash = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def wait_for_refill(self):
+        for _ in range(100):
+            if self.pool.stats()["building_schemas"] == 0:
+                return
+            time.sleep(0.01)
+
+    def test_miss_then_hit_after_refill(self):
+        with self.pool.checkout(1):
+            pass
+        self.wait_for_refill()
+        with self.pool.checkout(1):
+            pass
+
+        stats = self.pool.stats()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 1)
+
+    def test_least_recently_used_problem_is_evicted(self):
+        for problem_id in (1, 2, 1, 3):
+            with self.pool.checkout(problem_id):
+                pass
+            self.wait_for_refill()
+
+        stats = self.pool.stats()
+        self.assertEqual(stats["hot_problems"], 2)
+        self.assertGreaterEqual(stats["evictions"], 1)
+        self.assertLessEqual(stats["ready_schemas"], 4)
+        self.assertNotIn((2, "v1"), self.pool._ready)
+
+    def test_schemas_of_an_edited_dataset_are_not_handed_out(self):
+        with self.pool.checkout(1):
+            pass
+        self.wait_for_refill()
+        stale = list(self.pool._ready[(1, "v1")])
+        self.assertEqual(len(stale), 2)
+
+        self.content_hash.return_value = "v2"
+        with self.pool.checkout(1):
+            pass
+        self.wait_for_refill()
+
+        self.assertEqual(self.pool.stats()["misses"], 2)
+        self.assertEqual(list(self.pool._ready), [(1, "v2")])
+        self.assertTrue(all(sandbox in self.pool.dropped for sandbox in stale))
+
+
+class StreamingComparatorTest(APISimpleTestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.addCleanup(self.conn.close)
+        self.conn.execute("CREATE TABLE t (id INT, name TEXT, score REAL)")
+        self.conn.executemany("INSERT INTO t VALUES (?, ?, ?)", [
+            (1, None, 2.5), (2, "b", None), (3, "c", 4.0), (4, None, None),
+        ])
+        cursor = self.conn.execute("SELECT id, name, score FROM t ORDER BY id")
+        columns = [col[0] for col in cursor.description]
+        self.expected = ExpectedResult(*canonicalize_result(columns, cursor.fetchall()))
+
+    def compare(self, sql, requires_order=False, batch_size=2):
+        cursor = self.conn.execute(sql)
+        return compare_cursor_to_expected(cursor, self.expected, requires_order, BoundedFetch(cursor, batch_size=batch_size))
+
+    def test_rows_mixing_null_compare_in_any_order(self):
+        # Column order differs too; columns are matched by name
+        matched, _ = self.compare("SELECT score, name, id FROM t ORDER BY id DESC")
+        self.assertTrue(matched)
+
+    def test_order_is_checked_when_required(self):
+        self.assertTrue(self.compare("SELECT id, name, score FROM t ORDER BY id", requires_order=True)[0])
+        self.assertFalse(self.compare("SELECT id, name, score FROM t ORDER BY id DESC", requires_order=True)[0])
+
+    def test_stops_reading_when_result_overflows(self):
+        cursor = self.conn.execute(
+            "SELECT id, name, score FROM t UNION ALL SELECT a.id, a.name, a.score FROM t a CROSS JOIN t b"
+        )
+        cursor = mock.Mock(wraps=cursor, description=cursor.description)
+        matched, reason = compare_cursor_to_expected(cursor, self.expected, False, BoundedFetch(cursor, batch_size=2))
+
+        self.assertFalse(matched)
+        self.assertEqual(reason, MISMATCH_TOO_MANY_ROWS)
+        self.assertLessEqual(cursor.fetchmany.call_count, 3)
+
+    def test_row_and_byte_caps_stop_fetching(self):
+        cursor = self.conn.execute("SELECT a.id FROM t a CROSS JOIN t b")
+        fetch = BoundedFetch(cursor, max_rows=5, batch_size=2)
+        with self.assertRaises(ResultLimitExceeded) as ctx:
+            list(fetch)
+        self.assertEqual(ctx.exception.limit, LIMIT_ROWS)
+        self.assertEqual(fetch.rows_transferred, 6)
+
+        cursor = self.conn.execute("SELECT name FROM t WHERE name IS NOT NULL")
+        with self.assertRaises(ResultLimitExceeded) as ctx:
+            list(BoundedFetch(cursor, max_bytes=1))
+        self.assertEqual(ctx.exception.limit, LIMIT_BYTES)
+
+
+class QueryWatchdogTest(APISimpleTestCase):
+    def setUp(self):
+        self.watchdog = QueryWatchdog(db_config_factory=dict)
+        self.side_conn = mock.MagicMock()
+        patcher = mock.patch.object(self.watchdog, "_side_connection", return_value=self.side_conn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.conn = mock.Mock(connection_id=42, server_host="localhost", server_port=3306)
+
+    def test_kills_statement_that_overruns_budget(self):
+        with self.watchdog.watch(self.conn, time_limit_ms=20) as watch:
+            time.sleep(0.2)
+
+        self.assertTrue(watch.killed)
+        self.side_conn.cursor.return_value.execute.assert_called_once_with("KILL QUERY 42")
+
+    def test_statement_within_budget_is_left_alone(self):
+        with self.watchdog.watch(self.conn, time_limit_ms=500) as watch:
+            pass
+        time.sleep(0.05)
+
+        self.assertFalse(watch.killed)
+        self.side_conn.cursor.assert_not_called()
+
+    def test_slow_kill_connection_does_not_block_other_watches(self):
+        connecting, release = threading.Event(), threading.Event()
+
+        def slow_side_connection(host, port):
+            connecting.set()
+            release.wait(5)
+            return self.side_conn
+
+        self.watchdog._side_connection.side_effect = slow_side_connection
+
+        def overrun():
+            with self.watchdog.watch(self.conn, time_limit_ms=10) as watch:
+                connecting.wait(5)
+            watches.append(watch)
+
+        watches = []
+        thread = threading.Thread(target=overrun)
+        thread.start()
+        self.assertTrue(connecting.wait(5))
+        start = time.monotonic()
+        with self.watchdog.watch(mock.Mock(connection_id=43, server_host="localhost", server_port=3306), 500):
+            pass
+        self.assertLess(time.monotonic() - start, 1)
+
+        release.set()
+        thread.join(5)
+        # The overrunning block only ended once its KILL was sent
+        self.assertTrue(watches[0].killed)
+        self.side_conn.cursor.return_value.execute.assert_called_once_with("KILL QUERY 42")
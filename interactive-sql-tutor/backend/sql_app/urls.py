@@ -1,14 +1,23 @@
 from django.urls import path
 from .views import problem_list, problem_detail, AttemptSubmitView, AttemptHistoryView, ProblemFiltersView, UploadSQLProblemView
-from .views import InstructorQueryAPIView, AllowedSchemaAPIView
+from .views import InstructorQueryAPIView, AllowedSchemaAPIView, GradingJobStatusView, GradingQueueMetricsView
+from .views import SandboxHostMetricsView, InstructorBatchGradeView, GradingLatencyMetricsView
+from .async_views import attempt_submit_async, instructor_query_async
 
 urlpatterns = [
     path('sql-problems/', problem_list, name='problem_list'),
     path('problems/<int:problem_id>/', problem_detail, name='problem_detail'),
     path('problems/<int:problem_id>/attempt/', AttemptSubmitView.as_view(), name='attempt_submit'),
+    path('problems/<int:problem_id>/attempt/async/', attempt_submit_async, name='attempt_submit_async'),
     path('problems/<int:problem_id>/history/', AttemptHistoryView.as_view(), name='attempt-history'),
+    path('grading-jobs/<int:job_id>/', GradingJobStatusView.as_view(), name='grading_job_status'),
+    path('grading-jobs/metrics/', GradingQueueMetricsView.as_view(), name='grading_queue_metrics'),
+    path('sandbox-hosts/metrics/', SandboxHostMetricsView.as_view(), name='sandbox_host_metrics'),
+    path('grading-latency/metrics/', GradingLatencyMetricsView.as_view(), name='grading_latency_metrics'),
     path('problems/filters/', ProblemFiltersView.as_view(), name='problem-filters'),
     path("sql-problems/add/", UploadSQLProblemView.as_view(), name="upload-sql-problem"),
     path("instructor/query-sql/", InstructorQueryAPIView.as_view(), name='instructor-query-sql'),
+    path("instructor/query-sql/async/", instructor_query_async, name='instructor-query-sql-async'),
+    path("instructor/problems/<int:problem_id>/batch-grade/", InstructorBatchGradeView.as_view(), name='instructor-batch-grade'),
     path("instructor/allowed-schema/", AllowedSchemaAPIView.as_view(), name='allowed-schema')
 ]
\ No newline at end of file
@@ -5,22 +5,32 @@ from rest_framework.decorators import api_view
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .models import SQLProblem, Attempt, Topic
+from .models import SQLProblem, Attempt, Topic, GradingJob
+from users.models import User
 from .serializers import SQLProblemListSerializer, SQLProblemDetailSerializer, AttemptSerializer, AttemptHistorySerializer 
-from .serializers import ProblemUploadSerializer, SQLQuerySerializer
-from utils.sql_sandbox import check_user_query
+from .serializers import ProblemUploadSerializer, SQLQuerySerializer, BatchGradeSerializer
+from utils.batch_grading import grade_batch
+from utils.grading import GradingPipeline, GradingResult
+from utils.grading_queue import JOB_DONE, JOB_FAILED, JOB_QUEUED, enqueue_grading_job, ensure_grading_workers, grading_queue_stats
+from utils.grading_timings import grading_latency_stats, server_timing_header
+from utils.sql_sandbox import warm_expected_result
+from utils.sandbox_hosts import get_sandbox_router
+from utils.result_limits import BoundedFetch, ResultLimitExceeded, record_transfer
 from rest_framework.permissions import IsAuthenticated
 from django.db.models import Count, Case, When, IntegerField, FloatField, ExpressionWrapper, Value, F, Func
 
-import os, json
+import os, json, time
 from django.conf import settings
 from .permissions import IsAdminUserOrInstructor
-from django.db import connection
+from django.db import connection, transaction
+from django.http import StreamingHttpResponse
+from django.urls import reverse
 from utils.save_sql_problem_to_db import save_sql_problem_to_db
 from sqlglot import parse_one, exp
-from utils.problem_loader import get_next_problem_id
 from utils.gcs_uploader import upload_problem_to_gcs
-from google.cloud import storage
+from utils.problem_catalog import allocate_problem_id, catalog_entry
+from utils.problem_loader import list_problem_datasets
+from utils.expected_output import cached_expected_results
 
 @api_view(['GET'])
 def problem_list(request):
@@ -168,10 +178,19 @@ class AttemptSubmitView(APIView):
     Features:
     - Requires authentication via `IsAuthenticated`.
     - Accepts the user's query and optional metadata (e.g., hints used, time taken).
-    - Validates and checks the SQL query in a sandboxed environment.
+    - Validates and checks the SQL query in a sandboxed environment, exactly once,
+      through `GradingPipeline`.
     - Computes score and status based on correctness.
     - Saves the result as an Attempt object.
     - Returns feedback and result status in the response.
+    - When GRADING_QUEUE_ENABLED is set, queues the submission instead (see
+      `utils.grading_queue`) and returns its job id right away; the verdict is then
+      read from `GradingJobStatusView`.
+    - Reports the time spent in each grading stage in a `Server-Timing` header
+      (GRADING_SERVER_TIMING), e.g.
+          Server-Timing: precheck;dur=0.8, connect;dur=2.3, create_schema;dur=1.9,
+                         setup;dur=14.2, query;dur=3.1, compare;dur=0.4,
+                         drop_schema;dur=2.6, total;dur=26.5
 
     Request Body:
         {
@@ -182,11 +201,18 @@ class AttemptSubmitView(APIView):
 
     Successful Response (200 OK):
         {
-            "result": "correct",
+            "result": "correct",     # or "wrong", "time_limit_exceeded"
             "score": 100,
             "feedback": ""
         }
 
+    Queued Response (202 Accepted, GRADING_QUEUE_ENABLED):
+        {
+            "job_id": 42,
+            "status": "queued",
+            "status_url": "/api/grading-jobs/42/"
+        }
+
     Failure Response (400 / 404):
         {
             "error": "Problem not found."
@@ -222,27 +248,198 @@ class AttemptSubmitView(APIView):
         hints_used = data.get("hints_used", 0)
         time_taken = data.get("time_taken", None)
 
-        # Run sandboxed check on the user's SQL query
-        correct, message = check_user_query(problem_id, user_query)
+        # Hand the submission to the grading workers instead of holding this request
+        if settings.GRADING_QUEUE_ENABLED:
+            job = enqueue_grading_job(user, problem, user_query, hints_used, time_taken)
+            return Response({
+                "job_id": job.job_id,
+                "status": job.status,
+                "status_url": reverse("grading_job_status", args=[job.job_id]),
+            }, status=status.HTTP_202_ACCEPTED)
 
-        score = 100 if correct else 0
-        status_str = "Completed" if correct else "Failed"
+        # Run sandboxed check on the user's SQL query (exactly once per submission)
+        result = GradingPipeline(problem_id, user_query).run()
 
-        # Save the attempt record
+        # Save the attempt record, reusing the verdict instead of re-grading
         attempt = serializer.save(
             user=user,
             problem=problem,
-            score=score,
-            status=status_str,
+            grading_result=result,
             hints_used=hints_used,
             time_taken=time_taken
         )
 
-        return Response({
-            "result": "correct" if correct else "wrong",
-            "score": score,
-            "feedback": message
-        }, status=status.HTTP_200_OK)
+        response = Response(result.as_response(), status=status.HTTP_200_OK)
+        if settings.GRADING_SERVER_TIMING and result.timings:
+            response["Server-Timing"] = server_timing_header(result.timings)
+        return response
+
+
+class GradingJobStatusView(APIView):
+    """
+    API endpoint to poll a queued submission (see `AttemptSubmitView`).
+
+    Method:
+        GET
+
+    URL:
+        /api/grading-jobs/<job_id>/
+
+    Permissions:
+        - Requires authentication (JWT token); users only see their own jobs.
+
+    Response (200 OK), while waiting:
+        {
+            "job_id": 42,
+            "status": "queued",      # or "running"
+            "queue_position": 3      # jobs ahead of this one (queued only)
+        }
+
+    Response (200 OK), once graded (same fields as the synchronous submit response):
+        {
+            "job_id": 42,
+            "status": "done",        # or "failed"
+            "result": "correct",
+            "score": 100,
+            "feedback": "",
+            "attempt_id": 17
+        }
+
+    Response (404 Not Found):
+        {
+            "error": "Grading job not found."
+        }
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        try:
+            job = GradingJob.objects.get(job_id=job_id, user=request.user)
+        except GradingJob.DoesNotExist:
+            return Response({"error": "Grading job not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        # Queued jobs left over from a restart still get picked up by this process
+        ensure_grading_workers()
+
+        payload = {"job_id": job.job_id, "status": job.status}
+        if job.status == JOB_QUEUED:
+            payload["queue_position"] = GradingJob.objects.filter(status=JOB_QUEUED, job_id__lt=job.job_id).count()
+        elif job.status == JOB_DONE:
+            payload.update({
+                "result": job.verdict,
+                "score": int(job.score),
+                "feedback": job.feedback,
+                "attempt_id": job.attempt_id,
+            })
+        elif job.status == JOB_FAILED:
+            payload["feedback"] = job.feedback
+        return Response(payload, status=status.HTTP_200_OK)
+
+
+class GradingQueueMetricsView(APIView):
+    """
+    API endpoint exposing grading queue depth and wait times.
+
+    Method:
+        GET
+
+    URL:
+        /api/grading-jobs/metrics/?window=300
+
+    Permissions:
+        - Requires user role: 'Instructor' or 'Admin' (`IsAdminUserOrInstructor`)
+
+    Response (200 OK):
+        {
+            "queued": 12, "running": 4, "failed": 0, "oldest_queued_ms": 850,
+            "window_seconds": 300, "started": 230,
+            "wait_ms_p50": 120.5, "wait_ms_p95": 910.0, "wait_ms_max": 1300.2,
+            "run_ms_p50": 85.1, "run_ms_p95": 400.7
+        }
+    """
+    permission_classes = [IsAuthenticated, IsAdminUserOrInstructor]
+
+    def get(self, request):
+        try:
+            window = int(request.query_params.get("window", 0)) or None
+        except ValueError:
+            return Response({"error": "window must be an integer number of seconds."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(grading_queue_stats(window), status=status.HTTP_200_OK)
+
+
+class SandboxHostMetricsView(APIView):
+    """
+    API endpoint exposing the load and health of the sandbox hosts seen by this process.
+
+    Method:
+        GET
+
+    URL:
+        /api/sandbox-hosts/metrics/
+
+    Permissions:
+        - Requires user role: 'Instructor' or 'Admin' (`IsAdminUserOrInstructor`)
+
+    Response (200 OK):
+        {
+            "hosts": [
+                {"host": "10.0.0.5:3306", "in_flight": 3, "max_concurrency": 16,
+                 "ejected": false, "ejected_for_seconds": 0, "consecutive_failures": 0,
+                 "sandboxes": 5120, "failures": 2, "ejections": 0},
+                ...
+            ]
+        }
+        "hosts" is empty when SANDBOX_HOSTS is not set.
+    """
+    permission_classes = [IsAuthenticated, IsAdminUserOrInstructor]
+
+    def get(self, request):
+        router = get_sandbox_router()
+        return Response({"hosts": router.stats() if router is not None else []}, status=status.HTTP_200_OK)
+
+
+class GradingLatencyMetricsView(APIView):
+    """
+    API endpoint exposing per-problem latency histograms of each grading stage, for the
+    submissions graded by this process (see `utils.grading_timings`).
+
+    Method:
+        GET
+
+    URL:
+        /api/grading-latency/metrics/?problem_id=3
+
+    Query Parameters:
+        problem_id (int, optional): Only report this problem.
+
+    Permissions:
+        - Requires user role: 'Instructor' or 'Admin' (`IsAdminUserOrInstructor`)
+
+    Response (200 OK):
+        {
+            "problems": {
+                "3": {
+                    "setup": {"count": 120, "mean_ms": 14.8, "p50_ms": 25, "p95_ms": 50,
+                              "p99_ms": 100, "max_ms": 61.2,
+                              "buckets": {"1": 0, "2": 0, ..., "25": 97, "50": 21, ..., "+Inf": 0}},
+                    "total": {...},
+                    ...
+                }
+            }
+        }
+        Buckets count the submissions whose stage took at most that many ms (and more
+        than the previous bound); percentiles are bucket upper bounds.
+    """
+    permission_classes = [IsAuthenticated, IsAdminUserOrInstructor]
+
+    def get(self, request):
+        try:
+            problem_id = int(request.query_params["problem_id"]) if "problem_id" in request.query_params else None
+        except ValueError:
+            return Response({"error": "problem_id must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        problems = grading_latency_stats(problem_id)
+        return Response({"problems": {str(pid): stages for pid, stages in problems.items()}},
+                        status=status.HTTP_200_OK)
 
 
 class AttemptHistoryView(APIView):
@@ -351,6 +548,7 @@ class UploadSQLProblemView(APIView):
                 - input_data (dict): The initial table data for the problem (for UI display or debugging).
                 - hints (list): A list of string hints associated with the problem.
                 - expected_output (list): The expected result rows (as dicts) from executing the solution query.
+                - time_limit_ms (int, optional): Per-statement time budget for student queries.
         
         *** Note: Do NOT include `problem_id` in the metadata. ***
         It will be automatically generated by the server upon upload.
@@ -360,12 +558,16 @@ class UploadSQLProblemView(APIView):
 
     Process:
         1. Validates the metadata and uploaded files.
-        2. Generates a new unique problem_id based on existing folders.
+        2. Allocates a new unique problem_id from the database sequence (`allocate_problem_id`).
         3. Creates a new subdirectory under `problems/{id}/` to store:
             - metadata.json
             - problem.sql
             - solution.sql
+           packed into one `problem.bundle` by default (PROBLEM_UPLOAD_FORMAT), and
+           records them in the problem catalog.
         4. Inserts the metadata and hints into the SQLProblem and Hint tables via raw SQL.
+        5. Precomputes the expected result of solution.sql so grading never has to re-run it,
+           and stores it in the problem's bundle (PROBLEM_UPLOAD_FORMAT = "bundle").
 
     Returns:
         - 201 Created: Problem uploaded successfully
@@ -392,15 +594,12 @@ class UploadSQLProblemView(APIView):
             # Generate new problem_id
             metadata = serializer.get_validated_metadata()
             files = serializer.get_cleaned_files()
-            new_id = get_next_problem_id()
+            new_id = allocate_problem_id()
             folder = str(new_id).zfill(3)
 
-            # Check for duplicates
-            client = storage.Client()
-            bucket = client.bucket(settings.GCS_PROBLEM_BUCKET)
-            gcs_conflict = any(blob.name.startswith(f"problems/{folder}/") for blob in bucket.list_blobs(prefix=f"problems/{folder}/"))
+            # Check for duplicates (problems added outside the upload endpoint)
             local_path = os.path.join(settings.BASE_DIR, "problems", folder)
-            if gcs_conflict or os.path.exists(local_path):
+            if catalog_entry(new_id) is not None or os.path.exists(local_path):
                 return Response({"error": f"Problem {new_id} already exists."}, status=400)
 
             # Update metadata and write
@@ -411,6 +610,17 @@ class UploadSQLProblemView(APIView):
             with connection.cursor() as cursor:
                 save_sql_problem_to_db(cursor, metadata_with_id)
 
+            # Compute the expected result now so the first submission doesn't pay for it.
+            # Not fatal: it is computed on first use if this fails.
+            try:
+                warm_expected_result(new_id)
+                if settings.PROBLEM_UPLOAD_FORMAT == "bundle":
+                    # Store the results in the bundle, so no process has to run solution.sql
+                    expected_results = cached_expected_results(new_id, list_problem_datasets(new_id))
+                    upload_problem_to_gcs(new_id, files, expected_results)
+            except Exception as e:
+                print(f"Could not precompute expected result for problem {new_id}: {e}")
+
             return Response({"message": f"Problem {new_id} uploaded successfully."}, status=201)
 
         except Exception as e:
@@ -536,6 +746,12 @@ class InstructorQueryAPIView(APIView):
                 {
                     "error": "Validation or execution error message"
                 }
+            400 Bad Request (result larger than QUERY_RESULT_MAX_ROWS / QUERY_RESULT_MAX_BYTES):
+                {
+                    "error": "Result exceeds the limit of 10000 rows.",
+                    "limit": "rows",
+                    "rows_transferred": 10001
+                }
             403 Forbidden:
                 {
                     "error": "Some columns are not allowed."
@@ -553,16 +769,55 @@ class InstructorQueryAPIView(APIView):
         if not self.are_selected_columns_allowed(query, self.ALLOWED_COLUMNS):
             return Response({"error": "Some columns are not allowed."}, status=403)
         try:
-            with connection.cursor() as cursor:
-                cursor.execute(query)
-                columns = [col[0] for col in cursor.description]
-                rows = cursor.fetchall()
+            columns, rows = self.run_query(query)
             # if not self.are_selected_columns_allowed(columns, self.ALLOWED_COLUMNS):
             #     return Response({"error": "Some columns are not allowed."}, status=403)
             return Response({"columns": columns, "rows": rows}, status=200)
 
+        except ResultLimitExceeded as e:
+            return Response(
+                {"error": str(e), "limit": e.limit, "rows_transferred": e.rows_transferred},
+                status=400,
+            )
         except Exception as e:
             return Response({"error": str(e)}, status=400)
+
+    def run_query(self, query):
+        """
+        Runs a validated query on an unbuffered cursor, reading at most
+        QUERY_RESULT_MAX_ROWS rows / QUERY_RESULT_MAX_BYTES bytes.
+
+        Returns:
+            (list[str], list[tuple]): Column names and rows.
+
+        Raises:
+            ResultLimitExceeded: If the result is larger than the caps.
+        """
+        cursor = self.unbuffered_cursor()
+        try:
+            cursor.execute(query)
+            columns = [col[0] for col in cursor.description]
+            fetch = BoundedFetch(cursor)
+            try:
+                rows = list(fetch)
+            finally:
+                record_transfer("instructor", fetch)
+        finally:
+            cursor.close()
+        return columns, rows
+
+    def unbuffered_cursor(self):
+        """
+        Returns a server-side (unbuffered) cursor on Django's MySQL connection.
+
+        The default cursor stores the whole result set client-side on execute,
+        before any cap can apply; with SSCursor rows are only transferred as
+        `fetchmany` asks for them, and closing the cursor drops the rest.
+        """
+        from MySQLdb.cursors import SSCursor
+
+        connection.ensure_connection()
+        return connection.connection.cursor(SSCursor)
         
     def is_safe_query(self, query):
         """
@@ -648,4 +903,161 @@ class AllowedSchemaAPIView(APIView):
                 {"name": "name", "type": "varchar"}
             ]
         }
-        return Response(schema)
\ No newline at end of file
+        return Response(schema)
+
+class InstructorBatchGradeView(APIView):
+    """
+    API endpoint for grading many submissions of one problem at once, e.g. to import an
+    exam or regrade after a grader or dataset fix.
+
+    All submissions share one sandbox and the cached expected result (see
+    `utils.batch_grading.grade_batch`), and verdicts are streamed back as they are
+    produced, one JSON object per line (NDJSON).
+
+    Method:
+        POST
+
+    URL:
+        /api/instructor/problems/<problem_id>/batch-grade/
+
+    Permissions:
+        - Requires user role: 'Instructor' or 'Admin' (`IsAdminUserOrInstructor`)
+
+    Request Body (JSON):
+        {
+            "items": [
+                {"user_id": 7, "user_query": "SELECT ..."},
+                {"attempt_id": 42, "user_query": "SELECT ..."}
+            ],
+            "save": true,          // optional, record the verdicts as Attempts
+            "use_cache": true      // optional, use the verdict cache
+        }
+        or, to regrade every finished queued submission of the problem:
+        {"regrade_jobs": true, "save": true, "use_cache": false}
+
+    Response (200 OK, application/x-ndjson):
+        {"index": 0, "user_id": 7, "attempt_id": null, "result": "correct", "score": 100, "feedback": "",
+         "datasets": [{"dataset": "sample", "verdict": "correct", "setup_ms": 21.4, "query_ms": 0.9, "total_ms": 22.5}]}
+        {"index": 1, "user_id": 3, "attempt_id": 42, "result": "wrong", "score": 0, "feedback": "Output does not match expected result.",
+         "datasets": [{"dataset": "sample", "verdict": "wrong", "setup_ms": null, "query_ms": 1.2, "total_ms": 1.3}]}
+        {"done": true, "graded": 2, "correct": 1, "saved": 2, "elapsed_ms": 310}
+        "datasets" holds per-dataset timings (null for verdicts served from the cache or
+        another engine); see `utils.sql_sandbox.grade_datasets`.
+
+    Error Responses:
+        - 400 Bad Request: invalid body, unknown user ids, attempt ids of another problem,
+          or more than BATCH_GRADING_MAX_ITEMS submissions (items or jobs to regrade)
+        - 404 Not Found: problem does not exist
+
+    Notes:
+        - Saving writes Attempts in bulk, BATCH_GRADING_WRITE_CHUNK rows at a time; ids of
+          newly created Attempts are not returned.
+        - A regrade of `regrade_jobs` also updates the verdict stored on each GradingJob.
+    """
+    permission_classes = [IsAuthenticated, IsAdminUserOrInstructor]
+
+    def post(self, request, problem_id):
+        if not SQLProblem.objects.filter(problem_id=problem_id).exists():
+            return Response({"error": "Problem not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        serializer = BatchGradeSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+
+        jobs = {}
+        if data["regrade_jobs"]:
+            done = GradingJob.objects.filter(problem_id=problem_id, status=JOB_DONE, attempt__isnull=False)
+            done = done.order_by("job_id").only("job_id", "user_id", "attempt_id", "user_query")
+            max_items = settings.BATCH_GRADING_MAX_ITEMS
+            done = list(done[:max_items + 1])
+            if len(done) > max_items:
+                return Response(
+                    {"error": f"More than {max_items} finished jobs to regrade; at most {max_items} items per batch."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            items = []
+            for job in done:
+                items.append({"user_query": job.user_query, "user_id": job.user_id, "attempt_id": job.attempt_id})
+                jobs[job.attempt_id] = job
+        else:
+            items = data["items"]
+
+        user_ids = {item["user_id"] for item in items if "user_id" in item}
+        unknown_users = user_ids - set(User.objects.filter(user_id__in=user_ids).values_list("user_id", flat=True))
+        if unknown_users:
+            return Response({"error": f"Unknown user ids: {sorted(unknown_users)}"}, status=status.HTTP_400_BAD_REQUEST)
+        attempt_ids = {item["attempt_id"] for item in items if "attempt_id" in item}
+        attempts = Attempt.objects.filter(problem_id=problem_id, attempt_id__in=attempt_ids).in_bulk()
+        if len(attempts) != len(attempt_ids):
+            missing = sorted(attempt_ids - set(attempts))
+            return Response({"error": f"Attempts not found for this problem: {missing}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(
+            self.stream(problem_id, items, attempts, jobs, data["save"], data["use_cache"]),
+            content_type="application/x-ndjson",
+        )
+        response["Cache-Control"] = "no-cache"
+        return response
+
+    def stream(self, problem_id, items, attempts, jobs, save, use_cache):
+        """
+        Yields one NDJSON line per graded item, then a summary line, writing Attempts
+        (and GradingJobs) in chunks when `save` is set.
+        """
+        start = time.monotonic()
+        new_attempts, updated_attempts, updated_jobs = [], [], []
+        graded = correct = saved = 0
+
+        def flush():
+            nonlocal saved
+            with transaction.atomic():
+                Attempt.objects.bulk_create(new_attempts)
+                Attempt.objects.bulk_update(updated_attempts, ["score", "status"])
+                GradingJob.objects.bulk_update(updated_jobs, ["verdict", "feedback", "score"])
+            saved += len(new_attempts) + len(updated_attempts)
+            new_attempts.clear()
+            updated_attempts.clear()
+            updated_jobs.clear()
+
+        queries = (item["user_query"] for item in items)
+        for index, check in grade_batch(problem_id, queries, use_cache=use_cache):
+            item = items[index]
+            result = GradingResult(check.verdict, check.message)
+            graded += 1
+            correct += result.correct
+
+            if save:
+                attempt = attempts.get(item.get("attempt_id"))
+                if attempt is not None:
+                    attempt.score, attempt.status = result.score, result.status
+                    updated_attempts.append(attempt)
+                    job = jobs.get(attempt.attempt_id)
+                    if job is not None:
+                        job.verdict, job.feedback, job.score = result.verdict, result.feedback, result.score
+                        updated_jobs.append(job)
+                else:
+                    new_attempts.append(Attempt(
+                        user_id=item["user_id"], problem_id=problem_id,
+                        score=result.score, status=result.status, hints_used=0,
+                    ))
+                if len(new_attempts) + len(updated_attempts) >= settings.BATCH_GRADING_WRITE_CHUNK:
+                    flush()
+
+            yield json.dumps({
+                "index": index,
+                "user_id": item.get("user_id"),
+                "attempt_id": item.get("attempt_id"),
+                **result.as_response(),
+                "datasets": check.datasets,
+            }) + "\n"
+
+        if save:
+            flush()
+        yield json.dumps({
+            "done": True,
+            "graded": graded,
+            "correct": correct,
+            "saved": saved,
+            "elapsed_ms": round((time.monotonic() - start) * 1000),
+        }) + "\n"
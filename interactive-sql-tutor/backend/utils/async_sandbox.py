@@ -0,0 +1,337 @@
+import asyncio
+import logging
+import uuid
+import weakref
+from contextlib import asynccontextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from config.db_config import get_mysql_db_config
+from utils.expected_output import ExpectedResult, get_expected_result, store_expected_result
+from utils.grading_timings import grading_timer, timed_stage
+from utils.problem_loader import list_problem_datasets, load_problem_file
+from utils.query_precheck import precheck_query
+from utils.query_watchdog import ER_QUERY_INTERRUPTED, ER_QUERY_TIMEOUT, get_time_limit_ms
+from utils.result_compare import compare_cursor_to_expected
+from utils.result_fingerprint import canonicalize_result
+from utils.result_limits import AsyncBoundedFetch, ResultLimitExceeded, record_transfer
+from utils.sandbox_hosts import get_sandbox_router
+from utils.setup_compiler import get_compiled_setup
+from utils.sql_sandbox import (
+    ENGINE_MYSQL, VERDICT_OUTPUT_LIMIT_EXCEEDED, VERDICT_TIME_LIMIT_EXCEEDED, QueryCheckResult,
+    check_user_query, load_grading_metadata, select_grading_engine,
+)
+
+try:
+    import aiomysql
+except ImportError:  # optional: without it the async views grade in a worker thread
+    aiomysql = None
+
+logger = logging.getLogger(__name__)
+
+# Server errors caused by load or shutdown rather than by the query:
+# too many connections, server shutdown, lock wait timeout, deadlock
+_TRANSIENT_ERRORS = {1040, 1053, 1205, 1213}
+
+# One aiomysql pool per (event loop, database); a pool cannot be shared across loops
+_pools = weakref.WeakKeyDictionary()
+
+
+def _in_thread(func):
+    # Blocking helpers (file/GCS reads, sqlglot, Django ORM) run off the event loop
+    return sync_to_async(func, thread_sensitive=False)
+
+
+async def get_async_pool(database=None):
+    """
+    Returns the running event loop's aiomysql pool for the default database server,
+    created on first use with up to ASYNC_SANDBOX_POOL_SIZE connections.
+
+    Parameters:
+        database (str, optional): Default schema of the pool's connections
+            (None for sandbox connections, which `USE` their own schema).
+    """
+    loop = asyncio.get_running_loop()
+    pools = _pools.setdefault(loop, {})
+    pool = pools.get(database)
+    if pool is None:
+        config = get_mysql_db_config()
+        pool = pools[database] = await aiomysql.create_pool(
+            host=config["host"],
+            port=config["port"],
+            user=config["user"],
+            password=config["password"],
+            db=database,
+            minsize=0,
+            maxsize=settings.ASYNC_SANDBOX_POOL_SIZE,
+            autocommit=True,
+        )
+    return pools[database]
+
+
+class AsyncSandbox:
+    """
+    A sandbox schema on an aiomysql connection, yielded by `async_sandbox_schema`.
+
+    Attributes:
+        conn: aiomysql connection with the schema selected via `USE`.
+        cursor: Unbuffered `SSCursor` on `conn` (rows are streamed, never buffered whole).
+        schema_name (str): Name of the sandbox schema.
+    """
+    __slots__ = ("conn", "cursor", "schema_name", "reusable")
+
+    def __init__(self, conn, cursor, schema_name):
+        self.conn = conn
+        self.cursor = cursor
+        self.schema_name = schema_name
+        self.reusable = True
+
+    def discard_connection(self):
+        """
+        Marks the connection as unusable (a statement was cancelled mid-flight, or
+        unread rows are pending): it is closed instead of going back to the pool.
+        """
+        self.reusable = False
+
+
+@asynccontextmanager
+async def async_sandbox_schema(time_limit_ms=None):
+    """
+    Asyncio counterpart of `sandbox_schema`: creates a uniquely named schema on a
+    pooled aiomysql connection, yields an `AsyncSandbox`, and drops the schema afterwards.
+
+    Parameters:
+        time_limit_ms (int, optional): Per-statement budget for SELECTs on this session
+            (`max_execution_time`).
+
+    Example:
+        async with async_sandbox_schema() as sandbox:
+            await sandbox.cursor.execute("SELECT 1")
+    """
+    schema_name = f"sandbox_{uuid.uuid4().hex[:8]}"
+    with timed_stage("connect"):
+        pool = await get_async_pool()
+        conn = await pool.acquire()
+    sandbox = None
+    try:
+        with timed_stage("create_schema"):
+            cursor = await conn.cursor(aiomysql.SSCursor)
+            sandbox = AsyncSandbox(conn, cursor, schema_name)
+            await cursor.execute(f"CREATE SCHEMA `{schema_name}`")
+            await cursor.execute(f"USE `{schema_name}`")
+            if time_limit_ms:
+                await cursor.execute("SET SESSION max_execution_time = %s", (int(time_limit_ms),))
+        yield sandbox
+    finally:
+        with timed_stage("drop_schema"):
+            if sandbox is None or not sandbox.reusable or conn.closed:
+                conn.close()
+                pool.release(conn)
+                conn = await pool.acquire()
+            try:
+                async with conn.cursor() as cleanup:
+                    await cleanup.execute(f"DROP SCHEMA IF EXISTS `{schema_name}`")
+            finally:
+                pool.release(conn)
+
+
+def _is_query_error(exc):
+    """
+    True when a PyMySQL error is a property of the query (syntax, unknown column, bad
+    value, ...) rather than of the connection or server load. PyMySQL reports many query
+    errors as OperationalError, so this goes by error code: client errors (2000-2999)
+    and the transient server errors in _TRANSIENT_ERRORS are not the query's fault.
+    """
+    errno = exc.args[0] if exc.args and isinstance(exc.args[0], int) else None
+    if errno is None or 2000 <= errno < 3000:
+        return False
+    return errno not in _TRANSIENT_ERRORS
+
+
+async def _kill_query(thread_id):
+    """
+    Stops a running statement from a side connection (KILL QUERY), like the query watchdog.
+    """
+    pool = await get_async_pool()
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(f"KILL QUERY {int(thread_id)}")
+
+
+async def _compute_expected_result(cursor, problem_id):
+    solution_sql = await _in_thread(load_problem_file)(problem_id, "solution.sql")
+    await cursor.execute(solution_sql)
+    columns = [col[0] for col in cursor.description]
+    fetch = AsyncBoundedFetch(cursor)
+    try:
+        rows = await fetch.fetch_rows()
+    finally:
+        record_transfer("solution", fetch)
+    expected = ExpectedResult(*canonicalize_result(columns, rows))
+    store_expected_result(problem_id, expected)
+    return expected
+
+
+async def _grade_statements(sandbox, statements, expected, requires_order):
+    """
+    Runs the user's statements and compares the last one's result. Returns
+    (matched, rows_transferred); raises driver errors and ResultLimitExceeded.
+    """
+    cursor = sandbox.cursor
+    rows_transferred = 0
+    matched = False
+    for i, stmt in enumerate(statements):
+        with timed_stage("query"):
+            await cursor.execute(stmt)
+        if cursor.description is None:
+            continue
+        fetch = AsyncBoundedFetch(cursor)
+        try:
+            if i == len(statements) - 1:
+                with timed_stage("compare"):
+                    # One row past the expected count is enough to know the result is wrong
+                    rows = await fetch.fetch_rows(limit=expected.row_count + 1)
+                    if len(rows) > expected.row_count:
+                        sandbox.discard_connection()
+                    matched, _ = compare_cursor_to_expected(cursor, expected, requires_order, iter(rows))
+            else:
+                with timed_stage("query"):
+                    await fetch.fetch_rows(keep=False)
+        except ResultLimitExceeded:
+            sandbox.discard_connection()
+            raise
+        finally:
+            rows_transferred += fetch.rows_transferred
+            record_transfer("grading", fetch)
+    return matched, rows_transferred
+
+
+async def async_check_user_query(problem_id, user_query, precheck=None, metadata=None):
+    """
+    `check_user_query` for asyncio views: the MySQL sandbox is driven with aiomysql, so
+    one event loop keeps many submissions' round trips in flight instead of one per
+    worker thread.
+
+    Same pre-check, expected-result cache, row/byte caps, time budget, verdicts and
+    stage timings (`.timings`) as `check_user_query`. The time budget is enforced by `max_execution_time` and, past
+    the SANDBOX_WATCHDOG_GRACE_MS grace, by KILL QUERY from a side connection.
+
+    Submissions are graded with the blocking `check_user_query` in a worker thread when
+    aiomysql is not installed, the problem is assigned to another engine,
+    SQL_SANDBOX_MODE is not "ephemeral" (pool/shared/clone sandboxes are synchronous),
+    sandboxes are routed to dedicated hosts (SANDBOX_HOSTS, `utils.sandbox_hosts`), or
+    the problem has hidden datasets (graded concurrently by `grade_datasets`).
+
+    Parameters:
+        problem_id (int): The ID of the SQL problem.
+        user_query (str): The SQL code submitted by the user.
+        precheck (PrecheckResult, optional): Result of `precheck_query`, if already run.
+        metadata (dict, optional): The problem's metadata.json, if already loaded.
+
+    Returns:
+        QueryCheckResult
+    """
+    with grading_timer() as timer:
+        result = await _async_check_user_query(problem_id, user_query, precheck, metadata)
+    result.timings = timer.as_dict()
+    return result
+
+
+async def _async_check_user_query(problem_id, user_query, precheck, metadata):
+    with timed_stage("precheck"):
+        if metadata is None:
+            metadata, error = await _in_thread(load_grading_metadata)(problem_id)
+            if error is not None:
+                return error
+        if precheck is None:
+            precheck = await _in_thread(precheck_query)(user_query, metadata)
+    if not precheck.ok:
+        return QueryCheckResult(False, precheck.error, cacheable=True)
+
+    if (aiomysql is None or select_grading_engine(metadata) != ENGINE_MYSQL
+            or settings.SQL_SANDBOX_MODE != "ephemeral" or get_sandbox_router() is not None
+            or len(list_problem_datasets(problem_id, metadata)) > 1):
+        return await _in_thread(check_user_query)(problem_id, user_query, precheck)
+
+    requires_order = metadata.get("requires_order", False)
+    time_limit_ms = get_time_limit_ms(metadata)
+    cacheable = precheck.parsed  # only MySQL vouched for queries sqlglot cannot parse
+    kill_after = (time_limit_ms + settings.SANDBOX_WATCHDOG_GRACE_MS) / 1000.0
+    statements = precheck.executable
+    compiled = await _in_thread(get_compiled_setup)(problem_id)
+    expected = await _in_thread(get_expected_result)(problem_id)
+
+    try:
+        async with async_sandbox_schema(time_limit_ms) as sandbox:
+            with timed_stage("setup"):
+                for stmt in compiled.statements:
+                    await sandbox.cursor.execute(stmt)
+            if expected is None:
+                with timed_stage("solution"):
+                    expected = await _compute_expected_result(sandbox.cursor, problem_id)
+
+            try:
+                matched, rows_transferred = await asyncio.wait_for(
+                    _grade_statements(sandbox, statements, expected, requires_order), kill_after,
+                )
+            except asyncio.TimeoutError:
+                sandbox.discard_connection()
+                await _kill_query(sandbox.conn.thread_id())
+                return QueryCheckResult(
+                    False, f"Time limit exceeded: query ran longer than {time_limit_ms} ms.",
+                    VERDICT_TIME_LIMIT_EXCEEDED,
+                )
+            except ResultLimitExceeded as e:
+                return QueryCheckResult(
+                    False, f"Output limit exceeded: {e}", VERDICT_OUTPUT_LIMIT_EXCEEDED,
+                    e.rows_transferred, cacheable=cacheable,
+                )
+            except aiomysql.Error as e:
+                sandbox.discard_connection()
+                if e.args and e.args[0] in (ER_QUERY_INTERRUPTED, ER_QUERY_TIMEOUT):
+                    return QueryCheckResult(
+                        False, f"Time limit exceeded: query ran longer than {time_limit_ms} ms.",
+                        VERDICT_TIME_LIMIT_EXCEEDED,
+                    )
+                return QueryCheckResult(False, f"Error in query execution: {str(e)}", cacheable=cacheable and _is_query_error(e))
+
+        if matched:
+            return QueryCheckResult(True, "", rows_transferred=rows_transferred, cacheable=cacheable)
+        return QueryCheckResult(False, "Output does not match expected result.",
+                                rows_transferred=rows_transferred, cacheable=cacheable)
+
+    except Exception as e:
+        return QueryCheckResult(False, f"Execution error: {str(e)}")
+
+
+async def async_run_readonly_query(query):
+    """
+    Runs an already-validated read-only query on the application database with an
+    unbuffered aiomysql cursor (the asyncio counterpart of the instructor query endpoint).
+
+    Returns:
+        (list[str], list[tuple]): Column names and rows.
+
+    Raises:
+        ResultLimitExceeded: If the result is larger than the row/byte caps.
+    """
+    pool = await get_async_pool(get_mysql_db_config()["database"])
+    conn = await pool.acquire()
+    fetch = None
+    try:
+        cursor = await conn.cursor(aiomysql.SSCursor)
+        await cursor.execute(query)
+        columns = [col[0] for col in cursor.description]
+        fetch = AsyncBoundedFetch(cursor)
+        rows = await fetch.fetch_rows()
+        await cursor.close()
+        return columns, rows
+    except BaseException:
+        # Unread rows or an interrupted statement: do not hand the connection back
+        conn.close()
+        raise
+    finally:
+        if fetch is not None:
+            record_transfer("instructor", fetch)
+        pool.release(conn)
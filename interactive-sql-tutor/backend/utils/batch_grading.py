@@ -0,0 +1,182 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from utils.expected_output import get_expected_result
+from utils.problem_loader import dataset_name, list_problem_datasets, load_problem_metadata
+from utils.query_precheck import precheck_query
+from utils.query_watchdog import get_time_limit_ms
+from utils.sql_sandbox import (
+    ENGINE_MYSQL, QueryCheckResult, dataset_failure_message, discard_pending_results, get_grading_backend,
+    grade_in_sandbox, problem_sandbox, select_grading_engine,
+)
+from utils.verdict_cache import get_cached_verdict, store_verdict, verdict_cache_key
+
+logger = logging.getLogger(__name__)
+
+
+class BatchSandbox:
+    """
+    One dataset's sandbox, shared by every submission of a batch.
+
+    The sandbox (and the expected result) is set up on the first submission that needs
+    MySQL, and replaced only when the connection is lost, or after a query that used
+    user variables (`@name`), which would otherwise leak into the next submission.
+
+    Parameters:
+        problem_id (int): The ID of the SQL problem.
+        dataset_file (str): The dataset loaded in the sandbox (see `list_problem_datasets`).
+        requires_order (bool): Whether row order is graded.
+        time_limit_ms (int): Per-statement time budget.
+    """
+
+    def __init__(self, problem_id, dataset_file, requires_order, time_limit_ms):
+        self.problem_id = problem_id
+        self.dataset_file = dataset_file
+        self.requires_order = requires_order
+        self.time_limit_ms = time_limit_ms
+        self.sandboxes_opened = 0
+        self._stack = None
+
+    def grade(self, statements):
+        """
+        Grades one pre-checked submission, given as its `PrecheckResult.executable`
+        statements.
+
+        Returns:
+            (QueryCheckResult, dict): The result and the dataset's timings, shaped like
+            the entries of `QueryCheckResult.datasets` (setup_ms is only set when the
+            sandbox had to be set up for this submission).
+        """
+        start = time.perf_counter()
+        timing = {"dataset": dataset_name(self.dataset_file), "verdict": None,
+                  "setup_ms": None, "query_ms": None, "total_ms": None}
+        if self._stack is None:
+            try:
+                self._open()
+            except Exception as e:
+                self.close()
+                return self._finish(QueryCheckResult(False, f"Execution error: {str(e)}"), timing, start)
+            timing["setup_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+        query_start = time.perf_counter()
+        try:
+            discard_pending_results(self._conn)
+            result = grade_in_sandbox(
+                self._conn, self._cursor, statements, self._expected, self.requires_order, self.time_limit_ms,
+            )
+        except Exception as e:
+            self.close()
+            return self._finish(QueryCheckResult(False, f"Execution error: {str(e)}"), timing, start)
+        timing["query_ms"] = round((time.perf_counter() - query_start) * 1000, 1)
+
+        if any("@" in stmt for stmt in statements) or not self._conn.is_connected():
+            self.close()
+        return self._finish(result, timing, start)
+
+    def _finish(self, result, timing, start):
+        timing["verdict"] = result.verdict
+        timing["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return result, timing
+
+    def close(self):
+        if self._stack is None:
+            return
+        stack, self._stack = self._stack, None
+        try:
+            stack.close()
+        except Exception:
+            logger.exception("Failed to clean up batch sandbox for problem %s", self.problem_id)
+
+    def _open(self):
+        self._stack = ExitStack()
+        self._conn, self._cursor, _ = self._stack.enter_context(
+            problem_sandbox(self.problem_id, self.time_limit_ms, self.dataset_file)
+        )
+        self._expected = get_expected_result(self.problem_id, self._cursor, self.dataset_file)
+        self.sandboxes_opened += 1
+
+
+def grade_batch(problem_id, user_queries, use_cache=True):
+    """
+    Grades many submissions for one problem, yielding each verdict as soon as it is known.
+
+    `check_user_query` provisions a sandbox per submission; for a regrade or an exam
+    import that is thousands of schema builds. Here the whole batch shares one per dataset.
+
+    Features:
+    - Metadata is loaded once; every submission is pre-checked (`utils.query_precheck`)
+      and rejected ones never reach MySQL.
+    - Submissions with the same canonical form (see `utils.verdict_cache`) are graded
+      once per batch; with `use_cache`, the shared verdict cache is consulted and filled.
+    - Problems assigned to another engine (SQLite, DuckDB) are graded there first.
+    - Everything else runs in one `BatchSandbox` per dataset, populated once and
+      compared against the dataset's cached expected result. Datasets are tried in
+      order and a submission stops at its first failing one. The caps and time budget
+      of `check_user_query` apply to every submission.
+
+    Parameters:
+        problem_id (int): The ID of the SQL problem.
+        user_queries (iterable[str]): The submissions, in order.
+        use_cache (bool): Read and write the verdict cache. Pass False when regrading
+            because cached verdicts are suspect (e.g. after a grader fix).
+
+    Yields:
+        (int, QueryCheckResult): Index of the submission in `user_queries`, and its
+        result, in input order. Submissions graded in MySQL carry per-dataset timings
+        in `.datasets`.
+
+    Example:
+        for index, result in grade_batch(3, queries):
+            print(index, result.verdict)
+    """
+    metadata = load_problem_metadata(problem_id)
+    datasets = list_problem_datasets(problem_id, metadata)
+    engine = select_grading_engine(metadata)
+    backend = get_grading_backend(engine) if engine != ENGINE_MYSQL and len(datasets) == 1 else None
+    requires_order, time_limit_ms = metadata.get("requires_order", False), get_time_limit_ms(metadata)
+    sandboxes = [BatchSandbox(problem_id, dataset_file, requires_order, time_limit_ms) for dataset_file in datasets]
+    graded = {}  # verdict cache key -> result, for this batch
+
+    try:
+        for index, user_query in enumerate(user_queries):
+            precheck = precheck_query(user_query, metadata)
+            if not precheck.ok:
+                yield index, QueryCheckResult(False, precheck.error, cacheable=True)
+                continue
+
+            key = verdict_cache_key(problem_id, user_query, precheck.statements)
+            result = graded.get(key) if key is not None else None
+            if result is None and key is not None and use_cache:
+                result = get_cached_verdict(key)
+            if result is None:
+                if backend is not None and precheck.parsed:
+                    result = backend(problem_id, precheck, metadata)
+                if result is None:
+                    result = _grade_on_datasets(sandboxes, precheck.executable)
+                if key is not None and result.cacheable:
+                    graded[key] = result
+                    if use_cache:
+                        store_verdict(key, result)
+            yield index, result
+    finally:
+        for sandbox in sandboxes:
+            sandbox.close()
+
+
+def _grade_on_datasets(sandboxes, statements):
+    timings = [
+        {"dataset": dataset_name(sandbox.dataset_file), "verdict": "skipped",
+         "setup_ms": None, "query_ms": None, "total_ms": None}
+        for sandbox in sandboxes
+    ]
+    rows_transferred = 0
+    cacheable = True
+    for i, sandbox in enumerate(sandboxes):
+        result, timings[i] = sandbox.grade(statements)
+        rows_transferred += result.rows_transferred
+        cacheable = cacheable and result.cacheable
+        if not result.correct:
+            return QueryCheckResult(False, dataset_failure_message(sandbox.dataset_file, result), result.verdict,
+                                    rows_transferred, result.cacheable, datasets=timings)
+    return QueryCheckResult(True, "", rows_transferred=rows_transferred, cacheable=cacheable, datasets=timings)
@@ -0,0 +1,302 @@
+import csv
+import logging
+import os
+import tempfile
+import threading
+
+import sqlglot
+from django.conf import settings
+from sqlglot import exp
+from sqlglot.errors import ErrorLevel, SqlglotError
+
+from utils.expected_output import ExpectedResult
+from utils.lru_cache import LRUCache
+from utils.problem_loader import get_problem_content_hash, load_problem_file, load_problem_metadata
+from utils.query_watchdog import get_time_limit_ms
+from utils.result_compare import compare_cursor_to_expected, discard_rows
+from utils.result_fingerprint import canonicalize_result
+from utils.result_limits import BoundedFetch, ResultLimitExceeded, record_transfer
+from utils.setup_compiler import get_compiled_setup
+from utils.sql_sandbox import (
+    VERDICT_OUTPUT_LIMIT_EXCEEDED, VERDICT_TIME_LIMIT_EXCEEDED, VERDICT_WRONG, QueryCheckResult,
+)
+
+try:
+    import duckdb
+except ImportError:  # optional: problems assigned to DuckDB are graded on MySQL without it
+    duckdb = None
+
+logger = logging.getLogger(__name__)
+
+ENGINE_DUCKDB = "duckdb"
+
+_TEXT_TYPES = tuple(exp.DataType.TEXT_TYPES) + ("tinytext", "mediumtext", "longtext")
+
+# NULL marker used when bulk-loading `input_data` through CSV
+_CSV_NULL = "\\N"
+
+
+class DuckDBUnavailable(Exception):
+    """
+    Raised when a problem cannot be loaded into DuckDB (missing module, bad data, ...).
+    """
+
+
+class DuckDBProblem:
+    """
+    One problem version loaded into an in-memory DuckDB database.
+
+    Submissions only run queries (enforced by `utils.query_precheck`), so they all share
+    the loaded database, each through its own cursor; nothing is copied per submission.
+
+    Attributes:
+        database: The DuckDB connection holding the problem's tables.
+        expected (ExpectedResult): Result of `solution.sql` on this database.
+    """
+    __slots__ = ("database", "expected")
+
+    def __init__(self, database, expected):
+        self.database = database
+        self.expected = expected
+
+    def cursor(self):
+        """
+        Returns a new connection to the shared database, for one submission.
+        """
+        return self.database.cursor()
+
+
+def _duckdb_column_definition(column):
+    """
+    Adapts a MySQL column definition for DuckDB: text columns get COLLATE NOCASE to
+    match MySQL's case-insensitive default collation. ENUM is kept as is (DuckDB sorts
+    it by declaration order, like MySQL).
+    """
+    kind = column.args.get("kind")
+    if kind is not None and kind.is_type(*_TEXT_TYPES):
+        column.append("constraints", exp.ColumnConstraint(kind=exp.CollateColumnConstraint(this=exp.var("NOCASE"))))
+    return column
+
+
+def _transpile(statement):
+    try:
+        return statement.sql(dialect="duckdb", unsupported_level=ErrorLevel.RAISE)
+    except SqlglotError as e:
+        raise DuckDBUnavailable(str(e)) from e
+
+
+def _load_input_data(database, metadata):
+    """
+    Loads the tables described by metadata `tables` with the rows in `input_data`
+    ({table: [header, row, ...]}), bulk-loading each table through a temporary CSV
+    file and DuckDB's native `read_csv`.
+
+    Returns:
+        bool: False (nothing loaded) when `input_data` does not cover every table.
+    """
+    tables = metadata.get("tables") or []
+    input_data = metadata.get("input_data") or {}
+    if not tables or any(table.get("table_name") not in input_data for table in tables):
+        return False
+
+    for table in tables:
+        name = table["table_name"]
+        header, *rows = input_data[name]
+        types = {column["name"]: column.get("type") for column in table.get("columns", [])}
+        if any(not types.get(column) for column in header):
+            return False
+        statement = exp.Create(
+            kind="TABLE",
+            this=exp.Schema(
+                this=exp.to_table(name),
+                expressions=[
+                    _duckdb_column_definition(exp.ColumnDef(
+                        this=exp.to_identifier(column), kind=exp.DataType.build(types[column], dialect="mysql"),
+                    ))
+                    for column in header
+                ],
+            ),
+        )
+        database.execute(_transpile(statement))
+
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, newline="", encoding="utf-8") as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+            writer.writerows([_CSV_NULL if value is None else value for value in row] for row in rows)
+        try:
+            csv_columns = "{" + ", ".join(f"'{col}': 'VARCHAR'" for col in header) + "}"
+            database.execute(
+                f'INSERT INTO "{name}" SELECT * FROM read_csv(?, header = false, columns = {csv_columns}, '
+                f"nullstr = '{_CSV_NULL}')",
+                [f.name],
+            )
+        finally:
+            os.unlink(f.name)
+    return True
+
+
+def _load_problem_sql(database, problem_id):
+    """
+    Loads the problem's compiled `problem.sql` (see `utils.setup_compiler`), transpiled
+    to DuckDB.
+    """
+    for text in get_compiled_setup(problem_id).statements:
+        statement = sqlglot.parse_one(text, read="mysql")
+        if isinstance(statement, exp.Create):
+            for column in statement.find_all(exp.ColumnDef):
+                _duckdb_column_definition(column)
+        database.execute(_transpile(statement))
+
+
+def build_duckdb_problem(problem_id):
+    """
+    Loads the current version of a problem into an in-memory DuckDB database.
+
+    Steps:
+    1. Create the tables from metadata `tables` and bulk-load `input_data` when it
+       covers every table; otherwise transpile and run the compiled `problem.sql`.
+    2. Disable external access (files, extensions, ...) and lock the configuration,
+       so submissions can only read the loaded tables.
+    3. Run the transpiled `solution.sql` to get the expected result.
+    4. When metadata has an `expected_output`, check the solution reproduces it.
+
+    Returns:
+        DuckDBProblem
+
+    Raises:
+        DuckDBUnavailable: If DuckDB is not installed or the problem cannot be loaded.
+    """
+    if duckdb is None:
+        raise DuckDBUnavailable("duckdb is not installed.")
+    metadata = load_problem_metadata(problem_id)
+    database = duckdb.connect(":memory:")
+    try:
+        if not _load_input_data(database, metadata):
+            _load_problem_sql(database, problem_id)
+        database.execute("SET enable_external_access = false")
+        database.execute("SET lock_configuration = true")
+
+        cursor = database.cursor()
+        solution = [stmt for stmt in sqlglot.parse(load_problem_file(problem_id, "solution.sql"), read="mysql") if stmt]
+        for stmt in solution[:-1]:
+            cursor.execute(_transpile(stmt))
+        cursor.execute(_transpile(solution[-1]))
+        columns = [col[0] for col in cursor.description]
+        expected = ExpectedResult(*canonicalize_result(columns, cursor.fetchall()))
+        cursor.close()
+    except (SqlglotError, duckdb.Error, DuckDBUnavailable) as e:
+        database.close()
+        raise DuckDBUnavailable(str(e)) from e
+
+    expected_output = metadata.get("expected_output")
+    if expected_output:
+        reference = ExpectedResult(*canonicalize_result(expected_output[0], expected_output[1:]))
+        if not reference.matches(expected.columns, expected.rows, metadata.get("requires_order", False)):
+            database.close()
+            raise DuckDBUnavailable("Solution result on DuckDB differs from expected_output.")
+
+    return DuckDBProblem(database, expected)
+
+
+_problems = LRUCache(max_entries=settings.DUCKDB_ENGINE_CACHE_SIZE)
+_build_lock = threading.Lock()
+
+
+def get_duckdb_problem(problem_id):
+    """
+    Returns the cached `DuckDBProblem` for the problem's current version, or None if it
+    cannot be loaded (the reason is cached too). Builds are serialized, since loading a
+    large dataset is expensive and should happen once.
+    """
+    key = (problem_id, get_problem_content_hash(problem_id))
+    problem = _problems.get(key)
+    if problem is None:
+        with _build_lock:
+            problem = _problems.get(key)
+            if problem is None:
+                try:
+                    problem = build_duckdb_problem(problem_id)
+                except DuckDBUnavailable as e:
+                    logger.warning("Problem %s is graded on MySQL: %s", problem_id, e)
+                    problem = str(e)
+                _problems.set(key, problem)
+    return problem if isinstance(problem, DuckDBProblem) else None
+
+
+def check_user_query_duckdb(problem_id, precheck, metadata):
+    """
+    Grades a pre-checked submission on the problem's DuckDB database.
+
+    Meant for problems that set `"engine": "duckdb"` in metadata.json: window-function
+    and aggregation problems over 10^5-10^6 rows, which DuckDB's columnar engine answers
+    interactively without touching the production MySQL instance.
+
+    Features:
+    - The query is transpiled from MySQL with sqlglot; queries using constructs without
+      a faithful DuckDB equivalent are graded on MySQL.
+    - The time budget (`time_limit_ms`) is enforced by interrupting the cursor.
+    - Results go through the same row/byte caps and streaming comparator as on MySQL.
+
+    Returns:
+        QueryCheckResult (with `engine` 'duckdb'), or None when the query must be graded
+        on MySQL:
+        - the problem could not be loaded into DuckDB,
+        - a statement does not transpile,
+        - DuckDB raises an error other than a timeout (its type coercion and function
+          set differ from MySQL's, e.g. comparing a VARCHAR column with a number),
+        - the result is wrong and DUCKDB_ENGINE_CONFIRM_ON_MYSQL is set.
+    """
+    problem = get_duckdb_problem(problem_id)
+    if problem is None:
+        return None
+    try:
+        statements = [_transpile(stmt) for stmt in precheck.statements]
+    except DuckDBUnavailable:
+        return None  # no faithful DuckDB equivalent: MySQL decides
+
+    time_limit_ms = get_time_limit_ms(metadata)
+    cursor = problem.cursor()
+    timed_out = threading.Event()
+
+    def interrupt():
+        timed_out.set()
+        cursor.interrupt()
+
+    timer = threading.Timer(time_limit_ms / 1000.0, interrupt)
+    timer.start()
+    fetch = None
+    rows_transferred = 0
+    try:
+        for i, stmt in enumerate(statements):
+            cursor.execute(stmt)
+            fetch = BoundedFetch(cursor)
+            if i == len(statements) - 1:
+                matched, _ = compare_cursor_to_expected(cursor, problem.expected, metadata.get("requires_order", False), fetch)
+            else:
+                discard_rows(cursor, fetch)
+            rows_transferred += fetch.rows_transferred
+            record_transfer("grading", fetch)
+    except ResultLimitExceeded as e:
+        record_transfer("grading", fetch)
+        return QueryCheckResult(
+            False, f"Output limit exceeded: {e}", VERDICT_OUTPUT_LIMIT_EXCEEDED,
+            rows_transferred + fetch.rows_transferred, cacheable=True, engine=ENGINE_DUCKDB,
+        )
+    except duckdb.Error as e:
+        if timed_out.is_set():
+            return QueryCheckResult(
+                False, f"Time limit exceeded: query ran longer than {time_limit_ms} ms.",
+                VERDICT_TIME_LIMIT_EXCEEDED, engine=ENGINE_DUCKDB,
+            )
+        return None  # DuckDB may reject what MySQL accepts (implicit casts, MySQL-only functions)
+    finally:
+        timer.cancel()
+        cursor.close()
+
+    if matched:
+        return QueryCheckResult(True, "", rows_transferred=rows_transferred, cacheable=True, engine=ENGINE_DUCKDB)
+    if settings.DUCKDB_ENGINE_CONFIRM_ON_MYSQL:
+        return None
+    return QueryCheckResult(
+        False, "Output does not match expected result.", VERDICT_WRONG,
+        rows_transferred, cacheable=True, engine=ENGINE_DUCKDB,
+    )
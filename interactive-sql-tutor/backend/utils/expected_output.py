@@ -0,0 +1,160 @@
+from collections import Counter
+
+from django.conf import settings
+
+from utils.grading_timings import timed_stage
+from utils.lru_cache import LRUCache
+from utils.problem_loader import SAMPLE_DATASET, get_problem_content_hash, load_problem_bundle, load_problem_file
+from utils.result_fingerprint import canonicalize_result, ordered_fingerprint, unordered_fingerprint
+from utils.result_limits import BoundedFetch, record_transfer
+
+# The reference result only depends on the dataset and the solution query.
+EXPECTED_RESULT_FILES = ("problem.sql", "solution.sql")
+
+
+class ExpectedResult:
+    """
+    Canonicalized reference result of a problem's `solution.sql`.
+
+    Attributes:
+        columns (tuple[str]): Column names, sorted by name.
+        rows (list[tuple]): Canonical rows, in the order the solution returned them,
+                            projected into `columns` order.
+        ordered_fingerprint (str): Hash of the rows in order (for `requires_order`).
+        unordered_fingerprint (str): Multiset hash of the rows (order ignored).
+    """
+    __slots__ = ("columns", "rows", "ordered_fingerprint", "unordered_fingerprint", "_row_counts")
+
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+        self.ordered_fingerprint = ordered_fingerprint(rows)
+        self.unordered_fingerprint = unordered_fingerprint(rows)
+        self._row_counts = None
+
+    @property
+    def row_count(self):
+        return len(self.rows)
+
+    @property
+    def row_counts(self):
+        """
+        Multiset of the rows ({row: occurrences}), built once and used by the
+        streaming comparator for order-insensitive checks. Treat as read-only.
+        """
+        if self._row_counts is None:
+            self._row_counts = Counter(self.rows)
+        return self._row_counts
+
+    def matches(self, columns, rows, requires_order):
+        """
+        Checks a canonicalized result (from `canonicalize_result`) against this one.
+        """
+        if tuple(columns) != self.columns or len(rows) != self.row_count:
+            return False
+        if requires_order:
+            return ordered_fingerprint(rows) == self.ordered_fingerprint
+        return unordered_fingerprint(rows) == self.unordered_fingerprint
+
+
+_cache = LRUCache(max_entries=settings.EXPECTED_RESULT_CACHE_SIZE)
+
+
+def expected_result_key(problem_id, dataset_file=SAMPLE_DATASET):
+    """
+    Cache key for a problem's expected result on one dataset: the content hash of the
+    files it depends on (the dataset and `solution.sql`).
+    """
+    if dataset_file == SAMPLE_DATASET:
+        return (problem_id, get_problem_content_hash(problem_id, EXPECTED_RESULT_FILES))
+    return (problem_id, get_problem_content_hash(problem_id, (dataset_file, "solution.sql")))
+
+
+def compute_expected_result(cursor, problem_id):
+    """
+    Runs `solution.sql` on a cursor whose schema already holds the problem data,
+    and returns the canonicalized `ExpectedResult`.
+
+    The solution's result is subject to the same row/byte caps as user results
+    (raises `ResultLimitExceeded`).
+    """
+    solution_sql = load_problem_file(problem_id, "solution.sql")
+    cursor.execute(solution_sql)
+    columns = [col[0] for col in cursor.description]
+    fetch = BoundedFetch(cursor)
+    try:
+        return ExpectedResult(*canonicalize_result(columns, fetch))
+    finally:
+        record_transfer("solution", fetch)
+
+
+def get_expected_result(problem_id, cursor=None, dataset_file=SAMPLE_DATASET):
+    """
+    Returns the problem's `ExpectedResult`, executing `solution.sql` only when the
+    current content of `problem.sql`/`solution.sql` has not been seen before and the
+    problem's bundle (see `utils.problem_bundle`) has no result stored for it.
+
+    Parameters:
+        problem_id (int): The ID of the SQL problem.
+        cursor (MySQLCursor, optional): Cursor on a populated sandbox, used to compute the
+            result on a cache miss. When omitted and the result is not cached, None is returned.
+        dataset_file (str, optional): Dataset loaded in the sandbox, for problems with
+            hidden datasets (see `list_problem_datasets`); each has its own expected result.
+
+    Returns:
+        ExpectedResult or None
+
+    Example:
+        with problem_sandbox(problem_id) as (conn, cursor, _):
+            expected = get_expected_result(problem_id, cursor)   # computed once
+        get_expected_result(problem_id)                          # served from cache
+    """
+    key = expected_result_key(problem_id, dataset_file)
+    expected = _cache.get(key)
+    if expected is None:
+        bundle = load_problem_bundle(problem_id)
+        if bundle is not None:
+            expected = bundle.expected_result(dataset_file, key[1])
+        if expected is None and cursor is not None:
+            with timed_stage("solution"):
+                expected = compute_expected_result(cursor, problem_id)
+        if expected is not None:
+            _cache.set(key, expected)
+    return expected
+
+
+def store_expected_result(problem_id, expected):
+    """
+    Caches an `ExpectedResult` computed outside `get_expected_result`, e.g. by the
+    asyncio grader (`utils.async_sandbox`), under the problem's current key.
+    """
+    _cache.set(expected_result_key(problem_id), expected)
+
+
+def cached_expected_results(problem_id, dataset_files):
+    """
+    Returns the cached expected results of a problem's datasets, for packing them into
+    its bundle (`utils.problem_bundle.pack_problem_bundle`).
+
+    Returns:
+        dict: {dataset file: (content hash key, ExpectedResult)} for the datasets whose
+              result is cached.
+    """
+    results = {}
+    for dataset_file in dataset_files:
+        key = expected_result_key(problem_id, dataset_file)
+        expected = _cache.get(key)
+        if expected is not None:
+            results[dataset_file] = (key[1], expected)
+    return results
+
+
+def invalidate_expected_result(problem_id):
+    """
+    Removes every cached expected result of a problem, whatever its content hash.
+    """
+    _cache.discard_where(lambda key: key[0] == problem_id)
+
+
+def expected_result_cache_stats():
+    return _cache.stats()
@@ -1,11 +1,34 @@
 from django.conf import settings
-from google.cloud import storage
 
-def upload_problem_to_gcs(problem_id: int, files: dict):
-    folder = str(problem_id).zfill(3)
-    client = storage.Client()
-    bucket = storage.Client().bucket(settings.GCS_PROBLEM_BUCKET)
+from utils.problem_bundle import BUNDLE_FILE, pack_problem_bundle
+from utils.problem_catalog import catalog_file_entry, record_problem
+from utils.problem_storage import get_problem_storage, problem_object_name
 
-    for filename, content in files.items():
-        blob = bucket.blob(f"problems/{folder}/{filename}")
-        blob.upload_from_string(content, content_type="text/plain")
\ No newline at end of file
+def upload_problem_to_gcs(problem_id: int, files: dict, expected_results=None):
+    """
+    Writes a problem's files to problem storage (the GCS problem bucket unless
+    PROBLEM_STORAGE selects another backend, see `utils.problem_storage`), then records
+    them (generation, SHA-256, size) in the problem catalog, `utils.problem_catalog`.
+
+    With PROBLEM_UPLOAD_FORMAT = "bundle" (default) the files are packed into one
+    `problem.bundle` object together with their compiled setup statements and the
+    given expected results (see `utils.problem_bundle`); with "folder" each file is
+    its own object.
+
+    Parameters:
+        problem_id (int): The ID of the new problem.
+        files (dict): {filename: text content}, e.g. {"problem.sql": "...", "solution.sql": "..."}.
+        expected_results (dict, optional): {dataset file: (content hash key, ExpectedResult)}
+            to store in the bundle, see `utils.expected_output.cached_expected_results`.
+    """
+    if settings.PROBLEM_UPLOAD_FORMAT == "bundle":
+        objects = {BUNDLE_FILE: pack_problem_bundle(files, expected_results)}
+    else:
+        objects = files
+
+    storage = get_problem_storage()
+    cataloged = {}
+    for filename, content in objects.items():
+        generation = storage.put(problem_object_name(problem_id, filename), content)
+        cataloged[filename] = catalog_file_entry(content, generation)
+    record_problem(problem_id, cataloged)
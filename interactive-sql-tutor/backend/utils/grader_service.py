@@ -0,0 +1,220 @@
+import logging
+import os
+import signal
+import sys
+from multiprocessing.connection import AuthenticationError, Client, Listener
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from utils.grading_timings import grading_timer
+from utils.sandbox_pool import close_sandbox_pool
+from utils.sql_sandbox import VERDICT_TIME_LIMIT_EXCEEDED, QueryCheckResult
+from utils.verdict_cache import cached_check_user_query
+
+logger = logging.getLogger(__name__)
+
+
+class GraderServiceError(Exception):
+    """
+    Raised when the grader service failed to grade a submission.
+    """
+
+
+class GraderServiceUnavailable(GraderServiceError):
+    """
+    Raised when the grader service cannot be reached (not running, wrong authkey,
+    or its process died before answering).
+    """
+
+
+def _authkey():
+    return settings.GRADER_SERVICE_AUTHKEY.encode("utf-8")
+
+
+def check_via_grader_service(problem_id, user_query, socket_path=None, timeout=None):
+    """
+    Grades a submission in the grader service instead of the calling process.
+
+    One connection is opened per submission, so whichever grader process is idle
+    accepts it; nothing pins a web worker to a grader process.
+
+    Parameters:
+        problem_id (int): The ID of the SQL problem.
+        user_query (str): The SQL code submitted by the user.
+        socket_path (str, optional): Defaults to GRADER_SERVICE_SOCKET.
+        timeout (float, optional): Seconds to wait for the verdict; defaults to
+            GRADER_SERVICE_TIMEOUT_SECONDS.
+
+    Returns:
+        QueryCheckResult: Same result `cached_check_user_query` would return locally.
+        A submission not graded within `timeout` gets a (non-cacheable) time limit verdict.
+
+    Raises:
+        GraderServiceUnavailable: If the service cannot be reached.
+        GraderServiceError: If grading raised an error in the grader process.
+    """
+    socket_path = socket_path or settings.GRADER_SERVICE_SOCKET
+    timeout = timeout or settings.GRADER_SERVICE_TIMEOUT_SECONDS
+    try:
+        conn = Client(socket_path, family="AF_UNIX", authkey=_authkey())
+    except (OSError, AuthenticationError) as e:
+        raise GraderServiceUnavailable(f"Cannot connect to grader service at {socket_path}: {e}") from e
+
+    with conn:
+        try:
+            conn.send((problem_id, user_query))
+            if not conn.poll(timeout):
+                return QueryCheckResult(
+                    False, "Grading did not finish in time, please resubmit.", VERDICT_TIME_LIMIT_EXCEEDED,
+                )
+            reply = conn.recv()
+        except (EOFError, OSError) as e:
+            raise GraderServiceUnavailable(f"Grader service closed the connection: {e}") from e
+
+    status, payload = reply
+    if status != "ok":
+        raise GraderServiceError(payload)
+    return QueryCheckResult(*payload)
+
+
+def _handle_connection(conn):
+    """
+    Answers one `(problem_id, user_query)` request on an accepted connection.
+    """
+    try:
+        problem_id, user_query = conn.recv()
+    except (EOFError, OSError, ValueError):
+        return
+    try:
+        # Timed here rather than taken from the result: a cached result carries the
+        # timings of the run that first produced it
+        with grading_timer() as timer:
+            result = cached_check_user_query(problem_id, user_query)
+        reply = ("ok", (result.correct, result.message, result.verdict, result.rows_transferred,
+                        result.cacheable, result.engine, result.datasets, timer.as_dict()))
+    except Exception as e:
+        logger.exception("Grader service failed to grade problem %s", problem_id)
+        reply = ("error", f"{type(e).__name__}: {e}")
+    finally:
+        close_old_connections()
+    try:
+        conn.send(reply)
+    except OSError:
+        pass  # client gave up (timeout) or went away
+
+
+def serve_requests(listener, max_requests=None):
+    """
+    Accepts and answers grading requests, one at a time, until `max_requests` have
+    been served (forever if None). This is the body of each grader process.
+    """
+    served = 0
+    while max_requests is None or served < max_requests:
+        try:
+            conn = listener.accept()
+        except (AuthenticationError, EOFError, ConnectionError) as e:
+            logger.warning("Rejected grader service connection: %s", e)
+            continue
+        with conn:
+            _handle_connection(conn)
+        served += 1
+
+
+def _close_grader_process():
+    """
+    Releases what a grader process opened before it exits: the schemas of its sandbox
+    pool and its database connections. Interpreter exit handlers are not run (the
+    child leaves with os._exit), since those inherited through fork belong to the parent.
+    """
+    try:
+        close_sandbox_pool()
+    except Exception:
+        logger.exception("Grader process %s failed to close its sandbox pool", os.getpid())
+    connections.close_all()
+
+
+class GraderService:
+    """
+    A pre-forked pool of grader processes listening on one Unix socket.
+
+    Grading (sandbox provisioning, the user's query, the result comparison) then runs
+    in processes that own their MySQL connections, sandbox pool and caches, while
+    gunicorn workers only forward the submission and wait on a socket. Grading
+    capacity is the number of grader processes, scaled independently of the web tier.
+
+    Features:
+    - The listening socket is created once and shared by every child; the kernel
+      hands each connection to one idle child.
+    - A child exits after `max_requests` submissions (bounding memory growth) and
+      any child that exits is replaced.
+    - SIGTERM/SIGINT stop the children and remove the socket.
+
+    Parameters:
+        socket_path (str): Path of the Unix socket (GRADER_SERVICE_SOCKET).
+        processes (int): Number of grader processes.
+        max_requests (int, optional): Submissions served by a child before it is recycled.
+
+    Example:
+        GraderService("/run/sql-tutor/grader.sock", processes=8).serve_forever()
+    """
+
+    def __init__(self, socket_path, processes, max_requests=None):
+        self.socket_path = socket_path
+        self.processes = processes
+        self.max_requests = max_requests
+        self._children = set()
+        self._stopping = False
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        listener = Listener(self.socket_path, family="AF_UNIX", authkey=_authkey())
+        # Children must not inherit the parent's database connections
+        connections.close_all()
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        try:
+            for _ in range(self.processes):
+                self._spawn(listener)
+            while self._children:
+                pid, _ = os.wait()
+                self._children.discard(pid)
+                if not self._stopping:
+                    logger.info("Grader process %s exited, starting a replacement", pid)
+                    self._spawn(listener)
+        finally:
+            listener.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def _spawn(self, listener):
+        pid = os.fork()
+        if pid:
+            self._children.add(pid)
+            return
+        # Child: SIGTERM unwinds the stack, so open sandboxes are dropped by their
+        # context managers, and `_close_grader_process` releases the rest.
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        code = 0
+        try:
+            serve_requests(listener, self.max_requests)
+        except SystemExit:
+            pass
+        except Exception:
+            logger.exception("Grader process %s crashed", os.getpid())
+            code = 1
+        finally:
+            # Never return into the parent's code
+            _close_grader_process()
+            os._exit(code)
+
+    def _stop(self, *_):
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self._children.discard(pid)
@@ -0,0 +1,127 @@
+import logging
+
+from django.conf import settings
+
+from utils.grader_service import GraderServiceUnavailable, check_via_grader_service
+from utils.grading_timings import grading_timer, record_grading_timings, timed_stage
+from utils.sql_sandbox import VERDICT_CORRECT
+from utils.verdict_cache import cached_check_user_query
+
+logger = logging.getLogger(__name__)
+
+
+class GradingResult:
+    """
+    Immutable outcome of grading one submission.
+
+    This is the single object that carries the verdict of a submission from the
+    sandbox to every consumer (the API response, the serializer and the Attempt
+    row), so none of them need to re-run the user's query to learn the result.
+
+    Attributes:
+        verdict (str): 'correct', 'wrong', 'time_limit_exceeded' or 'output_limit_exceeded'.
+        feedback (str): Message returned by the checker (empty string if correct).
+        score (float): 100.0 if correct, 0.0 otherwise.
+        status (str): Attempt status, 'Completed' or 'Failed'.
+        timings (dict or None): Milliseconds per grading stage, plus "total" (see
+                                `utils.grading_timings`); not part of the JSON payload.
+
+    Example:
+        result = GradingResult(VERDICT_CORRECT, "")
+        result.score   # 100.0
+        result.status  # "Completed"
+    """
+    __slots__ = ("verdict", "feedback", "timings")
+
+    def __init__(self, verdict, feedback="", timings=None):
+        self.verdict = verdict
+        self.feedback = feedback
+        self.timings = timings
+
+    @property
+    def correct(self):
+        return self.verdict == VERDICT_CORRECT
+
+    @property
+    def score(self):
+        return 100.0 if self.correct else 0.0
+
+    @property
+    def status(self):
+        return "Completed" if self.correct else "Failed"
+
+    def as_response(self):
+        """
+        Returns the public JSON payload for the submit endpoint.
+        """
+        return {
+            "result": self.verdict,
+            "score": int(self.score),
+            "feedback": self.feedback,
+        }
+
+    def __repr__(self):
+        return f"GradingResult(verdict={self.verdict!r}, feedback={self.feedback!r})"
+
+
+class GradingPipeline:
+    """
+    Grades a single submission exactly once.
+
+    Every submission used to be checked twice: once in `AttemptSubmitView.post`
+    and again in `AttemptSerializer.create`, which built two sandbox schemas and
+    replayed `problem.sql` twice. The pipeline owns the one call to
+    `check_user_query()` and memoizes its result, so any number of consumers can
+    ask for the verdict without touching MySQL again.
+
+    The check itself goes through the verdict cache (`utils.verdict_cache`), so an
+    equivalent query already graded for the same problem version skips the sandbox.
+    When GRADER_SERVICE_SOCKET is set, the check runs in the grader service
+    (`utils.grader_service`) instead of this process; if the service is unreachable
+    the submission is graded locally, unless GRADER_SERVICE_FALLBACK_LOCAL is False.
+
+    The run is timed stage by stage (`utils.grading_timings`): the timings are attached
+    to the `GradingResult` and added to the problem's latency histograms. A verdict cache
+    hit only has a "precheck" stage; the grader service reports the stages it ran.
+
+    Parameters:
+        problem_id (int): The ID of the SQL problem being attempted.
+        user_query (str): The SQL code submitted by the user.
+
+    Example:
+        pipeline = GradingPipeline(problem_id, user_query)
+        result = pipeline.run()      # runs the sandbox
+        result = pipeline.run()      # returns the cached GradingResult
+        serializer.save(user=user, problem=problem, grading_result=result)
+    """
+
+    def __init__(self, problem_id, user_query):
+        self.problem_id = problem_id
+        self.user_query = user_query
+        self._result = None
+
+    def run(self):
+        """
+        Runs the sandboxed check on first call and returns the cached
+        `GradingResult` on every later call.
+        """
+        if self._result is None:
+            with grading_timer() as timer:
+                check = self._check(timer)
+            timings = timer.as_dict()
+            record_grading_timings(self.problem_id, timings)
+            self._result = GradingResult(check.verdict, check.message, timings)
+        return self._result
+
+    def _check(self, timer):
+        if settings.GRADER_SERVICE_SOCKET:
+            try:
+                with timed_stage("grader_service"):
+                    check = check_via_grader_service(self.problem_id, self.user_query)
+                timer.merge(check.timings)
+                return check
+            except GraderServiceUnavailable as e:
+                if not settings.GRADER_SERVICE_FALLBACK_LOCAL:
+                    raise
+                logger.warning("%s; grading locally", e)
+        return cached_check_user_query(self.problem_id, self.user_query)
@@ -0,0 +1,285 @@
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from sql_app.models import GradingJob
+from sql_app.serializers import AttemptSerializer
+from utils.grading import GradingPipeline
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+def enqueue_grading_job(user, problem, user_query, hints_used=0, time_taken=None):
+    """
+    Stores a submission in the GradingJob table and wakes up the in-process workers.
+
+    Parameters:
+        user (User): The submitting user.
+        problem (SQLProblem): The problem being attempted.
+        user_query (str): The submitted SQL.
+        hints_used (int): Hints used, copied to the Attempt.
+        time_taken (int, optional): Time taken in seconds, copied to the Attempt.
+
+    Returns:
+        GradingJob: The queued job; its `job_id` is what the client polls.
+    """
+    job = GradingJob.objects.create(
+        user=user,
+        problem=problem,
+        user_query=user_query,
+        hints_used=hints_used,
+        time_taken=time_taken,
+        status=JOB_QUEUED,
+    )
+    workers = ensure_grading_workers()
+    if workers is not None:
+        workers.notify()
+    return job
+
+
+def claim_next_job(worker_id):
+    """
+    Atomically claims the oldest queued job.
+
+    The row is locked with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers
+    (threads or processes, on any host) never claim the same job and never wait on
+    each other's locks.
+
+    Returns:
+        GradingJob or None if the queue is empty.
+    """
+    with transaction.atomic():
+        job = (
+            GradingJob.objects.select_for_update(skip_locked=True)
+            .filter(status=JOB_QUEUED)
+            .order_by("job_id")
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = JOB_RUNNING
+        job.worker_id = worker_id
+        job.started_at = timezone.now()
+        job.tries += 1
+        job.save(update_fields=["status", "worker_id", "started_at", "tries"])
+    return job
+
+
+def run_grading_job(job):
+    """
+    Grades a claimed job through `GradingPipeline` and records the Attempt with
+    `AttemptSerializer`, exactly as the synchronous submit path does.
+
+    An unexpected error puts the job back in the queue, or marks it failed after
+    GRADING_JOB_MAX_TRIES claims.
+    """
+    try:
+        result = GradingPipeline(job.problem_id, job.user_query).run()
+        serializer = AttemptSerializer(
+            data={"user_query": job.user_query, "hints_used": job.hints_used, "time_taken": job.time_taken},
+            partial=True,
+        )
+        serializer.is_valid(raise_exception=True)
+        attempt = serializer.save(user=job.user, problem=job.problem, grading_result=result)
+    except Exception:
+        logger.exception("Grading job %s failed (try %s)", job.job_id, job.tries)
+        job.status = JOB_FAILED if job.tries >= settings.GRADING_JOB_MAX_TRIES else JOB_QUEUED
+        job.feedback = "Grading failed, please resubmit." if job.status == JOB_FAILED else ""
+        job.finished_at = timezone.now() if job.status == JOB_FAILED else None
+        job.save(update_fields=["status", "feedback", "finished_at"])
+        return job
+
+    job.status = JOB_DONE
+    job.verdict = result.verdict
+    job.feedback = result.feedback
+    job.score = result.score
+    job.attempt = attempt
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "verdict", "feedback", "score", "attempt", "finished_at"])
+    return job
+
+
+def requeue_stale_jobs():
+    """
+    Returns jobs stuck in 'running' for longer than GRADING_JOB_TIMEOUT_SECONDS to the
+    queue (their worker died or was restarted), or fails them after
+    GRADING_JOB_MAX_TRIES claims.
+
+    Returns:
+        int: Number of jobs requeued or failed.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.GRADING_JOB_TIMEOUT_SECONDS)
+    stale = GradingJob.objects.filter(status=JOB_RUNNING, started_at__lt=cutoff)
+    failed = stale.filter(tries__gte=settings.GRADING_JOB_MAX_TRIES).update(
+        status=JOB_FAILED, feedback="Grading failed, please resubmit.", finished_at=timezone.now()
+    )
+    requeued = stale.update(status=JOB_QUEUED)
+    if failed or requeued:
+        logger.warning("Recovered stale grading jobs: %s requeued, %s failed", requeued, failed)
+    return failed + requeued
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return round(sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))], 1)
+
+
+def grading_queue_stats(window_seconds=None):
+    """
+    Returns queue depth and wait-time metrics, computed from the GradingJob table so
+    they cover every worker process.
+
+    Parameters:
+        window_seconds (int, optional): Jobs started in the last `window_seconds` are
+            used for wait-time percentiles; defaults to GRADING_QUEUE_METRICS_WINDOW_SECONDS.
+
+    Returns:
+        dict: queued, running, failed (in the window), oldest_queued_ms, and for the
+              window: started, wait_ms_p50, wait_ms_p95, wait_ms_max, run_ms_p50, run_ms_p95.
+    """
+    window_seconds = window_seconds or settings.GRADING_QUEUE_METRICS_WINDOW_SECONDS
+    now = timezone.now()
+    since = now - timedelta(seconds=window_seconds)
+
+    oldest = GradingJob.objects.filter(status=JOB_QUEUED).order_by("job_id").values_list("created_at", flat=True).first()
+    recent = list(
+        GradingJob.objects.filter(started_at__gte=since)
+        .values_list("created_at", "started_at", "finished_at")[:10000]
+    )
+    waits = sorted((started - created).total_seconds() * 1000 for created, started, _ in recent)
+    runs = sorted((finished - started).total_seconds() * 1000 for _, started, finished in recent if finished)
+
+    return {
+        "queued": GradingJob.objects.filter(status=JOB_QUEUED).count(),
+        "running": GradingJob.objects.filter(status=JOB_RUNNING).count(),
+        "failed": GradingJob.objects.filter(status=JOB_FAILED, finished_at__gte=since).count(),
+        "oldest_queued_ms": round((now - oldest).total_seconds() * 1000) if oldest else 0,
+        "window_seconds": window_seconds,
+        "started": len(waits),
+        "wait_ms_p50": _percentile(waits, 0.5),
+        "wait_ms_p95": _percentile(waits, 0.95),
+        "wait_ms_max": round(waits[-1], 1) if waits else None,
+        "run_ms_p50": _percentile(runs, 0.5),
+        "run_ms_p95": _percentile(runs, 0.95),
+    }
+
+
+class GradingWorkerPool:
+    """
+    A bounded pool of threads that grade jobs from the GradingJob table.
+
+    Each worker claims one job at a time (see `claim_next_job`), so at most `workers`
+    submissions are graded concurrently by this process, however many are queued.
+    Idle workers sleep until `notify()` is called (a job was enqueued in this
+    process) or `poll_interval` elapses (jobs enqueued by other processes).
+    Stale 'running' jobs are recovered on start and then periodically.
+
+    Parameters:
+        workers (int): Number of worker threads.
+        poll_interval (float): Seconds an idle worker waits before polling again.
+
+    Example:
+        pool = GradingWorkerPool(workers=4, poll_interval=1.0)
+        pool.start()
+        pool.notify()   # after enqueueing a job
+        pool.stop()
+    """
+
+    def __init__(self, workers, poll_interval):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._last_recovery = 0.0
+        self._worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(f"{self._worker_prefix}:{i}",),
+                                      name=f"grading-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def notify(self):
+        """
+        Wakes one idle worker.
+        """
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def stop(self, timeout=None):
+        """
+        Stops the workers after their current job.
+        """
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _recover_stale_jobs(self):
+        # At most once per timeout period across this pool's workers
+        now = time.monotonic()
+        if now - self._last_recovery < settings.GRADING_JOB_TIMEOUT_SECONDS / 2:
+            return
+        self._last_recovery = now
+        requeue_stale_jobs()
+
+    def _work(self, worker_id):
+        try:
+            while not self._stopping.is_set():
+                try:
+                    self._recover_stale_jobs()
+                    job = claim_next_job(worker_id)
+                    if job is not None:
+                        run_grading_job(job)
+                except Exception:
+                    logger.exception("Grading worker %s error", worker_id)
+                    job = None
+                finally:
+                    close_old_connections()
+                if job is None:
+                    with self._wakeup:
+                        self._wakeup.wait(self.poll_interval)
+        finally:
+            connection.close()
+
+
+_workers = None
+_workers_lock = threading.Lock()
+
+
+def ensure_grading_workers():
+    """
+    Returns the process-wide `GradingWorkerPool`, started on first use from settings
+    (GRADING_QUEUE_WORKERS, GRADING_QUEUE_POLL_SECONDS), or None when this process
+    does not run workers (GRADING_QUEUE_IN_PROCESS_WORKERS is False, e.g. when
+    `scripts/run_grading_workers.py` runs them instead).
+    """
+    global _workers
+    if not settings.GRADING_QUEUE_IN_PROCESS_WORKERS:
+        return None
+    if _workers is None:
+        with _workers_lock:
+            if _workers is None:
+                _workers = GradingWorkerPool(settings.GRADING_QUEUE_WORKERS, settings.GRADING_QUEUE_POLL_SECONDS)
+                _workers.start()
+                atexit.register(_workers.stop, 5)
+    return _workers
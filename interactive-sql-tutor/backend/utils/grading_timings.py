@@ -0,0 +1,201 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Upper bounds (ms) of the latency histogram buckets; a last, unbounded bucket follows
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# The timer of the grading run in progress, if any. A ContextVar (rather than a
+# threading.local) so it follows the run into asyncio tasks, `sync_to_async` threads and
+# dataset threads started with `contextvars.copy_context()`.
+_current_timer = ContextVar("grading_timer", default=None)
+
+
+class StageTimer:
+    """
+    Accumulates the wall time of the stages of one grading run, measured with
+    `time.perf_counter()` (monotonic).
+
+    Stages recorded by the grading path:
+        precheck        load metadata.json and pre-check the query
+        engine          grade on a non-MySQL backend (SQLite, DuckDB)
+        connect         open the sandbox connection
+        create_schema   CREATE SCHEMA + USE + session time budget
+        setup           replay the dataset, or clone the golden schema
+        solution        run solution.sql (expected-result cache misses only)
+        query           execute the user's statements
+        compare         fetch and compare the final SELECT's rows
+        drop_schema     DROP SCHEMA and close the connection
+        coalesced_wait  wait for an identical submission already being graded
+        grader_service  round trip to the grader service
+
+    A stage entered several times (e.g. once per hidden dataset, concurrently) is
+    summed, so the stages of a run with hidden datasets can add up to more than its total.
+    """
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self._durations[stage] = self._durations.get(stage, 0.0) + seconds
+
+    def merge(self, timings):
+        """
+        Adds the stages of a run measured elsewhere (e.g. in the grader service), as
+        returned by `as_dict`; its "total" is ignored.
+        """
+        for stage, ms in (timings or {}).items():
+            if stage != "total":
+                self.add(stage, ms / 1000.0)
+
+    def as_dict(self):
+        """
+        Returns {stage: milliseconds} in the order the stages were first entered, plus
+        "total": the time since the timer was created.
+        """
+        with self._lock:
+            timings = {stage: round(seconds * 1000, 2) for stage, seconds in self._durations.items()}
+        timings["total"] = round((time.perf_counter() - self._start) * 1000, 2)
+        return timings
+
+
+@contextmanager
+def grading_timer():
+    """
+    Context manager yielding the `StageTimer` of the current grading run: the active
+    one when called inside a run, otherwise a new timer that is active for the block.
+
+    Example:
+        with grading_timer() as timer:
+            result = check_user_query(problem_id, user_query)
+        timer.as_dict()   # {"precheck": 0.41, "connect": 2.1, ..., "total": 38.7}
+    """
+    timer = _current_timer.get()
+    if timer is not None:
+        yield timer
+        return
+    timer = StageTimer()
+    token = _current_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _current_timer.reset(token)
+
+
+@contextmanager
+def timed_stage(stage):
+    """
+    Context manager adding the wall time of its block to `stage` of the active timer.
+    Does nothing outside a grading run.
+
+    Example:
+        with timed_stage("connect"):
+            conn = mysql.connector.connect(**db_config)
+    """
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(stage, time.perf_counter() - start)
+
+
+def server_timing_header(timings):
+    """
+    Formats stage timings as a `Server-Timing` header value.
+
+    Example:
+        server_timing_header({"connect": 2.1, "query": 4.05, "total": 38.7})
+        # "connect;dur=2.1, query;dur=4.05, total;dur=38.7"
+    """
+    return ", ".join(f"{stage};dur={ms}" for stage, ms in timings.items())
+
+
+class LatencyHistogram:
+    """
+    Count of observations per LATENCY_BUCKETS_MS bucket, with their sum and maximum.
+    Percentiles are estimated as the upper bound of the bucket they fall in.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.sum_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, fraction):
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return 0.0
+
+    def snapshot(self):
+        labels = [str(bound) for bound in LATENCY_BUCKETS_MS] + ["+Inf"]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.sum_ms / self.count, 2) if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max_ms, 2),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+_histograms = {}  # problem_id -> {stage: LatencyHistogram}
+_histograms_lock = threading.Lock()
+
+
+def record_grading_timings(problem_id, timings):
+    """
+    Adds the stage timings of one graded submission to the problem's histograms.
+    """
+    with _histograms_lock:
+        stages = _histograms.setdefault(problem_id, {})
+        for stage, ms in timings.items():
+            histogram = stages.get(stage)
+            if histogram is None:
+                histogram = stages[stage] = LatencyHistogram()
+            histogram.observe(ms)
+
+
+def grading_latency_stats(problem_id=None):
+    """
+    Returns the per-problem, per-stage latency histograms of the submissions graded by
+    this process (each web process and grading queue worker keeps its own).
+
+    Parameters:
+        problem_id (int, optional): Only report this problem.
+
+    Returns:
+        dict: {problem_id: {stage: {"count", "mean_ms", "p50_ms", "p95_ms", "p99_ms",
+               "max_ms", "buckets": {"<upper bound ms>" or "+Inf": count}}}}
+    """
+    with _histograms_lock:
+        return {
+            pid: {stage: histogram.snapshot() for stage, histogram in stages.items()}
+            for pid, stages in _histograms.items()
+            if problem_id is None or pid == problem_id
+        }
+
+
+def reset_grading_latency_stats():
+    with _histograms_lock:
+        _histograms.clear()
@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded mapping with least-recently-used eviction and
+    hit/miss/eviction counters.
+
+    Used for the per-process caches on the grading path (expected results, verdicts,
+    problem content), where entries are cheap to recompute but expensive enough
+    that we never want to hold an unbounded number of them.
+
+    Parameters:
+        max_entries (int): Maximum number of entries; the least recently used entry
+                           is evicted when a new key would exceed it.
+
+    Example:
+        cache = LRUCache(max_entries=2)
+        cache.set("a", 1)
+        cache.get("a")       # 1 (hit)
+        cache.get("b")       # None (miss)
+        cache.stats()        # {"hits": 1, "misses": 1, "evictions": 0, "size": 1, "max_entries": 2}
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self._misses += 1
+                return default
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def discard_where(self, predicate):
+        """
+        Removes every entry whose key satisfies `predicate(key)`.
+        """
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "size": len(self._data),
+                "max_entries": self.max_entries,
+            }
@@ -0,0 +1,253 @@
+import base64
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from decimal import Decimal
+
+# A problem packed into one file, stored as "problems/<id:03>/problem.bundle" next to
+# (or instead of) the loose files of the folder layout.
+BUNDLE_FILE = "problem.bundle"
+BUNDLE_FORMAT = 1
+
+# Header: magic, format version, flags (unused), length of the compressed index
+_MAGIC = b"SQLTBNDL"
+_HEADER = struct.Struct("<8sHHI")
+
+# Section name prefixes
+_FILES = "files/"
+_SETUP = "setup/"
+_EXPECTED = "expected/"
+
+
+class BundleFormatError(ValueError):
+    """
+    Raised when a file is not a problem bundle, or one of an unsupported format version.
+    """
+
+
+class BundledFile:
+    """
+    A problem file read from a bundle, with the same fields the problem loader caches
+    for loose files: its text, parsed JSON (filled in by the loader) and SHA-256.
+    """
+    __slots__ = ("content", "parsed", "sha256")
+
+    def __init__(self, content, sha256):
+        self.content = content
+        self.parsed = None
+        self.sha256 = sha256
+
+
+def _encode_value(value):
+    # Canonical values (see utils.result_fingerprint.canonical_value) as JSON
+    if value is None or isinstance(value, (str, int)):
+        return value
+    if isinstance(value, Decimal):
+        return {"decimal": str(value)}
+    if isinstance(value, bytes):
+        return {"bytes": base64.b64encode(value).decode("ascii")}
+    raise TypeError(f"Cannot store {type(value).__name__} values in a problem bundle")
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if "decimal" in value:
+            return Decimal(value["decimal"])
+        return base64.b64decode(value["bytes"])
+    return value
+
+
+class ProblemBundle:
+    """
+    Read access to a packed problem bundle (see `pack_problem_bundle`).
+
+    Layout:
+        header   b"SQLTBNDL", format version (u16), flags (u16), index length (u32)
+        index    zlib-compressed JSON: {"sections": {name: {"offset", "length", "size", "sha256"}}},
+                 offsets counted from the end of the index
+        sections each zlib-compressed on its own:
+                 files/<filename>       a problem file (metadata.json, problem.sql, tests/x.sql, ...)
+                 setup/<dataset file>   the dataset's compiled setup statements
+                 expected/<dataset file> the dataset's expected result and fingerprints
+
+    Only the header and index are read when a bundle is opened; sections are
+    decompressed on first use and kept. Bundles on disk are memory-mapped
+    (`ProblemBundle.open`), so a section that is never used is never read.
+
+    Parameters:
+        buffer (bytes or mmap): The bundle.
+
+    Raises:
+        BundleFormatError: If `buffer` is not a bundle of a supported format version.
+
+    Example:
+        bundle = ProblemBundle.open("problems/042/problem.bundle")
+        bundle.file("solution.sql").content
+        bundle.compiled_setup("problem.sql")
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        if len(buffer) < _HEADER.size:
+            raise BundleFormatError("Truncated problem bundle")
+        magic, version, _, index_length = _HEADER.unpack_from(buffer)
+        if magic != _MAGIC:
+            raise BundleFormatError("Not a problem bundle")
+        if version != BUNDLE_FORMAT:
+            raise BundleFormatError(f"Unsupported problem bundle format {version}")
+        index = zlib.decompress(buffer[_HEADER.size:_HEADER.size + index_length])
+        self._sections = json.loads(index)["sections"]
+        self._data_start = _HEADER.size + index_length
+        self._files = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path):
+        """
+        Memory-maps a bundle file. The mapping stays valid if the file is replaced.
+        """
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def _read(self, name):
+        section = self._sections.get(name)
+        if section is None:
+            return None
+        start = self._data_start + section["offset"]
+        return zlib.decompress(self._buffer[start:start + section["length"]])
+
+    def _read_json(self, name):
+        data = self._read(name)
+        return json.loads(data) if data is not None else None
+
+    def filenames(self):
+        """
+        Names of the problem files in the bundle, e.g. ["metadata.json", "problem.sql", ...].
+        """
+        return sorted(name[len(_FILES):] for name in self._sections if name.startswith(_FILES))
+
+    def file(self, filename):
+        """
+        Returns a problem file as a `BundledFile`, or None if the bundle does not have it.
+        """
+        with self._lock:
+            bundled = self._files.get(filename)
+        if bundled is not None:
+            return bundled
+        data = self._read(_FILES + filename)
+        if data is None:
+            return None
+        bundled = BundledFile(data.decode("utf-8"), self._sections[_FILES + filename]["sha256"])
+        with self._lock:
+            return self._files.setdefault(filename, bundled)
+
+    def compiled_setup(self, dataset_file, sha256=None):
+        """
+        Returns the precompiled `CompiledSetup` of a dataset, or None if the bundle has
+        none (or, with `sha256`, none compiled from that version of the dataset).
+        """
+        from utils.setup_compiler import CompiledSetup
+
+        setup = self._read_json(_SETUP + dataset_file)
+        if setup is None or (sha256 is not None and setup["sha256"] != sha256):
+            return None
+        return CompiledSetup(setup["statements"], setup["source_statements"])
+
+    def expected_result(self, dataset_file, key):
+        """
+        Returns the stored `ExpectedResult` of a dataset if it was computed for content
+        hash `key` (see `utils.expected_output.expected_result_key`), otherwise None.
+        A result whose fingerprints no longer match its rows (e.g. packed before a
+        change to result canonicalization) is ignored.
+        """
+        from utils.expected_output import ExpectedResult
+
+        stored = self._read_json(_EXPECTED + dataset_file)
+        if stored is None or stored["key"] != key:
+            return None
+        rows = [tuple(_decode_value(value) for value in row) for row in stored["rows"]]
+        expected = ExpectedResult(tuple(stored["columns"]), rows)
+        if (expected.ordered_fingerprint, expected.unordered_fingerprint) != (
+                stored["ordered_fingerprint"], stored["unordered_fingerprint"]):
+            return None
+        return expected
+
+
+def pack_problem_bundle(files, expected_results=None):
+    """
+    Packs a problem into a bundle.
+
+    Besides the files, the bundle holds the compiled setup statements of every dataset
+    (`problem.sql` and `tests/*.sql`, see `utils.setup_compiler`) and, when given, the
+    expected results, so a process loading the bundle neither compiles the datasets
+    nor runs `solution.sql`.
+
+    Parameters:
+        files (dict): {filename: text content}, as in the folder layout.
+        expected_results (dict, optional): {dataset file: (content hash key, ExpectedResult)},
+            e.g. from `utils.expected_output.cached_expected_results`. Results with
+            values that cannot be stored are left out (computed on first use instead).
+
+    Returns:
+        bytes: The bundle.
+
+    Example:
+        data = pack_problem_bundle({"metadata.json": "...", "problem.sql": "...", "solution.sql": "..."})
+        ProblemBundle(data).file("solution.sql").content
+    """
+    from utils.setup_compiler import compile_setup_script
+
+    sections = {}
+    for filename, content in sorted(files.items()):
+        sections[_FILES + filename] = content.encode("utf-8")
+        if filename == "problem.sql" or (filename.startswith("tests/") and filename.endswith(".sql")):
+            compiled = compile_setup_script(content)
+            sections[_SETUP + filename] = json.dumps({
+                "sha256": hashlib.sha256(sections[_FILES + filename]).hexdigest(),
+                "statements": list(compiled.statements),
+                "source_statements": compiled.source_statements,
+            }).encode("utf-8")
+    for dataset_file, (key, expected) in sorted((expected_results or {}).items()):
+        try:
+            rows = [[_encode_value(value) for value in row] for row in expected.rows]
+        except TypeError:
+            continue
+        sections[_EXPECTED + dataset_file] = json.dumps({
+            "key": key,
+            "columns": list(expected.columns),
+            "rows": rows,
+            "ordered_fingerprint": expected.ordered_fingerprint,
+            "unordered_fingerprint": expected.unordered_fingerprint,
+        }).encode("utf-8")
+
+    compressed = {name: zlib.compress(data, 6) for name, data in sections.items()}
+    index = {}
+    offset = 0
+    for name, data in compressed.items():
+        index[name] = {"offset": offset, "length": len(data), "size": len(sections[name]),
+                       "sha256": hashlib.sha256(sections[name]).hexdigest()}
+        offset += len(data)
+    packed_index = zlib.compress(json.dumps({"sections": index}, sort_keys=True).encode("utf-8"), 6)
+    return b"".join([_HEADER.pack(_MAGIC, BUNDLE_FORMAT, 0, len(packed_index)), packed_index, *compressed.values()])
+
+
+def read_problem_folder(path):
+    """
+    Reads the files of a problem folder (folder layout) into {filename: text content},
+    with "/" separated names (e.g. "tests/ties.sql"). An existing bundle in the folder
+    is not included.
+    """
+    files = {}
+    for folder, _, filenames in os.walk(path):
+        for filename in filenames:
+            full_path = os.path.join(folder, filename)
+            name = os.path.relpath(full_path, path).replace(os.sep, "/")
+            if name == BUNDLE_FILE or filename.startswith("."):
+                continue
+            with open(full_path, "r", encoding="utf-8") as f:
+                files[name] = f.read()
+    return files
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from utils.problem_storage import PROBLEM_PREFIX, StorageConflict, get_problem_storage
+
+# The catalog is a single object next to the problem folders. Its name has no numeric
+# folder, so listings of problems/ never mistake it for a problem.
+CATALOG_OBJECT = f"{PROBLEM_PREFIX}catalog.json"
+CATALOG_FORMAT = 1
+
+# Row of the ProblemIdSequence table that problem IDs are allocated from
+_SEQUENCE_NAME = "problem"
+
+# Attempts of a catalog read-modify-write before giving up (each retry follows a
+# concurrent write by another uploader)
+_MAX_WRITE_ATTEMPTS = 10
+
+
+class _CachedCatalog:
+    __slots__ = ("generation", "problems", "checked_at")
+
+    def __init__(self, generation, problems):
+        self.generation = generation
+        self.problems = problems
+        self.checked_at = time.monotonic()
+
+
+_catalogs = {}  # storage location -> _CachedCatalog
+_catalogs_lock = threading.Lock()
+
+
+def catalog_file_entry(content, generation):
+    """
+    Catalog record of one problem file: its generation in problem storage, the
+    SHA-256 of its content and its size in bytes.
+
+    Example:
+        catalog_file_entry("SELECT 1", 1712345678)
+        # {"generation": 1712345678, "sha256": "...", "size": 8}
+    """
+    data = content if isinstance(content, bytes) else content.encode("utf-8")
+    return {"generation": generation, "sha256": hashlib.sha256(data).hexdigest(), "size": len(data)}
+
+
+def _read_catalog(storage):
+    for attempt in range(2):
+        generation = storage.generation(CATALOG_OBJECT)
+        if generation is None:
+            return 0, {}
+        try:
+            content = storage.get(CATALOG_OBJECT, generation)
+            break
+        except FileNotFoundError:
+            if attempt:
+                raise  # rewritten twice in between; let the caller retry
+    return generation, json.loads(content)["problems"]
+
+
+def get_problem_catalog():
+    """
+    Returns the problem catalog of problem storage: one index object
+    (`problems/catalog.json`) recording, for every uploaded problem, its files with
+    their generation, SHA-256 and size.
+
+    The catalog is the invalidation source of the problem caches: the problem loader
+    reads cataloged files by the generation recorded here, and
+    `get_problem_content_hash` (which versions golden schemas, expected results,
+    verdicts and the SQLite/DuckDB engines) uses the recorded hashes instead of
+    hashing the files. Checking every file of every problem therefore costs one
+    metadata request for the catalog, made at most every
+    PROBLEM_CATALOG_REVALIDATE_SECONDS per process.
+
+    Returns:
+        dict: {"042": {"files": {filename: {"generation", "sha256", "size"}}}}.
+              Shared by every caller until the catalog changes, so it must not be modified.
+
+    Example:
+        get_problem_catalog()["042"]["files"]["solution.sql"]["sha256"]
+    """
+    storage = get_problem_storage()
+    with _catalogs_lock:
+        cached = _catalogs.get(storage.location)
+    if cached is not None and time.monotonic() - cached.checked_at < settings.PROBLEM_CATALOG_REVALIDATE_SECONDS:
+        return cached.problems
+
+    if cached is not None and (storage.generation(CATALOG_OBJECT) or 0) == cached.generation:
+        cached.checked_at = time.monotonic()
+        return cached.problems
+
+    catalog = _CachedCatalog(*_read_catalog(storage))
+    with _catalogs_lock:
+        _catalogs[storage.location] = catalog
+    return catalog.problems
+
+
+def catalog_entry(problem_id):
+    """
+    Returns the catalog record of a problem ({"files": {...}}), or None if the problem
+    is not cataloged (not uploaded, or only in the local `problems/` folder).
+    """
+    return get_problem_catalog().get(str(problem_id).zfill(3))
+
+
+def catalog_file(problem_id, filename):
+    """
+    Returns the catalog record of one problem file ({"generation", "sha256", "size"}),
+    or None if it is not cataloged.
+    """
+    entry = catalog_entry(problem_id)
+    return entry["files"].get(filename) if entry is not None else None
+
+
+def record_problem(problem_id, files):
+    """
+    Adds a problem to the catalog, or replaces its record.
+
+    The catalog object is rewritten with a generation precondition, so concurrent
+    uploads never overwrite each other's records: a writer that lost the race reads
+    the new catalog and tries again.
+
+    Parameters:
+        problem_id (int): The ID of the problem.
+        files (dict): {filename: record}, records built with `catalog_file_entry`.
+
+    Raises:
+        StorageConflict: If the catalog kept changing for _MAX_WRITE_ATTEMPTS attempts.
+    """
+    storage = get_problem_storage()
+    for attempt in range(_MAX_WRITE_ATTEMPTS):
+        generation, problems = _read_catalog(storage)
+        problems = {**problems, str(problem_id).zfill(3): {"files": files}}
+        content = json.dumps({"format": CATALOG_FORMAT, "problems": problems}, sort_keys=True)
+        try:
+            generation = storage.put(CATALOG_OBJECT, content, if_generation_match=generation)
+        except StorageConflict:
+            if attempt == _MAX_WRITE_ATTEMPTS - 1:
+                raise
+            continue
+        with _catalogs_lock:
+            _catalogs[storage.location] = _CachedCatalog(generation, problems)
+        return
+
+
+def rebuild_problem_catalog():
+    """
+    Rebuilds the catalog from one full listing of problem storage, downloading every
+    problem file to hash it. Used to catalog problems uploaded before the catalog
+    existed, or after files were edited in the bucket directly.
+
+    Returns:
+        int: Number of problems cataloged.
+    """
+    storage = get_problem_storage()
+    problems = {}
+    for name, generation in storage.list(PROBLEM_PREFIX):
+        parts = name[len(PROBLEM_PREFIX):].split("/", 1)
+        if len(parts) < 2 or not parts[0].isdigit():
+            continue  # the catalog itself
+        content = storage.get_bytes(name, generation)
+        problems.setdefault(parts[0], {"files": {}})["files"][parts[1]] = catalog_file_entry(content, generation)
+
+    for attempt in range(_MAX_WRITE_ATTEMPTS):
+        current = storage.generation(CATALOG_OBJECT) or 0
+        content = json.dumps({"format": CATALOG_FORMAT, "problems": problems}, sort_keys=True)
+        try:
+            generation = storage.put(CATALOG_OBJECT, content, if_generation_match=current)
+            break
+        except StorageConflict:
+            if attempt == _MAX_WRITE_ATTEMPTS - 1:
+                raise
+    with _catalogs_lock:
+        _catalogs[storage.location] = _CachedCatalog(generation, problems)
+    return len(problems)
+
+
+def _first_free_problem_id():
+    from sql_app.models import SQLProblem
+    from utils.problem_loader import get_next_problem_id
+
+    cataloged = max((int(folder) for folder in get_problem_catalog()), default=0)
+    in_database = max(SQLProblem.objects.values_list("problem_id", flat=True), default=0)
+    return max(get_next_problem_id(), cataloged + 1, in_database + 1)
+
+
+def allocate_problem_id():
+    """
+    Allocates a new, never used problem ID from the ProblemIdSequence table.
+
+    The sequence row is locked (SELECT ... FOR UPDATE) while it is incremented, so
+    concurrent uploads get distinct IDs without listing problem storage. The first
+    allocation seeds the row from the problems that already exist (local folders,
+    problem storage, the catalog and the SQLProblem table); that is the only full
+    listing, once per database.
+
+    Returns:
+        int: The new problem ID.
+
+    Example:
+        new_id = allocate_problem_id()   # e.g. 43
+    """
+    from sql_app.models import ProblemIdSequence
+
+    while True:
+        with transaction.atomic():
+            sequence = ProblemIdSequence.objects.select_for_update().filter(name=_SEQUENCE_NAME).first()
+            if sequence is not None:
+                problem_id = sequence.next_id
+                sequence.next_id = problem_id + 1
+                sequence.save(update_fields=["next_id"])
+                return problem_id
+        try:
+            with transaction.atomic():
+                ProblemIdSequence.objects.create(name=_SEQUENCE_NAME, next_id=_first_free_problem_id())
+        except IntegrityError:
+            pass  # seeded by a concurrent upload
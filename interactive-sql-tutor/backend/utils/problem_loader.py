@@ -1,30 +1,371 @@
-import os, json
+import os, json, hashlib, threading, time
 from django.conf import settings
-from google.cloud import storage
+
+from utils.lru_cache import LRUCache
+from utils.problem_bundle import BUNDLE_FILE, ProblemBundle
+from utils.problem_catalog import catalog_entry, catalog_file
+from utils.problem_storage import PROBLEM_PREFIX, get_problem_storage, problem_object_name
+
+# Local files modified this recently are re-read on every call: a rewrite within the
+# filesystem's timestamp granularity could keep the same mtime and size.
+_RACY_MTIME_SECONDS = 2.0
+
+class _CachedFile:
+    __slots__ = ("version", "content", "parsed", "sha256", "checked_at")
+
+    def __init__(self, version, content, sha256=None):
+        self.version = version
+        self.content = content
+        self.parsed = None
+        self.sha256 = sha256
+        self.checked_at = time.monotonic()
+
+# (location, path) -> _CachedFile, where location is "local", "mirror" or a problem
+# storage location (e.g. "gs://bucket"). The content of a cached bundle is its ProblemBundle.
+_content_cache = LRUCache(max_entries=settings.PROBLEM_CONTENT_CACHE_SIZE)
+_stale = 0
+_stale_lock = threading.Lock()
+
+def _count_stale():
+    global _stale
+    with _stale_lock:
+        _stale += 1
+
+def _read_path(path):
+    # Bundles are memory-mapped; other problem files are text
+    if os.path.basename(path) == BUNDLE_FILE:
+        return ProblemBundle.open(path)
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+def _read_stored(storage, name, generation):
+    if name.endswith("/" + BUNDLE_FILE):
+        return ProblemBundle(storage.get_bytes(name, generation))
+    return storage.get(name, generation)
+
+def _load_local_file(local_path, st):
+    key = ("local", local_path)
+    version = (st.st_mtime_ns, st.st_size)
+    cached = _content_cache.get(key)
+    if cached is not None and cached.version == version:
+        return cached
+    if cached is not None:
+        _count_stale()
+
+    entry = _CachedFile(version, _read_path(local_path))
+    if time.time() - st.st_mtime >= _RACY_MTIME_SECONDS:
+        _content_cache.set(key, entry)
+    return entry
+
+def _load_mirrored_file(mirror, name, problem_id, filename, cataloged):
+    try:
+        found = mirror.get(name, cataloged["generation"] if cataloged is not None else None)
+    except FileNotFoundError:
+        # Rewritten since the catalog was read; fall back to its current generation
+        found = mirror.get(name, mirror.storage.generation(name))
+    if found is None:
+        raise FileNotFoundError(f"{filename} not found locally or in problem storage for problem {problem_id}")
+    generation, path = found
+
+    key = ("mirror", name)
+    cached = _content_cache.get(key)
+    if cached is not None and cached.version == generation:
+        return cached
+    if cached is not None:
+        _count_stale()
+
+    entry = _CachedFile(generation, _read_path(path), _cataloged_sha256(cataloged, generation))
+    _content_cache.set(key, entry)
+    return entry
+
+def _cataloged_sha256(cataloged, generation):
+    return cataloged["sha256"] if cataloged is not None and cataloged["generation"] == generation else None
+
+def _load_stored_file(name, problem_id, filename):
+    from utils.problem_mirror import get_problem_mirror
+
+    cataloged = catalog_file(problem_id, filename)
+    mirror = get_problem_mirror()
+    if mirror is not None:
+        return _load_mirrored_file(mirror, name, problem_id, filename, cataloged)
+
+    storage = get_problem_storage()
+    key = (storage.location, name)
+    cached = _content_cache.get(key)
+
+    # Cataloged files are read by the generation the catalog records: no request at all
+    # while it is unchanged
+    if cataloged is not None:
+        generation = cataloged["generation"]
+        if cached is not None and cached.version == generation:
+            return cached
+        try:
+            content = _read_stored(storage, name, generation)
+        except FileNotFoundError:
+            pass  # rewritten without updating the catalog; fall back to its current generation
+        else:
+            if cached is not None:
+                _count_stale()
+            entry = _CachedFile(generation, content, cataloged["sha256"])
+            _content_cache.set(key, entry)
+            return entry
+
+    if cached is not None and time.monotonic() - cached.checked_at < settings.PROBLEM_CONTENT_GCS_REVALIDATE_SECONDS:
+        return cached
+
+    # One metadata request; the object is only downloaded when its generation changed
+    for attempt in range(2):
+        generation = storage.generation(name)
+        if generation is None:
+            if cached is not None:
+                _content_cache.pop(key)
+            raise FileNotFoundError(f"{filename} not found locally or in problem storage for problem {problem_id}")
+        if cached is not None and cached.version == generation:
+            cached.checked_at = time.monotonic()
+            return cached
+        try:
+            content = _read_stored(storage, name, generation)
+            break
+        except FileNotFoundError:
+            if attempt:
+                raise  # rewritten twice in between; let the caller retry
+    if cached is not None:
+        _count_stale()
+
+    entry = _CachedFile(generation, content)
+    _content_cache.set(key, entry)
+    return entry
+
+def _local_problem_dir(problem_id):
+    return os.path.join(settings.BASE_DIR, "problems", str(problem_id).zfill(3))
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+def _from_bundle(bundle_entry, problem_id, filename):
+    bundled = bundle_entry.content.file(filename)
+    if bundled is None:
+        raise FileNotFoundError(f"{filename} not found in the bundle of problem {problem_id}")
+    return bundled
+
+def _load_stored_bundle(problem_id):
+    return _load_stored_file(problem_object_name(problem_id, BUNDLE_FILE), problem_id, BUNDLE_FILE)
+
+def _load_stored_entry(problem_id, filename):
+    cataloged = catalog_entry(problem_id)
+    if cataloged is not None and BUNDLE_FILE in cataloged["files"]:
+        return _from_bundle(_load_stored_bundle(problem_id), problem_id, filename)
+    try:
+        return _load_stored_file(problem_object_name(problem_id, filename), problem_id, filename)
+    except FileNotFoundError:
+        if cataloged is not None:
+            raise
+    # Not cataloged: the problem may be stored as a bundle
+    try:
+        bundle_entry = _load_stored_bundle(problem_id)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"{filename} not found locally or in problem storage for problem {problem_id}") from None
+    return _from_bundle(bundle_entry, problem_id, filename)
+
+def _load_entry(problem_id, filename):
+    local_dir = _local_problem_dir(problem_id)
+
+    # 1. Attempt to load from the local filesystem first: a loose file, then the bundle
+    local_path = os.path.join(local_dir, filename)
+    st = _stat(local_path)
+    if st is not None:
+        return _load_local_file(local_path, st)
+    bundle_path = os.path.join(local_dir, BUNDLE_FILE)
+    st = _stat(bundle_path)
+    if st is not None:
+        return _from_bundle(_load_local_file(bundle_path, st), problem_id, filename)
+
+    # 2. If not found, fallback to loading from problem storage (GCS by default)
+    return _load_stored_entry(problem_id, filename)
+
+def load_problem_bundle(problem_id):
+    """
+    Returns the problem's `ProblemBundle` (see `utils.problem_bundle`): a local
+    `problems/<id>/problem.bundle`, or, for problems without a local folder, a bundle
+    the problem catalog lists in problem storage. None if the problem is not packed.
+    Cached like the problem files.
+
+    Example:
+        bundle = load_problem_bundle(42)
+        compiled = bundle.compiled_setup("problem.sql") if bundle is not None else None
+    """
+    local_dir = _local_problem_dir(problem_id)
+    bundle_path = os.path.join(local_dir, BUNDLE_FILE)
+    st = _stat(bundle_path)
+    if st is not None:
+        return _load_local_file(bundle_path, st).content
+    if os.path.isdir(local_dir):
+        return None  # local folder layout
+    cataloged = catalog_entry(problem_id)
+    if cataloged is not None and BUNDLE_FILE in cataloged["files"]:
+        return _load_stored_bundle(problem_id).content
+    return None
 
 def load_problem_file(problem_id, filename, parse_json=False):
-    folder = str(problem_id).zfill(3)
-    local_path = os.path.join(settings.BASE_DIR, "problems", folder, filename)
+    """
+    Returns the content of a problem file, from the local `problems/` folder or, when
+    it is not there, from problem storage (the GCS problem bucket, see
+    `utils.problem_storage`).
 
-    # 1. Attempt to load from the local filesystem first
-    if os.path.exists(local_path):
-        with open(local_path, "r", encoding="utf-8") as f:
-            content = f.read()
-    else:
-        # 2. If not found, fallback to loading from Google Cloud Storage (GCS)
-        client = storage.Client()
-        bucket = client.bucket(settings.GCS_PROBLEM_BUCKET)
-        blob = bucket.blob(f"problems/{folder}/{filename}")
-        if not blob.exists():
-            raise FileNotFoundError(f"{filename} not found in local or GCS for problem {problem_id}")
-        content = blob.download_as_text()
-
-    # 3. If the file is a JSON file, parse and return it as a Python dictionary
+    Both problem layouts are accepted: loose files (`problems/042/solution.sql`) and
+    a packed bundle (`problems/042/problem.bundle`, see `utils.problem_bundle`), which
+    loads every file of the problem with one read. Loose files take precedence.
+
+    Files are cached per process (PROBLEM_CONTENT_CACHE_SIZE files, least recently
+    used evicted) together with their parsed JSON, and revalidated before reuse:
+    - local files by mtime and size (one `stat` per call);
+    - stored objects listed in the problem catalog (`utils.problem_catalog`) by the
+      generation it records, so they cost no request while the catalog is unchanged;
+    - other stored objects by generation number, at most every
+      PROBLEM_CONTENT_GCS_REVALIDATE_SECONDS; only a changed object is downloaded again.
+    - With PROBLEM_MIRROR_DIR set, stored objects are read from the local mirror
+      (`utils.problem_mirror`) instead, by the generation it last synced (or the
+      cataloged one, when newer); problem storage is only contacted for files the
+      mirror does not have yet.
+
+    Parameters:
+        problem_id (int): The ID of the SQL problem.
+        filename (str): File in the problem folder, e.g. "solution.sql" or "tests/ties.sql".
+        parse_json (bool): Return the parsed JSON instead of the raw text.
+
+    Returns:
+        str, or the parsed JSON with `parse_json`. The parsed object is shared by every
+        caller until the file changes, so it must not be modified.
+
+    Raises:
+        FileNotFoundError: If the file is neither on disk nor in problem storage.
+    """
+    entry = _load_entry(problem_id, filename)
+
+    # If the file is a JSON file, parse it once per version
     if parse_json:
-        return json.loads(content)
-    return content
+        if entry.parsed is None:
+            entry.parsed = json.loads(entry.content)
+        return entry.parsed
+    return entry.content
+
+def problem_content_cache_stats():
+    """
+    Returns the problem file cache counters: hits, misses, evictions, size,
+    max_entries, and stale (cached files found changed and reloaded).
+    """
+    stats = _content_cache.stats()
+    with _stale_lock:
+        stats["stale"] = _stale
+    return stats
+
+def load_problem_metadata(problem_id):
+    """
+    Returns the problem's parsed metadata.json, or an empty dict if it has none.
+    """
+    try:
+        return load_problem_file(problem_id, "metadata.json", parse_json=True)
+    except FileNotFoundError:
+        return {}
+
+PROBLEM_FILES = ("metadata.json", "problem.sql", "solution.sql")
+
+# The visible sample dataset; hidden datasets live in tests/<name>.sql
+SAMPLE_DATASET = "problem.sql"
+DATASET_DIR = "tests"
+
+def list_problem_datasets(problem_id, metadata=None):
+    """
+    Returns the dataset files a submission is graded on: `problem.sql` first, then the
+    problem's hidden datasets.
+
+    Hidden datasets are listed by name in metadata.json (`"datasets": ["edge_cases", ...]`,
+    each stored as `tests/<name>.sql`); without that key, the `tests/*.sql` files of the
+    local problem folder, or else of the problem's bundle, are used, in name order.
+    Problems stored in GCS in the folder layout must list their datasets in metadata.json.
+
+    Parameters:
+        problem_id (int): The ID of the SQL problem.
+        metadata (dict, optional): The problem's metadata.json, if already loaded.
+
+    Example:
+        list_problem_datasets(3)   # ["problem.sql", "tests/empty.sql", "tests/ties.sql"]
+    """
+    if metadata is None:
+        metadata = load_problem_metadata(problem_id)
+    names = metadata.get("datasets")
+    if names is None:
+        local_dir = os.path.join(_local_problem_dir(problem_id), DATASET_DIR)
+        if os.path.isdir(local_dir):
+            names = sorted(f[:-4] for f in os.listdir(local_dir) if f.endswith(".sql"))
+        else:
+            bundle = load_problem_bundle(problem_id)
+            prefix = DATASET_DIR + "/"
+            names = [f[len(prefix):-4] for f in bundle.filenames()
+                     if f.startswith(prefix) and f.endswith(".sql")] if bundle is not None else []
+    return [SAMPLE_DATASET] + [f"{DATASET_DIR}/{name}.sql" for name in names]
+
+def dataset_name(dataset_file):
+    """
+    Display name of a dataset file: "sample" for problem.sql, otherwise the file name
+    without directory and extension ("tests/edge_cases.sql" -> "edge_cases").
+    """
+    if dataset_file == SAMPLE_DATASET:
+        return "sample"
+    return os.path.splitext(os.path.basename(dataset_file))[0]
+
+def get_problem_file_sha256(problem_id, filename):
+    """
+    Returns the SHA-256 hex digest of a problem file's content.
+
+    Cataloged files use the digest recorded in the problem catalog, without reading
+    the file, and bundled files the one recorded in the bundle; other files are hashed
+    once per version and the digest is cached with their content.
+
+    Raises:
+        FileNotFoundError: If the file is neither on disk nor in problem storage.
+    """
+    local_dir = _local_problem_dir(problem_id)
+    if not os.path.exists(os.path.join(local_dir, filename)) and not os.path.exists(os.path.join(local_dir, BUNDLE_FILE)):
+        cataloged = catalog_file(problem_id, filename)
+        if cataloged is not None:
+            return cataloged["sha256"]
+    entry = _load_entry(problem_id, filename)
+    if entry.sha256 is None:
+        entry.sha256 = hashlib.sha256(entry.content.encode("utf-8")).hexdigest()
+    return entry.sha256
+
+def get_problem_content_hash(problem_id, filenames=PROBLEM_FILES):
+    """
+    Returns a SHA-256 hex digest over the content of a problem's files (the digest of
+    their names and per-file SHA-256, see `get_problem_file_sha256`).
+
+    The digest changes whenever any of the given files changes, so it can be used to
+    version anything derived from the problem (materialized schemas, cached results).
+    For uploaded problems it follows the problem catalog: a new catalog record
+    invalidates everything derived from the old files.
+
+    Parameters:
+        problem_id (int): The ID of the SQL problem.
+        filenames (tuple[str]): Which problem files to include, in order.
+
+    Example:
+        get_problem_content_hash(1)                   # all three files
+        get_problem_content_hash(1, ("problem.sql",))  # dataset only
+    """
+    digest = hashlib.sha256()
+    for filename in filenames:
+        digest.update(filename.encode("utf-8") + b"\0")
+        digest.update(get_problem_file_sha256(problem_id, filename).encode("ascii") + b"\0")
+    return digest.hexdigest()
 
 def get_next_problem_id():
+    # Full scan of every problem folder and stored object. Uploads allocate IDs with
+    # utils.problem_catalog.allocate_problem_id, which only calls this to seed its sequence.
+
     # Get the maximum problem ID from local filesystem (e.g., /problems/001/, /problems/002/, ...)
     local_root = os.path.join(settings.BASE_DIR, "problems")
     if os.path.exists(local_root):
@@ -36,12 +377,10 @@ def get_next_problem_id():
     else:
         local_max = 0
 
-    # Get the maximum problem ID from GCS by scanning the 'problems/' folder prefix
-    client = storage.Client()
-    bucket = client.bucket(settings.GCS_PROBLEM_BUCKET)
+    # Get the maximum problem ID from problem storage by scanning the 'problems/' folder prefix
     gcs_ids = set()
-    for blob in bucket.list_blobs(prefix="problems/"):
-        parts = blob.name.split("/")
+    for name, _ in get_problem_storage().list(PROBLEM_PREFIX):
+        parts = name.split("/")
         if len(parts) > 1 and parts[1].isdigit():
             gcs_ids.add(int(parts[1]))
     gcs_max = max(gcs_ids, default=0)
@@ -0,0 +1,227 @@
+import atexit
+import json
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+from utils.problem_storage import PROBLEM_PREFIX, get_problem_storage
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+
+
+class ProblemMirror:
+    """
+    Local on-disk copy of the `problems/` prefix of problem storage (the GCS problem
+    bucket, see `utils.problem_storage`), so problem files are read from disk instead
+    of downloaded by every cold worker.
+
+    Features:
+    - A manifest (`<root>/manifest.json`) records the generation of every mirrored
+      object; it survives restarts, so a warm mirror is usable immediately.
+    - `sync()` lists the prefix once (the listing carries generation numbers) and only
+      downloads objects whose generation changed; objects deleted from storage are
+      removed from the mirror. `start()` runs it in a background thread every
+      `sync_interval` seconds.
+    - `get()` serves from the mirror and falls back to storage on a miss (e.g. a problem
+      uploaded since the last sync, or a file whose generation in the problem catalog
+      is newer than the mirrored one), mirroring the object it fetched.
+    - Files are downloaded to a temporary name and renamed into place, so readers
+      (and other processes sharing the directory) never see a partial file.
+
+    Parameters:
+        root (str): Mirror directory; objects are stored at `<root>/<object name>`.
+        storage (ProblemStorage): The store to mirror.
+        sync_interval (float): Seconds between background syncs.
+
+    Example:
+        mirror = ProblemMirror("/var/cache/sql-tutor", get_problem_storage(), sync_interval=60)
+        mirror.sync()
+        generation, path = mirror.get("problems/042/problem.sql")
+    """
+
+    def __init__(self, root, storage, sync_interval):
+        self.root = os.path.abspath(root)
+        self.storage = storage
+        self.sync_interval = sync_interval
+        self.counters = {"syncs": 0, "sync_errors": 0, "downloads": 0, "deletions": 0, "misses": 0}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._generations = self._load_manifest()
+
+    def local_path(self, name):
+        """
+        Path of an object in the mirror.
+
+        Raises:
+            ValueError: If the object name would resolve outside the mirror directory.
+        """
+        path = os.path.normpath(os.path.join(self.root, *name.split("/")))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Object name escapes the mirror directory: {name}")
+        return path
+
+    def get(self, name, generation=None):
+        """
+        Returns the generation and local path of a mirrored object, downloading it from
+        storage first when it is not mirrored yet.
+
+        Parameters:
+            generation (int, optional): The generation wanted (e.g. the one recorded in
+                the problem catalog); a mirrored copy of an older generation is replaced
+                without waiting for the next sync. A newer one is returned as is, since
+                the generation may come from a catalog read before the last sync.
+
+        Returns:
+            (int, str) or None: (generation, path), or None if the object is not in storage.
+        """
+        path = self.local_path(name)
+        with self._lock:
+            mirrored = self._generations.get(name)
+        if mirrored is not None and (generation is None or mirrored >= generation) and os.path.exists(path):
+            return mirrored, path
+
+        with self._lock:
+            self.counters["misses"] += 1
+        if generation is None:
+            generation = self.storage.generation(name)
+            if generation is None:
+                return None
+        self._download(name, generation)
+        self._save_manifest()
+        return generation, path
+
+    def sync(self):
+        """
+        Brings the mirror up to date with problem storage in one listing.
+
+        Returns:
+            dict: {"downloaded": n, "deleted": n}
+        """
+        # Snapshot before listing: only objects known before the listing can be deleted,
+        # never one that `get()` fetched while the listing was in progress
+        with self._lock:
+            known = dict(self._generations)
+        listed = dict(self.storage.list(PROBLEM_PREFIX))
+
+        downloaded = 0
+        for name, generation in listed.items():
+            if known.get(name) != generation or not os.path.exists(self.local_path(name)):
+                try:
+                    self._download(name, generation)
+                except FileNotFoundError:
+                    continue  # changed or deleted since the listing; the next sync catches up
+                downloaded += 1
+
+        deleted = [name for name in known if name not in listed]
+        for name in deleted:
+            with self._lock:
+                self._generations.pop(name, None)
+                self.counters["deletions"] += 1
+            try:
+                os.remove(self.local_path(name))
+            except FileNotFoundError:
+                pass
+
+        self._save_manifest()
+        with self._lock:
+            self.counters["syncs"] += 1
+        return {"downloaded": downloaded, "deleted": len(deleted)}
+
+    def start(self):
+        """
+        Starts the background sync thread (first sync right away).
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="problem-mirror-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        """
+        Returns the mirror's counters: objects, syncs, sync_errors, downloads, deletions, misses.
+        """
+        with self._lock:
+            return {"objects": len(self._generations), **self.counters}
+
+    # ------------------------------------------------------------------ internals
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.sync()
+            except Exception:
+                with self._lock:
+                    self.counters["sync_errors"] += 1
+                logger.exception("Problem mirror sync failed")
+            self._stopping.wait(self.sync_interval)
+
+    def _download(self, name, generation):
+        content = self.storage.get_bytes(name, generation)
+        path = self.local_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        # Recorded after the rename: a reader may see the new file with the old
+        # generation (and read it again later), never the old file with the new one
+        with self._lock:
+            self._generations[name] = generation
+            self.counters["downloads"] += 1
+
+    def _load_manifest(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST_FILE), "r", encoding="utf-8") as f:
+                generations = json.load(f)["generations"]
+        except (OSError, ValueError, KeyError):
+            return {}
+        return {name: generation for name, generation in generations.items()
+                if os.path.exists(self.local_path(name))}
+
+    def _save_manifest(self):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, MANIFEST_FILE)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"generations": self._generations}, f)
+            os.replace(tmp_path, path)
+
+
+_mirror = None
+_mirror_lock = threading.Lock()
+
+
+def get_problem_mirror():
+    """
+    Returns the process-wide `ProblemMirror` of problem storage, with its sync thread
+    started on first use, or None when PROBLEM_MIRROR_DIR is not set (problem storage
+    is then read directly).
+    """
+    global _mirror
+    if not settings.PROBLEM_MIRROR_DIR:
+        return None
+    if _mirror is None:
+        with _mirror_lock:
+            if _mirror is None:
+                mirror = ProblemMirror(
+                    settings.PROBLEM_MIRROR_DIR, get_problem_storage(), settings.PROBLEM_MIRROR_SYNC_SECONDS,
+                )
+                mirror.start()
+                atexit.register(mirror.stop, 5)
+                _mirror = mirror
+    return _mirror
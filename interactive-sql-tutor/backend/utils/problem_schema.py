@@ -0,0 +1,141 @@
+import threading
+from contextlib import contextmanager
+
+import mysql.connector
+
+from config.db_config import get_mysql_db_config, get_sandbox_readonly_db_config
+from utils.problem_loader import get_problem_content_hash
+from utils.query_watchdog import set_statement_time_budget
+from utils.sql_sandbox import discard_pending_results, run_problem_setup
+
+# Every materialized schema starts with this prefix, so a single wildcard grant
+# (see dbDDL.sql) gives the read-only account SELECT on all of them.
+SCHEMA_PREFIX = "problem_data_"
+
+# Marker table created after the dataset is fully loaded. A schema without it is a
+# leftover of a failed or interrupted build and is rebuilt.
+READY_MARKER_TABLE = "_schema_ready"
+
+_materialized = {}  # (host, port, problem_id) -> schema_name known to be ready in this process
+_materialized_lock = threading.Lock()
+
+
+def problem_schema_name(problem_id, content_hash):
+    """
+    Returns the persistent schema name for one version of a problem's dataset,
+    e.g. 'problem_data_003_1a2b3c4d5e6f'.
+    """
+    return f"{SCHEMA_PREFIX}{str(problem_id).zfill(3)}_{content_hash[:12]}"
+
+
+def ensure_problem_schema(problem_id, db_config=None):
+    """
+    Makes sure the current version of a problem's dataset exists as a persistent schema,
+    and returns its name.
+
+    The schema is both the shared read-only schema of "shared" mode and the golden
+    template that "clone" mode copies each sandbox from.
+
+    The schema name embeds a hash of `problem.sql`, so editing the dataset produces a new
+    schema on next use and older versions of the same problem are dropped. The build runs
+    under a MySQL named lock (`GET_LOCK`) so concurrent workers and processes materialize
+    each version only once.
+
+    Steps:
+    1. Hash `problem.sql` and derive the schema name.
+    2. If this process already saw the schema ready, return immediately.
+    3. Otherwise take the named lock and check for the ready marker table.
+    4. If missing, (re)create the schema, replay `problem.sql`, create the marker,
+       and drop older versions of this problem's schema.
+
+    Parameters:
+        problem_id (int): The ID of the SQL problem.
+        db_config (dict, optional): Server to materialize the schema on (e.g. a sandbox
+            host, see `utils.sandbox_hosts`); defaults to the application database.
+
+    Returns:
+        str: Name of the ready, populated schema.
+    """
+    db_config = db_config or get_mysql_db_config()
+    schema_name = problem_schema_name(problem_id, get_problem_content_hash(problem_id, ("problem.sql",)))
+    key = (db_config.get("host"), db_config.get("port"), problem_id)
+    if _materialized.get(key) == schema_name:
+        return schema_name
+
+    conn = mysql.connector.connect(**db_config)
+    cursor = conn.cursor()
+    lock_name = f"materialize_{schema_name}"
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, 60)", (lock_name,))
+        if cursor.fetchone()[0] != 1:
+            raise RuntimeError(f"Timed out waiting to materialize schema {schema_name}")
+        try:
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s",
+                (schema_name, READY_MARKER_TABLE),
+            )
+            if cursor.fetchone()[0] == 0:
+                cursor.execute(f"DROP SCHEMA IF EXISTS `{schema_name}`")
+                cursor.execute(f"CREATE SCHEMA `{schema_name}`")
+                cursor.execute(f"USE `{schema_name}`")
+                run_problem_setup(cursor, problem_id)
+                cursor.execute(f"CREATE TABLE `{READY_MARKER_TABLE}` (ready TINYINT)")
+                conn.commit()
+                _drop_old_versions(cursor, problem_id, schema_name)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+            cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.close()
+
+    with _materialized_lock:
+        _materialized[key] = schema_name
+    return schema_name
+
+
+def _drop_old_versions(cursor, problem_id, current_schema):
+    # Escape '_' so LIKE matches it literally: problem\_data\_003\_%
+    pattern = f"{SCHEMA_PREFIX}{str(problem_id).zfill(3)}_".replace("_", "\\_") + "%"
+    cursor.execute(
+        "SELECT SCHEMA_NAME FROM information_schema.SCHEMATA WHERE SCHEMA_NAME LIKE %s",
+        (pattern,),
+    )
+    for (name,) in cursor.fetchall():
+        if name != current_schema:
+            cursor.execute(f"DROP SCHEMA IF EXISTS `{name}`")
+
+
+@contextmanager
+def readonly_problem_schema(problem_id, time_limit_ms=None):
+    """
+    Context manager yielding a read-only session on the problem's shared schema.
+
+    The connection uses the SELECT-only account from `get_sandbox_readonly_db_config()`
+    and the session is additionally marked `READ ONLY`, so grading is a plain SELECT
+    round trip with no DDL or DML per submission.
+
+    Parameters:
+        problem_id (int): The ID of the SQL problem.
+        time_limit_ms (int, optional): Per-statement budget for SELECTs on this session.
+
+    Yields:
+        tuple: (conn, cursor, schema_name), same shape as `sandbox_schema`.
+
+    Example:
+        with readonly_problem_schema(3) as (conn, cursor, schema_name):
+            cursor.execute("SELECT * FROM Employee")
+    """
+    schema_name = ensure_problem_schema(problem_id)
+    conn = mysql.connector.connect(**get_sandbox_readonly_db_config())
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"USE `{schema_name}`")
+        cursor.execute("SET SESSION TRANSACTION READ ONLY")
+        if time_limit_ms:
+            set_statement_time_budget(cursor, time_limit_ms)
+        yield conn, cursor, schema_name
+    finally:
+        discard_pending_results(conn)
+        cursor.close()
+        conn.close()
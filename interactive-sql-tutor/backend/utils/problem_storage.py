@@ -0,0 +1,252 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from google.cloud import storage
+
+# Problem files are stored as "problems/<id:03>/<filename>", e.g. "problems/042/problem.sql"
+PROBLEM_PREFIX = "problems/"
+
+
+def problem_object_name(problem_id, filename):
+    """
+    Object name of a problem file in problem storage.
+
+    Example:
+        problem_object_name(42, "tests/ties.sql")   # "problems/042/tests/ties.sql"
+    """
+    return f"{PROBLEM_PREFIX}{str(problem_id).zfill(3)}/{filename}"
+
+
+class StorageConflict(Exception):
+    """
+    Raised by `ProblemStorage.put` when `if_generation_match` does not match the
+    object's current generation, i.e. someone else wrote it first.
+    """
+
+
+class ProblemStorage(ABC):
+    """
+    Where uploaded problem files live, behind one small interface so callers (the
+    problem loader, the upload endpoint, the disk mirror) do not depend on GCS.
+
+    Objects are files addressed by name (see `problem_object_name`), mostly text;
+    problem bundles (`utils.problem_bundle`) are binary. Every
+    version of an object has an integer generation, which changes whenever the
+    object is rewritten.
+
+    Implementations: `GCSProblemStorage` (the problem bucket) and
+    `LocalProblemStorage` (a directory, for development, tests and benchmarks).
+    Use `get_problem_storage()` to get the one selected by PROBLEM_STORAGE.
+
+    Attributes:
+        location (str): Identifies the store, e.g. "gs://bucket" or "file:///srv/problems";
+                        used in cache keys and logs.
+    """
+    location = None
+
+    @abstractmethod
+    def get_bytes(self, name, generation=None):
+        """
+        Returns the raw content of an object, of a specific generation if given.
+
+        Raises:
+            FileNotFoundError: If the object (or that generation of it) does not exist.
+        """
+
+    def get(self, name, generation=None):
+        """
+        Returns the content of a text object (UTF-8), see `get_bytes`.
+        """
+        return self.get_bytes(name, generation).decode("utf-8")
+
+    @abstractmethod
+    def put(self, name, content, if_generation_match=None):
+        """
+        Creates or replaces an object (`content` is text or bytes) and returns its new
+        generation.
+
+        Parameters:
+            if_generation_match (int, optional): Only write if the object is currently at
+                this generation; 0 means "only if it does not exist yet".
+
+        Raises:
+            StorageConflict: If `if_generation_match` is given and does not match.
+        """
+
+    @abstractmethod
+    def list(self, prefix):
+        """
+        Returns (name, generation) of every object whose name starts with `prefix`.
+        """
+
+    @abstractmethod
+    def generation(self, name):
+        """
+        Returns the current generation of an object, or None if it does not exist.
+        """
+
+    def exists(self, name):
+        return self.generation(name) is not None
+
+
+_storage_client = None
+_storage_client_lock = threading.Lock()
+
+
+def get_storage_client():
+    """
+    Returns the process-wide `google.cloud.storage.Client`. Building a client runs
+    credential discovery, so it is done once per process, not per request.
+    """
+    global _storage_client
+    if _storage_client is None:
+        with _storage_client_lock:
+            if _storage_client is None:
+                _storage_client = storage.Client()
+    return _storage_client
+
+
+class GCSProblemStorage(ProblemStorage):
+    """
+    Problem storage in a GCS bucket, through the process-wide client (whose HTTP
+    session keeps connections to GCS open across requests).
+
+    Parameters:
+        bucket_name (str): The problem bucket, GCS_PROBLEM_BUCKET by default.
+        client (storage.Client, optional): Defaults to `get_storage_client()`.
+    """
+
+    def __init__(self, bucket_name, client=None):
+        self.bucket = (client or get_storage_client()).bucket(bucket_name)
+        self.location = f"gs://{bucket_name}"
+
+    def get_bytes(self, name, generation=None):
+        try:
+            return self.bucket.blob(name, generation=generation).download_as_bytes()
+        except NotFound:
+            raise FileNotFoundError(f"{self.location}/{name} not found")
+
+    def put(self, name, content, if_generation_match=None):
+        blob = self.bucket.blob(name)
+        content_type = "application/octet-stream" if isinstance(content, bytes) else "text/plain"
+        try:
+            blob.upload_from_string(content, content_type=content_type, if_generation_match=if_generation_match)
+        except PreconditionFailed:
+            raise StorageConflict(f"{self.location}/{name} is not at generation {if_generation_match}")
+        return blob.generation
+
+    def list(self, prefix):
+        return [(blob.name, blob.generation) for blob in self.bucket.list_blobs(prefix=prefix)
+                if not blob.name.endswith("/")]
+
+    def generation(self, name):
+        blob = self.bucket.get_blob(name)
+        return blob.generation if blob is not None else None
+
+
+class LocalProblemStorage(ProblemStorage):
+    """
+    Problem storage in a local directory: object "problems/042/problem.sql" is the file
+    `<root>/problems/042/problem.sql`. Generations are file mtimes in nanoseconds;
+    writes go to a temporary file renamed into place. Conditional writes
+    (`if_generation_match`) are only atomic within one process.
+
+    Parameters:
+        root (str): The directory.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.location = f"file://{self.root}"
+        self._put_lock = threading.Lock()
+
+    def path(self, name):
+        path = os.path.normpath(os.path.join(self.root, *name.split("/")))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Object name escapes the storage directory: {name}")
+        return path
+
+    def get_bytes(self, name, generation=None):
+        path = self.path(name)
+        with open(path, "rb") as f:
+            content = f.read()
+            if generation is not None and os.fstat(f.fileno()).st_mtime_ns != generation:
+                raise FileNotFoundError(f"{self.location}/{name} has no generation {generation}")
+        return content
+
+    def put(self, name, content, if_generation_match=None):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{os.getpid()}.{threading.get_ident()}")
+        with open(tmp_path, "wb") as f:
+            f.write(content if isinstance(content, bytes) else content.encode("utf-8"))
+        with self._put_lock:
+            previous = self.generation(name) or 0
+            if if_generation_match is not None and previous != if_generation_match:
+                os.remove(tmp_path)
+                raise StorageConflict(f"{self.location}/{name} is not at generation {if_generation_match}")
+            os.replace(tmp_path, path)
+            generation = os.stat(path).st_mtime_ns
+            if generation <= previous:
+                # File timestamps are coarse (a few ms): make every write a new generation
+                generation = previous + 1
+                os.utime(path, ns=(generation, generation))
+        return generation
+
+    def list(self, prefix):
+        base = os.path.join(self.root, *prefix.split("/")[:-1])
+        objects = []
+        for folder, _, files in os.walk(base):
+            for filename in files:
+                if filename.startswith("."):
+                    continue  # temporary files of in-progress writes
+                path = os.path.join(folder, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if name.startswith(prefix):
+                    try:
+                        objects.append((name, os.stat(path).st_mtime_ns))
+                    except FileNotFoundError:
+                        pass
+        return sorted(objects)
+
+    def generation(self, name):
+        try:
+            return os.stat(self.path(name)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def get_problem_storage():
+    """
+    Returns the process-wide `ProblemStorage` selected by settings:
+    - PROBLEM_STORAGE = "gcs" (default): `GCSProblemStorage` on GCS_PROBLEM_BUCKET.
+    - PROBLEM_STORAGE = "local": `LocalProblemStorage` on PROBLEM_STORAGE_DIR
+      (BASE_DIR when empty, i.e. uploads land next to the bundled problems).
+
+    Example:
+        storage = get_problem_storage()
+        storage.put(problem_object_name(42, "solution.sql"), "SELECT 1")
+    """
+    backend = settings.PROBLEM_STORAGE.lower()
+    if backend == "gcs":
+        key = (backend, settings.GCS_PROBLEM_BUCKET)
+    elif backend == "local":
+        key = (backend, str(settings.PROBLEM_STORAGE_DIR or settings.BASE_DIR))
+    else:
+        raise ValueError(f"Unknown PROBLEM_STORAGE: {settings.PROBLEM_STORAGE!r} (expected 'gcs' or 'local')")
+
+    problem_storage = _storages.get(key)
+    if problem_storage is None:
+        with _storages_lock:
+            problem_storage = _storages.get(key)
+            if problem_storage is None:
+                problem_storage = GCSProblemStorage(key[1]) if backend == "gcs" else LocalProblemStorage(key[1])
+                _storages[key] = problem_storage
+    return problem_storage
@@ -0,0 +1,255 @@
+import sqlglot
+from sqlglot import exp
+from sqlglot.dialects.mysql import MySQL
+from sqlglot.errors import ParseError, SqlglotError
+from sqlglot.tokens import TokenType
+
+from utils.setup_compiler import split_sql_statements
+
+# Table names that never come from the problem's dataset
+BUILTIN_TABLES = frozenset({"dual"})
+
+# Checks of queries sqlglot cannot parse (valid MySQL it does not know, e.g. `x MOD 3`):
+# every statement must start like a query and contain none of these keywords.
+_QUERY_START_TOKENS = (TokenType.SELECT, TokenType.WITH, TokenType.L_PAREN)
+_WRITE_KEYWORDS = frozenset({"INSERT", "UPDATE", "DELETE", "INTO"})
+_LITERAL_TOKENS = frozenset({
+    TokenType.STRING, TokenType.IDENTIFIER, TokenType.NATIONAL_STRING, TokenType.HEX_STRING,
+    TokenType.BIT_STRING, TokenType.BYTE_STRING, TokenType.RAW_STRING, TokenType.HEREDOC_STRING,
+    TokenType.UNICODE_STRING,
+})
+
+
+class PrecheckResult:
+    """
+    Outcome of statically checking a submission before any sandbox is provisioned.
+
+    Attributes:
+        statements (list[sqlglot.Expression]): Parsed statements (MySQL dialect), in order.
+            Empty when the query could not be parsed; a query sqlglot cannot parse may
+            still pass (see `parsed`).
+        texts (list[str]): The original text of each statement, split at the
+            tokenizer's statement boundaries (the same split sqlglot parses).
+        error (str or None): Why the submission was rejected, or None if it passed.
+        executable (list[str]): The statements as sent to MySQL: `texts`, so result
+            column names are the student's own (`count(*)`, not `COUNT(*)`). Comments
+            MySQL and sqlglot read differently are rejected, so each text runs exactly
+            the statement the pre-check validated.
+
+    Example:
+        precheck = precheck_query("SELECT name FROM Employee", metadata)
+        precheck.ok          # True
+        precheck.statements  # [Select(...)]
+    """
+    __slots__ = ("statements", "texts", "error")
+
+    def __init__(self, statements, error=None, texts=None):
+        self.statements = statements
+        self.texts = texts if texts is not None else []
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def parsed(self):
+        """
+        False when sqlglot could not parse the query and only the token-level checks
+        ran: MySQL decides whether it is valid, and the verdict is not cached.
+        """
+        return bool(self.statements)
+
+    @property
+    def executable(self):
+        return self.texts
+
+
+def _syntax_error_message(error):
+    details = error.errors[0] if getattr(error, "errors", None) else None
+    if not details:
+        return f"Syntax error: {error}"
+    return (
+        f"Syntax error at line {details['line']}, column {details['col']}: "
+        f"{details['description']} near '{details['highlight']}'."
+    )
+
+
+def _comment_mismatch(user_query):
+    """
+    Returns the first comment sqlglot and MySQL would read differently, or None:
+    `--` not followed by whitespace (a comment for sqlglot, two minus signs for MySQL)
+    and executable comments `/*! ... */` (ignored by sqlglot, run by MySQL).
+    """
+    i, length = 0, len(user_query)
+    quote = None
+    while i < length:
+        ch = user_query[i]
+        if quote is not None:
+            if ch == "\\" and quote != "`":
+                i += 2
+                continue
+            if ch == quote:
+                if user_query[i + 1:i + 2] == quote:
+                    i += 2
+                    continue
+                quote = None
+            i += 1
+            continue
+        if ch in ("'", '"', "`"):
+            quote = ch
+        elif user_query.startswith("--", i):
+            if i + 2 < length and not user_query[i + 2].isspace():
+                return user_query[i:i + 3]
+            i = user_query.find("\n", i)
+            if i < 0:
+                break
+        elif ch == "#":
+            i = user_query.find("\n", i)
+            if i < 0:
+                break
+        elif user_query.startswith("/*", i):
+            if user_query.startswith("/*!", i):
+                return "/*!"
+            end = user_query.find("*/", i + 2)
+            if end < 0:
+                break
+            i = end + 1
+        i += 1
+    return None
+
+
+def _check_unparsed(texts, parse_error):
+    """
+    Token-level pre-check of a query sqlglot could not parse: sqlglot does not know
+    every MySQL construct, so such a query goes to MySQL as long as each statement
+    starts like a query and has no write keyword.
+    """
+    for text in texts:
+        tokens = MySQL().tokenize(text)
+        for token in tokens:
+            if token.token_type not in _LITERAL_TOKENS and token.text.upper() in _WRITE_KEYWORDS:
+                return PrecheckResult(
+                    [], f"Query contains forbidden SQL operation: {token.text.upper()} is not allowed.",
+                )
+        if tokens[0].token_type not in _QUERY_START_TOKENS:
+            return PrecheckResult([], _syntax_error_message(parse_error))
+    return PrecheckResult([], texts=texts)
+
+
+def _referenced_tables(statement):
+    """
+    Names of the real tables a statement reads: CTE names, table functions and DUAL
+    are excluded. Database-qualified names are returned qualified.
+    """
+    cte_names = {cte.alias_or_name.lower() for cte in statement.find_all(exp.CTE)}
+    tables = []
+    for table in statement.find_all(exp.Table):
+        name = table.name
+        if not name:
+            continue
+        if table.db:
+            tables.append(f"{table.db}.{name}")
+        elif name.lower() not in cte_names and name.lower() not in BUILTIN_TABLES:
+            tables.append(name)
+    return tables
+
+
+def _table_functions(statement):
+    """
+    Names of the table functions a statement reads from (`read_text(...)`,
+    `read_csv(...)`, ...). MySQL's own JSON_TABLE is not included.
+    """
+    functions = []
+    for table in statement.find_all(exp.Table):
+        source = table.this
+        if isinstance(source, exp.Func) and not isinstance(source, exp.JSONTable):
+            functions.append((source.name if isinstance(source, exp.Anonymous) else source.sql_name()).lower())
+    return functions
+
+
+def precheck_query(user_query, metadata):
+    """
+    Statically validates a submission against its problem, without touching MySQL.
+
+    This replaces the old substring scan for forbidden keywords, which rejected valid
+    queries such as `SELECT updated_at ...` and let broken ones through to the sandbox.
+
+    Checks, in order:
+    1. The query has no comment that MySQL would read differently (`--x`,
+       `/*! ... */`) and parses with sqlglot in the MySQL dialect. A query sqlglot
+       cannot parse may still be valid MySQL (`x MOD 3`): it passes when every
+       statement starts with SELECT, WITH or "(" and has no INSERT, UPDATE, DELETE or
+       INTO keyword, and MySQL decides (see `PrecheckResult.parsed`); checks 2-3 are
+       skipped for it.
+    2. Every statement is a query (SELECT, WITH ... SELECT, UNION, ...); DML, DDL,
+       SET, SHOW etc. are rejected, as is SELECT ... INTO. Table functions other
+       than JSON_TABLE (`read_text`, `read_csv`, ...) are rejected too: they read
+       files on the engines that grade without MySQL.
+    3. Every referenced table exists in the problem's `tables` metadata
+       (case-insensitive; CTE names and DUAL are fine). Skipped when the metadata
+       lists no tables.
+
+    Parameters:
+        user_query (str): The SQL code submitted by the user.
+        metadata (dict): The problem's parsed `metadata.json`.
+
+    Returns:
+        PrecheckResult: The parsed statements, and the rejection message if any.
+
+    Example:
+        precheck_query("SELECT * FROM Employe", {"tables": [{"table_name": "Employee"}]}).error
+        # "Unknown table(s) referenced: Employe. Available tables: Employee."
+    """
+    mismatch = _comment_mismatch(user_query)
+    if mismatch is not None:
+        return PrecheckResult(
+            [], f"Ambiguous comment '{mismatch}': MySQL comments start with '-- ' (followed by a space) "
+                "or '#'; executable comments (/*! ... */) are not allowed.",
+        )
+
+    try:
+        texts = split_sql_statements(user_query)
+    except SqlglotError as e:
+        return PrecheckResult([], f"Syntax error: {e}")
+    if not texts:
+        return PrecheckResult([], "No valid SQL statement provided.")
+    try:
+        statements = [stmt for stmt in sqlglot.parse(user_query, read="mysql") if stmt is not None]
+    except ParseError as e:
+        return _check_unparsed(texts, e)
+    except SqlglotError as e:
+        return PrecheckResult([], f"Syntax error: {e}")
+
+    if not statements:
+        return PrecheckResult([], "No valid SQL statement provided.")
+    if len(texts) != len(statements):
+        return PrecheckResult(statements, "Could not split the query into statements.")
+
+    for stmt in statements:
+        if not isinstance(stmt, exp.Query):
+            return PrecheckResult(statements, "Query contains forbidden SQL operation: only SELECT statements are allowed.")
+        if stmt.find(exp.Into):
+            return PrecheckResult(statements, "Query contains forbidden SQL operation: SELECT ... INTO is not allowed.")
+        functions = _table_functions(stmt)
+        if functions:
+            return PrecheckResult(
+                statements, f"Query contains forbidden SQL operation: table function {functions[0]} is not allowed.",
+            )
+
+    known_tables = [table["table_name"] for table in (metadata or {}).get("tables", []) if table.get("table_name")]
+    if known_tables:
+        known = {name.lower() for name in known_tables}
+        unknown = []
+        for stmt in statements:
+            for name in _referenced_tables(stmt):
+                if name.lower() not in known and name not in unknown:
+                    unknown.append(name)
+        if unknown:
+            return PrecheckResult(
+                statements,
+                f"Unknown table(s) referenced: {', '.join(unknown)}. "
+                f"Available tables: {', '.join(known_tables)}.",
+            )
+
+    return PrecheckResult(statements, texts=texts)
@@ -0,0 +1,193 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import mysql.connector
+from django.conf import settings
+
+from config.db_config import get_mysql_db_config
+from utils.sandbox_hosts import get_sandbox_router
+
+logger = logging.getLogger(__name__)
+
+# MySQL error codes raised when a statement is stopped by its time budget
+ER_QUERY_INTERRUPTED = 1317   # KILL QUERY
+ER_QUERY_TIMEOUT = 3024       # max_execution_time exceeded
+
+
+def get_time_limit_ms(metadata):
+    """
+    Returns the per-statement time budget (ms) for a problem: `time_limit_ms` from
+    its metadata.json, or SANDBOX_QUERY_TIME_LIMIT_MS when not set.
+    """
+    return int((metadata or {}).get("time_limit_ms") or settings.SANDBOX_QUERY_TIME_LIMIT_MS)
+
+
+def set_statement_time_budget(cursor, time_limit_ms):
+    """
+    Sets the server-side budget for read-only SELECT statements on this session.
+    MySQL aborts a SELECT that runs longer with error 3024.
+    """
+    cursor.execute("SET SESSION max_execution_time = %s", (int(time_limit_ms),))
+
+
+def is_time_limit_error(exc):
+    """
+    True when a driver error means the statement was stopped for running too long.
+    """
+    return getattr(exc, "errno", None) in (ER_QUERY_INTERRUPTED, ER_QUERY_TIMEOUT)
+
+
+class Watch:
+    """
+    One watched statement. `killed` is set when the watchdog issued KILL QUERY for it;
+    `killing` while the KILL is being sent.
+    """
+    __slots__ = ("thread_id", "host", "port", "deadline", "done", "killing", "killed")
+
+    def __init__(self, thread_id, host, port, deadline):
+        self.thread_id = thread_id
+        self.host = host
+        self.port = port
+        self.deadline = deadline
+        self.done = False
+        self.killing = False
+        self.killed = False
+
+
+class QueryWatchdog:
+    """
+    Kills sandbox statements that exceed their time budget.
+
+    `max_execution_time` only covers read-only SELECTs and is enforced by the server.
+    The watchdog is the backstop for everything else: it tracks the MySQL thread id
+    of each watched sandbox connection and, once the deadline passes, issues
+    `KILL QUERY <thread id>` from a separate side connection. The blocked driver call
+    then fails with error 1317 and the caller reports "time limit exceeded".
+
+    A single background thread serves all watches, ordered by deadline.
+
+    Example:
+        with get_query_watchdog().watch(conn, time_limit_ms=2000) as watch:
+            cursor.execute(user_sql)
+        if watch.killed:
+            ...
+    """
+
+    def __init__(self, db_config_factory=get_mysql_db_config):
+        self.db_config_factory = db_config_factory
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._thread = None
+        self._side_conns = {}  # (host, port) -> connection used to issue KILL QUERY
+        self.kills = 0
+
+    @contextmanager
+    def watch(self, conn, time_limit_ms):
+        """
+        Context manager that watches the statement(s) run on `conn` inside the block.
+        Connections without a MySQL thread id are not watched.
+        """
+        thread_id = getattr(conn, "connection_id", None)
+        deadline = time.monotonic() + time_limit_ms / 1000.0
+        watch = Watch(thread_id, getattr(conn, "server_host", None), getattr(conn, "server_port", None), deadline)
+        if thread_id is None or not time_limit_ms:
+            yield watch
+            return
+
+        with self._cond:
+            self._ensure_thread()
+            heapq.heappush(self._heap, (deadline, next(self._seq), watch))
+            self._cond.notify_all()
+        try:
+            yield watch
+        finally:
+            # Waiting out a KILL in progress guarantees it targets this statement,
+            # never the next one run on the same connection.
+            with self._cond:
+                while watch.killing:
+                    self._cond.wait()
+                watch.done = True
+
+    def _ensure_thread(self):
+        # Caller holds self._cond
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="query-watchdog", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        with self._cond:
+            while True:
+                while self._heap and self._heap[0][2].done:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                deadline, _, watch = self._heap[0]
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                heapq.heappop(self._heap)
+                # Connecting to a slow host must not hold up the other watches, so the
+                # KILL is sent without the lock; `killing` keeps the statement's block open.
+                watch.killing = True
+                target = (watch.host, watch.port, watch.thread_id)
+                self._cond.release()
+                try:
+                    killed = self._kill(*target)
+                finally:
+                    self._cond.acquire()
+                watch.killing = False
+                watch.killed = killed
+                if killed:
+                    self.kills += 1
+                self._cond.notify_all()
+
+    def _kill(self, host, port, thread_id):
+        # Called without self._cond, from the watchdog thread only
+        try:
+            cursor = self._side_connection(host, port).cursor()
+            cursor.execute(f"KILL QUERY {int(thread_id)}")
+            cursor.close()
+            return True
+        except Exception:
+            logger.exception("Failed to kill sandbox query on thread %s", thread_id)
+            self._side_conns.pop((host, port), None)
+            return False
+
+    def _side_connection(self, host, port):
+        key = (host, port)
+        conn = self._side_conns.get(key)
+        if conn is None or not conn.is_connected():
+            # Sandbox hosts may use their own account (SANDBOX_HOST_USER)
+            router = get_sandbox_router()
+            config = router.host_config(host, port) if router is not None and host else None
+            if config is None:
+                config = self.db_config_factory()
+                if host:
+                    config = {**config, "host": host, "port": port}
+            config.pop("database", None)
+            conn = mysql.connector.connect(**config)
+            self._side_conns[key] = conn
+        return conn
+
+
+_watchdog = None
+_watchdog_lock = threading.Lock()
+
+
+def get_query_watchdog():
+    """
+    Returns the process-wide `QueryWatchdog`.
+    """
+    global _watchdog
+    if _watchdog is None:
+        with _watchdog_lock:
+            if _watchdog is None:
+                _watchdog = QueryWatchdog()
+    return _watchdog
@@ -0,0 +1,75 @@
+from utils.result_fingerprint import canonical_row, column_order
+from utils.result_limits import BoundedFetch
+
+MISMATCH_COLUMNS = "columns"
+MISMATCH_ROWS = "rows"
+MISMATCH_TOO_MANY_ROWS = "too_many_rows"
+MISMATCH_TOO_FEW_ROWS = "too_few_rows"
+
+
+def discard_rows(cursor, fetch=None):
+    """
+    Consumes and drops the rest of the cursor's current result set, subject to the
+    row/byte caps of `fetch` (a `BoundedFetch`, created with the defaults when omitted).
+    """
+    for _ in fetch or BoundedFetch(cursor):
+        pass
+
+
+def compare_cursor_to_expected(cursor, expected, requires_order, fetch=None):
+    """
+    Streams the cursor's current result set and compares it to an `ExpectedResult`,
+    stopping at the first difference.
+
+    Rows are canonicalized one at a time (see `utils.result_fingerprint`) and kept only
+    as compact tuples long enough to be compared:
+    - With `requires_order`, row i is compared with expected row i (a streaming merge).
+    - Otherwise each row is checked off a multiset of the expected rows; a row that is not
+      (or no longer) in the multiset is a mismatch.
+    - As soon as the user returns more rows than expected, comparison stops.
+
+    Parameters:
+        cursor: Cursor positioned on the user's final SELECT result.
+        expected (ExpectedResult): The cached reference result.
+        requires_order (bool): Whether row order must match.
+        fetch (BoundedFetch, optional): Bounded iterator over the cursor; pass one to read
+            its transfer counters afterwards. Created with the default caps when omitted.
+
+    Returns:
+        (bool, str or None): Whether the results match, and the kind of mismatch
+        (one of the MISMATCH_* constants) when they don't.
+        Unread rows are left on the cursor after an early exit.
+
+    Raises:
+        ResultLimitExceeded: When the result grows past the row/byte caps before a
+            difference is found.
+
+    Example:
+        cursor.execute(user_sql)
+        matched, reason = compare_cursor_to_expected(cursor, expected, requires_order=False)
+    """
+    columns = [col[0] for col in cursor.description]
+    order = column_order(columns)
+    if tuple(columns[i] for i in order) != expected.columns:
+        return False, MISMATCH_COLUMNS
+
+    expected_rows = expected.rows
+    remaining = None if requires_order else dict(expected.row_counts)
+    seen = 0
+    for raw in fetch or BoundedFetch(cursor):
+        if seen == expected.row_count:
+            return False, MISMATCH_TOO_MANY_ROWS
+        row = canonical_row(raw, order)
+        if requires_order:
+            if row != expected_rows[seen]:
+                return False, MISMATCH_ROWS
+        else:
+            count = remaining.get(row, 0)
+            if count == 0:
+                return False, MISMATCH_ROWS
+            remaining[row] = count - 1
+        seen += 1
+
+    if seen != expected.row_count:
+        return False, MISMATCH_TOO_FEW_ROWS
+    return True, None
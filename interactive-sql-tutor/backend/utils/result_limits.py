@@ -0,0 +1,177 @@
+import logging
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+LIMIT_ROWS = "rows"
+LIMIT_BYTES = "bytes"
+
+
+class ResultLimitExceeded(Exception):
+    """
+    Raised when a result set grows past the configured row or byte cap.
+
+    Attributes:
+        limit (str): Which cap was hit, LIMIT_ROWS or LIMIT_BYTES.
+        rows_transferred (int): Rows fetched before giving up.
+    """
+
+    def __init__(self, limit, max_value, rows_transferred):
+        self.limit = limit
+        self.max_value = max_value
+        self.rows_transferred = rows_transferred
+        super().__init__(f"Result exceeds the limit of {max_value} {limit}.")
+
+
+def estimate_row_bytes(row):
+    """
+    Cheap estimate of how much memory a fetched row's values occupy: the length of
+    strings and binary values, and a fixed 8 bytes for numbers, dates and NULLs.
+    """
+    size = 0
+    for value in row:
+        if isinstance(value, (str, bytes, bytearray)):
+            size += len(value)
+        else:
+            size += 8
+    return size
+
+
+class BoundedFetch:
+    """
+    Iterates over a cursor's current result set with `fetchmany`, enforcing a
+    maximum number of rows and (estimated) bytes.
+
+    Used by every path that reads query results: grading (user and solution
+    queries) and the instructor query endpoint. None of them may pull an
+    unbounded result into a worker.
+
+    Parameters:
+        cursor: Cursor positioned on a result set.
+        max_rows (int, optional): Row cap; defaults to QUERY_RESULT_MAX_ROWS.
+        max_bytes (int, optional): Byte cap; defaults to QUERY_RESULT_MAX_BYTES.
+        batch_size (int, optional): Rows per `fetchmany`; defaults to SANDBOX_FETCH_BATCH_SIZE.
+
+    Attributes:
+        rows_transferred (int): Rows fetched so far.
+        bytes_transferred (int): Estimated bytes fetched so far.
+        capped (bool): Whether a cap was hit.
+
+    Raises:
+        ResultLimitExceeded: While iterating, as soon as a cap is exceeded.
+
+    Example:
+        cursor.execute(sql)
+        fetch = BoundedFetch(cursor)
+        rows = list(fetch)
+        fetch.rows_transferred
+    """
+
+    def __init__(self, cursor, max_rows=None, max_bytes=None, batch_size=None):
+        self.cursor = cursor
+        self.max_rows = max_rows or settings.QUERY_RESULT_MAX_ROWS
+        self.max_bytes = max_bytes or settings.QUERY_RESULT_MAX_BYTES
+        self.batch_size = batch_size or settings.SANDBOX_FETCH_BATCH_SIZE
+        self.rows_transferred = 0
+        self.bytes_transferred = 0
+        self.capped = False
+
+    def __iter__(self):
+        while True:
+            batch = self.cursor.fetchmany(self.batch_size)
+            if not batch:
+                return
+            for row in batch:
+                self.count(row)
+                yield row
+
+    def count(self, row):
+        """
+        Adds one fetched row to the counters.
+
+        Raises:
+            ResultLimitExceeded: If the row takes the result past a cap.
+        """
+        self.rows_transferred += 1
+        self.bytes_transferred += estimate_row_bytes(row)
+        if self.rows_transferred > self.max_rows:
+            self.capped = True
+            raise ResultLimitExceeded(LIMIT_ROWS, self.max_rows, self.rows_transferred)
+        if self.bytes_transferred > self.max_bytes:
+            self.capped = True
+            raise ResultLimitExceeded(LIMIT_BYTES, self.max_bytes, self.rows_transferred)
+
+
+class AsyncBoundedFetch(BoundedFetch):
+    """
+    `BoundedFetch` for asyncio cursors (e.g. an aiomysql `SSCursor`), whose `fetchmany`
+    is a coroutine. Same caps, same counters.
+
+    Example:
+        await cursor.execute(sql)
+        fetch = AsyncBoundedFetch(cursor)
+        rows = await fetch.fetch_rows()
+    """
+
+    def __iter__(self):
+        raise TypeError("AsyncBoundedFetch must be read with fetch_rows().")
+
+    async def fetch_rows(self, limit=None, keep=True):
+        """
+        Fetches up to `limit` rows (the whole result when None), subject to the caps.
+
+        Parameters:
+            limit (int, optional): Stop after this many rows; the rest stay on the cursor.
+            keep (bool): Return the rows; with False they are only counted and dropped.
+
+        Returns:
+            list[tuple]: The fetched rows (empty when `keep` is False).
+        """
+        rows = []
+        fetched = 0
+        while limit is None or fetched < limit:
+            size = self.batch_size if limit is None else min(self.batch_size, limit - fetched)
+            batch = await self.cursor.fetchmany(size)
+            if not batch:
+                break
+            for row in batch:
+                self.count(row)
+            fetched += len(batch)
+            if keep:
+                rows.extend(batch)
+        return rows
+
+
+_transfer_lock = threading.Lock()
+_transfer_stats = {}
+
+
+def record_transfer(path, fetch):
+    """
+    Adds one result's transfer counters to the per-process totals used for capacity
+    planning.
+
+    Parameters:
+        path (str): Which code path read the result, e.g. 'grading', 'solution', 'instructor'.
+        fetch (BoundedFetch): The fetch whose counters to record.
+    """
+    with _transfer_lock:
+        stats = _transfer_stats.setdefault(path, {"results": 0, "rows": 0, "bytes": 0, "capped": 0, "max_rows": 0})
+        stats["results"] += 1
+        stats["rows"] += fetch.rows_transferred
+        stats["bytes"] += fetch.bytes_transferred
+        stats["capped"] += int(fetch.capped)
+        stats["max_rows"] = max(stats["max_rows"], fetch.rows_transferred)
+    if fetch.capped:
+        logger.info("%s result capped after %d rows (%d bytes)", path, fetch.rows_transferred, fetch.bytes_transferred)
+
+
+def transfer_stats():
+    """
+    Returns a copy of the per-path transfer totals:
+    {path: {"results", "rows", "bytes", "capped", "max_rows"}}.
+    """
+    with _transfer_lock:
+        return {path: dict(stats) for path, stats in _transfer_stats.items()}
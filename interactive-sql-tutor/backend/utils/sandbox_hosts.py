@@ -0,0 +1,304 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import mysql.connector
+from django.conf import settings
+
+from config.db_config import get_mysql_db_config
+
+logger = logging.getLogger(__name__)
+
+# Server errors caused by load or shutdown rather than by the query:
+# too many connections, server shutdown, lock wait timeout, deadlock
+_TRANSIENT_ERRORS = {1040, 1053, 1205, 1213}
+
+
+class SandboxHostsUnavailable(Exception):
+    """
+    Raised when no sandbox host can take a submission: every host is ejected, or
+    all healthy hosts stayed at their concurrency limit for the acquire timeout.
+    """
+
+
+def is_host_error(exc):
+    """
+    True when an exception means the sandbox host is unhealthy (unreachable, lost
+    connection, overloaded), as opposed to an error in the problem's or user's SQL.
+    """
+    if isinstance(exc, (mysql.connector.InterfaceError, mysql.connector.OperationalError)):
+        errno = getattr(exc, "errno", None)
+        # OperationalError also covers query-level errors such as a killed statement
+        return errno is None or 2000 <= errno < 3000 or errno in _TRANSIENT_ERRORS
+    return isinstance(exc, mysql.connector.Error) and getattr(exc, "errno", None) in _TRANSIENT_ERRORS
+
+
+class SandboxHost:
+    """
+    One MySQL server that sandboxes can be created on.
+
+    Attributes:
+        name (str): "host:port", used in logs and stats.
+        config (dict): Connection settings (no default database).
+        max_concurrency (int): Sandboxes this host may hold at once.
+        in_flight (int): Sandboxes currently open on it.
+        consecutive_failures (int): Host errors since the last success.
+        ejected_until (float): `time.monotonic()` until which the host is skipped (0 if admitted).
+        eject_seconds (float): Current ejection period; doubles on every failed re-admission.
+    """
+
+    def __init__(self, name, config, max_concurrency):
+        self.name = name
+        self.config = config
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.eject_seconds = 0.0
+        self.probing = False
+        self.counters = {"sandboxes": 0, "failures": 0, "ejections": 0}
+
+    @property
+    def ejected(self):
+        return self.ejected_until > 0
+
+    @property
+    def load(self):
+        return self.in_flight / self.max_concurrency
+
+
+def parse_sandbox_hosts(spec, user, password, default_max_concurrency):
+    """
+    Parses SANDBOX_HOSTS: comma-separated "host:port" entries, each optionally followed
+    by "=N" to override the concurrency limit of that host.
+
+    Example:
+        parse_sandbox_hosts("10.0.0.5:3306=32,10.0.0.6", "sandbox", "pw", 16)
+        # two hosts: 10.0.0.5:3306 (32 sandboxes) and 10.0.0.6:3306 (16 sandboxes)
+    """
+    hosts = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        address, _, limit = entry.partition("=")
+        host, _, port = address.partition(":")
+        port = int(port or 3306)
+        config = {
+            "host": host,
+            "port": port,
+            "user": user,
+            "password": password,
+            "connection_timeout": settings.SANDBOX_HOST_CONNECT_TIMEOUT_SECONDS,
+        }
+        hosts.append(SandboxHost(f"{host}:{port}", config, int(limit or default_max_concurrency)))
+    return hosts
+
+
+class SandboxHostRouter:
+    """
+    Spreads sandboxes over several MySQL servers dedicated to grading, so sandbox DDL
+    (CREATE/DROP SCHEMA, table loads) never lands on the application database.
+
+    Features:
+    - Least-loaded routing: each sandbox goes to the admitted host with the lowest
+      in_flight / max_concurrency ratio.
+    - Per-host concurrency limits: a host never holds more than `max_concurrency`
+      sandboxes; when every host is full, callers wait up to `acquire_timeout`.
+    - Ejection: after `failure_threshold` consecutive host errors (see `is_host_error`)
+      a host is skipped for `eject_seconds`.
+    - Re-admission: once the ejection period is over, the next caller probes the host
+      (connect + SELECT 1) before using it. A failed probe ejects it again for twice as
+      long, up to `max_eject_seconds`.
+
+    Parameters:
+        hosts (list[SandboxHost]): Candidate hosts.
+        acquire_timeout (float): Seconds to wait for a free slot.
+        failure_threshold (int): Consecutive host errors before ejection.
+        eject_seconds (float): First ejection period.
+        max_eject_seconds (float): Cap on the ejection period.
+
+    Example:
+        with router.acquire() as host:
+            with sandbox_schema(host.config) as (conn, cursor, schema_name):
+                ...
+    """
+
+    def __init__(self, hosts, acquire_timeout, failure_threshold, eject_seconds, max_eject_seconds):
+        self.hosts = hosts
+        self.acquire_timeout = acquire_timeout
+        self.failure_threshold = failure_threshold
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def acquire(self):
+        """
+        Context manager yielding the `SandboxHost` to create a sandbox on. The slot is
+        released when the block exits; a host error raised in the block counts
+        against the host, any other outcome resets its failure count.
+
+        Raises:
+            SandboxHostsUnavailable: If no admitted host has a free slot in time.
+        """
+        host = self._take_slot()
+        try:
+            yield host
+        except Exception as e:
+            self._release(host, failed=is_host_error(e))
+            raise
+        except BaseException:
+            self._release(host, failed=False)
+            raise
+        self._release(host, failed=False)
+
+    def host_config(self, host, port):
+        """
+        Returns the connection settings of a registered host, or None.
+        """
+        for candidate in self.hosts:
+            if candidate.config["host"] == host and candidate.config["port"] == port:
+                return dict(candidate.config)
+        return None
+
+    def stats(self):
+        """
+        Returns per-host occupancy and health.
+
+        Returns:
+            list[dict]: host, in_flight, max_concurrency, ejected, ejected_for_seconds,
+                        consecutive_failures, sandboxes, failures, ejections.
+        """
+        now = time.monotonic()
+        with self._cond:
+            return [{
+                "host": host.name,
+                "in_flight": host.in_flight,
+                "max_concurrency": host.max_concurrency,
+                "ejected": host.ejected,
+                "ejected_for_seconds": round(max(0.0, host.ejected_until - now), 1) if host.ejected else 0,
+                "consecutive_failures": host.consecutive_failures,
+                **host.counters,
+            } for host in self.hosts]
+
+    # ------------------------------------------------------------------ internals
+
+    def _take_slot(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                host = self._pick(now)
+                if host is not None:
+                    if host.probing:
+                        break
+                    host.in_flight += 1
+                    host.counters["sandboxes"] += 1
+                    return host
+                if not any(not h.ejected or h.ejected_until <= now for h in self.hosts):
+                    raise SandboxHostsUnavailable("All sandbox hosts are ejected.")
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise SandboxHostsUnavailable("All sandbox hosts are at their concurrency limit.")
+                self._cond.wait(min(remaining, 0.5))
+
+        # This caller re-admits (or re-ejects) the host; the probe runs outside the lock
+        healthy = self._probe(host)
+        with self._cond:
+            host.probing = False
+            if healthy:
+                logger.info("Sandbox host %s re-admitted", host.name)
+                host.ejected_until = 0.0
+                host.consecutive_failures = 0
+                host.in_flight += 1
+                host.counters["sandboxes"] += 1
+                self._cond.notify_all()
+                return host
+            self._eject(host, time.monotonic())
+        return self._take_slot()
+
+    def _pick(self, now):
+        # Caller holds self._cond
+        candidates = [h for h in self.hosts if not h.ejected and h.in_flight < h.max_concurrency]
+        if candidates:
+            return min(candidates, key=lambda h: h.load)
+        for host in self.hosts:
+            if host.ejected and host.ejected_until <= now and not host.probing:
+                host.probing = True
+                return host
+        return None
+
+    def _probe(self, host):
+        try:
+            conn = mysql.connector.connect(**host.config)
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+                cursor.close()
+            finally:
+                conn.close()
+            return True
+        except Exception as e:
+            logger.warning("Sandbox host %s failed its re-admission probe: %s", host.name, e)
+            return False
+
+    def _release(self, host, failed):
+        with self._cond:
+            host.in_flight -= 1
+            if failed:
+                host.counters["failures"] += 1
+                host.consecutive_failures += 1
+                if not host.ejected and host.consecutive_failures >= self.failure_threshold:
+                    self._eject(host, time.monotonic())
+            elif not host.ejected:
+                host.consecutive_failures = 0
+                host.eject_seconds = 0.0
+            self._cond.notify_all()
+
+    def _eject(self, host, now):
+        # Caller holds self._cond
+        if host.eject_seconds:
+            host.eject_seconds = min(host.eject_seconds * 2, self.max_eject_seconds)
+        else:
+            host.eject_seconds = self.eject_seconds
+        host.ejected_until = now + host.eject_seconds
+        host.counters["ejections"] += 1
+        logger.warning("Sandbox host %s ejected for %.0f s after %s consecutive failures",
+                       host.name, host.eject_seconds, host.consecutive_failures)
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_sandbox_router():
+    """
+    Returns the process-wide `SandboxHostRouter` built from SANDBOX_HOSTS, or None when
+    SANDBOX_HOSTS is empty (sandboxes are then created on the application database server).
+
+    Credentials are SANDBOX_HOST_USER / SANDBOX_HOST_PASSWORD, defaulting to the
+    application database account.
+    """
+    global _router
+    if not settings.SANDBOX_HOSTS:
+        return None
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                app_config = get_mysql_db_config()
+                _router = SandboxHostRouter(
+                    parse_sandbox_hosts(
+                        settings.SANDBOX_HOSTS,
+                        settings.SANDBOX_HOST_USER or app_config["user"],
+                        settings.SANDBOX_HOST_PASSWORD or app_config["password"],
+                        settings.SANDBOX_HOST_MAX_CONCURRENCY,
+                    ),
+                    acquire_timeout=settings.SANDBOX_HOST_ACQUIRE_TIMEOUT_SECONDS,
+                    failure_threshold=settings.SANDBOX_HOST_FAILURE_THRESHOLD,
+                    eject_seconds=settings.SANDBOX_HOST_EJECT_SECONDS,
+                    max_eject_seconds=settings.SANDBOX_HOST_MAX_EJECT_SECONDS,
+                )
+    return _router
@@ -0,0 +1,326 @@
+import atexit
+import logging
+import queue
+import threading
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import mysql.connector
+from django.conf import settings
+
+from config.db_config import get_mysql_db_config
+from utils.problem_loader import SAMPLE_DATASET, get_problem_content_hash
+from utils.query_watchdog import set_statement_time_budget
+from utils.sql_sandbox import discard_pending_results, run_problem_setup
+
+logger = logging.getLogger(__name__)
+
+
+class PooledSandbox:
+    """
+    A populated sandbox schema owned by the pool.
+
+    Attributes:
+        problem_id (int): The problem whose `problem.sql` was loaded into the schema.
+        conn: Open MySQL connection with the schema selected via `USE`.
+        cursor: Cursor on `conn`.
+        schema_name (str): Name of the sandbox schema (e.g., 'sandbox_pool_a1b2c3d4').
+    """
+    __slots__ = ("problem_id", "conn", "cursor", "schema_name")
+
+    def __init__(self, problem_id, conn, cursor, schema_name):
+        self.problem_id = problem_id
+        self.conn = conn
+        self.cursor = cursor
+        self.schema_name = schema_name
+
+
+class SandboxPool:
+    """
+    Keeps ready-to-use, already-populated sandbox schemas for hot problems.
+
+    Creating a schema and replaying `problem.sql` on every submission is most of
+    the grading latency under load and saturates the MySQL metadata lock. The pool
+    moves that work off the request path:
+
+    - `checkout(problem_id)` hands out a pre-populated schema (a hit), or builds
+      one synchronously when none is ready (a miss).
+    - A used schema is never handed out twice. It is dropped in the background and
+      a replacement is built by the refill workers.
+    - Ready schemas are keyed by problem and content hash of its `problem.sql`, so
+      after a dataset edit the schemas built from the old version are dropped on the
+      next checkout instead of being handed out.
+    - Problems are tracked in LRU order. When more than `max_problems` problems are
+      hot, or the global `max_schemas` cap is reached, the ready schemas of the
+      least recently used problem are evicted.
+
+    Parameters:
+        size_per_problem (int): Number of ready schemas to keep per hot problem.
+        max_problems (int): Maximum number of problems kept warm at once.
+        max_schemas (int): Global cap on pooled schemas (ready + being built).
+        refill_workers (int): Number of background threads that build and drop schemas.
+        db_config_factory (callable): Returns MySQL connection settings for new schemas.
+
+    Example:
+        pool = SandboxPool(size_per_problem=4, max_problems=20, max_schemas=60)
+        with pool.checkout(3) as (conn, cursor, schema_name):
+            cursor.execute("SELECT * FROM Employee")
+        pool.stats()  # {"hits": 1, "misses": 0, ...}
+    """
+
+    def __init__(self, size_per_problem, max_problems, max_schemas, refill_workers=2,
+                 db_config_factory=get_mysql_db_config):
+        self.size_per_problem = size_per_problem
+        self.max_problems = max_problems
+        self.max_schemas = max_schemas
+        self.refill_workers = refill_workers
+        self.db_config_factory = db_config_factory
+
+        self._lock = threading.Lock()
+        self._ready = OrderedDict()      # (problem_id, content hash) -> deque[PooledSandbox], LRU order
+        self._building = {}              # (problem_id, content hash) -> number of schemas being built
+        self._jobs = queue.Queue()
+        self._threads = []
+        self._closed = False
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "builds": 0, "build_errors": 0}
+
+    # ------------------------------------------------------------------ public API
+
+    @contextmanager
+    def checkout(self, problem_id, time_limit_ms=None):
+        """
+        Context manager yielding `(conn, cursor, schema_name)` for a schema that
+        already contains the problem's tables and data. `time_limit_ms` sets the
+        session's SELECT budget (`max_execution_time`).
+
+        The schema is retired (dropped in the background) when the block exits and
+        a refill is scheduled, so the next submission for the same problem is a hit.
+        """
+        self._ensure_workers()
+        key = (problem_id, get_problem_content_hash(problem_id, (SAMPLE_DATASET,)))
+        sandbox = self._take_ready(key)
+        while sandbox is not None and not sandbox.conn.is_connected():
+            # Idle connection was closed by the server (e.g. wait_timeout)
+            self._jobs.put(("drop", sandbox))
+            sandbox = self._take_ready(key)
+        if sandbox is None:
+            sandbox = self._build(problem_id)
+
+        try:
+            if time_limit_ms:
+                set_statement_time_budget(sandbox.cursor, time_limit_ms)
+            yield sandbox.conn, sandbox.cursor, sandbox.schema_name
+        finally:
+            self._jobs.put(("drop", sandbox))
+            self._schedule_refill(key)
+
+    def invalidate(self, problem_id):
+        """
+        Drops every ready schema of a problem. Not needed after a `problem.sql` edit,
+        which `checkout` detects by itself.
+        """
+        with self._lock:
+            self._drop_versions(problem_id, keep_key=None)
+
+    def stats(self):
+        """
+        Returns pool counters and current occupancy.
+
+        Returns:
+            dict: hits, misses, evictions, builds, build_errors, ready_schemas,
+                  building_schemas and hot_problems.
+        """
+        with self._lock:
+            return {
+                **self._counters,
+                "ready_schemas": sum(len(q) for q in self._ready.values()),
+                "building_schemas": sum(self._building.values()),
+                "hot_problems": len(self._ready),
+            }
+
+    def close(self):
+        """
+        Stops the refill workers and drops every pooled schema.
+        """
+        with self._lock:
+            self._closed = True
+            ready, self._ready = self._ready, OrderedDict()
+        for sandboxes in ready.values():
+            for sandbox in sandboxes:
+                self._drop(sandbox)
+        for _ in self._threads:
+            self._jobs.put(("stop", None))
+
+    # ------------------------------------------------------------------ internals
+
+    def _ensure_workers(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.refill_workers):
+                thread = threading.Thread(target=self._worker, name=f"sandbox-pool-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _take_ready(self, key):
+        with self._lock:
+            sandboxes = self._ready.get(key)
+            if sandboxes is None:
+                self._drop_versions(key[0], keep_key=key)
+                self._ready[key] = deque()
+                self._evict_cold_problems()
+            else:
+                self._ready.move_to_end(key)
+
+            if sandboxes:
+                self._counters["hits"] += 1
+                return sandboxes.popleft()
+
+            self._counters["misses"] += 1
+            return None
+
+    def _drop_versions(self, problem_id, keep_key):
+        # Caller holds self._lock. Drops the ready schemas of every other version of
+        # the problem; schemas still being built for them are dropped when done.
+        for key in [key for key in self._ready if key[0] == problem_id and key != keep_key]:
+            for sandbox in self._ready.pop(key):
+                self._jobs.put(("drop", sandbox))
+
+    def _evict_cold_problems(self):
+        # Caller holds self._lock
+        while len(self._ready) > self.max_problems:
+            cold_id, sandboxes = self._ready.popitem(last=False)
+            self._counters["evictions"] += 1
+            for sandbox in sandboxes:
+                self._jobs.put(("drop", sandbox))
+
+    def _evict_one_schema(self, keep_key):
+        # Caller holds self._lock. Frees one slot under the global cap by dropping
+        # a ready schema of the least recently used other problem.
+        for key, sandboxes in self._ready.items():
+            if key != keep_key and sandboxes:
+                self._jobs.put(("drop", sandboxes.pop()))
+                self._counters["evictions"] += 1
+                return True
+        return False
+
+    def _pooled_count(self):
+        # Caller holds self._lock
+        return sum(len(q) for q in self._ready.values()) + sum(self._building.values())
+
+    def _schedule_refill(self, key):
+        with self._lock:
+            if self._closed or key not in self._ready:
+                return
+            have = len(self._ready[key]) + self._building.get(key, 0)
+            for _ in range(self.size_per_problem - have):
+                if self._pooled_count() >= self.max_schemas and not self._evict_one_schema(key):
+                    break
+                self._building[key] = self._building.get(key, 0) + 1
+                self._jobs.put(("build", key))
+
+    def _worker(self):
+        while True:
+            action, payload = self._jobs.get()
+            if action == "stop":
+                return
+            if action == "drop":
+                self._drop(payload)
+            elif action == "build":
+                self._refill(payload)
+
+    def _refill(self, key):
+        try:
+            sandbox = self._build(key[0])
+        except Exception:
+            logger.exception("Failed to build pooled sandbox for problem %s", key[0])
+            with self._lock:
+                self._counters["build_errors"] += 1
+                self._finish_building(key)
+            return
+
+        with self._lock:
+            self._finish_building(key)
+            sandboxes = self._ready.get(key)
+            if self._closed or sandboxes is None:
+                # Problem was evicted, its dataset changed or pool closed while we were building
+                sandboxes = None
+            else:
+                sandboxes.append(sandbox)
+        if sandboxes is None:
+            self._drop(sandbox)
+
+    def _finish_building(self, key):
+        # Caller holds self._lock
+        self._building[key] -= 1
+        if not self._building[key]:
+            del self._building[key]
+
+    def _build(self, problem_id):
+        schema_name = f"sandbox_pool_{uuid.uuid4().hex[:8]}"
+        conn = mysql.connector.connect(**self.db_config_factory())
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"CREATE SCHEMA `{schema_name}`")
+            cursor.execute(f"USE `{schema_name}`")
+            run_problem_setup(cursor, problem_id)
+            conn.commit()
+        except Exception:
+            self._drop(PooledSandbox(problem_id, conn, cursor, schema_name))
+            raise
+
+        with self._lock:
+            self._counters["builds"] += 1
+        return PooledSandbox(problem_id, conn, cursor, schema_name)
+
+    def _drop(self, sandbox):
+        try:
+            discard_pending_results(sandbox.conn)
+            sandbox.cursor.execute(f"DROP SCHEMA IF EXISTS `{sandbox.schema_name}`")
+        except Exception:
+            logger.exception("Failed to drop pooled sandbox %s", sandbox.schema_name)
+        finally:
+            try:
+                sandbox.cursor.close()
+                sandbox.conn.close()
+            except Exception:
+                pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_sandbox_pool():
+    """
+    Returns the process-wide `SandboxPool`, created on first use from settings:
+    SANDBOX_POOL_SIZE_PER_PROBLEM, SANDBOX_POOL_MAX_PROBLEMS,
+    SANDBOX_POOL_MAX_SCHEMAS and SANDBOX_POOL_REFILL_WORKERS.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SandboxPool(
+                    size_per_problem=settings.SANDBOX_POOL_SIZE_PER_PROBLEM,
+                    max_problems=settings.SANDBOX_POOL_MAX_PROBLEMS,
+                    max_schemas=settings.SANDBOX_POOL_MAX_SCHEMAS,
+                    refill_workers=settings.SANDBOX_POOL_REFILL_WORKERS,
+                )
+                atexit.register(_pool.close)
+    return _pool
+
+
+def close_sandbox_pool():
+    """
+    Closes the process-wide `SandboxPool`, if this process created one, dropping its
+    pooled schemas. The next `get_sandbox_pool()` creates a new pool.
+    """
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
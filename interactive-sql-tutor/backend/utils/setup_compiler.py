@@ -0,0 +1,188 @@
+import hashlib
+
+from django.conf import settings
+from sqlglot.dialects.mysql import MySQL
+from sqlglot.tokens import TokenType
+
+from utils.lru_cache import LRUCache
+from utils.problem_loader import load_problem_bundle, load_problem_file
+
+# Tokens allowed at the top level of a VALUES list that can be merged with another one:
+# parenthesized rows separated by commas, and nothing after them (no ON DUPLICATE KEY ...).
+_VALUES_LIST_TOKENS = (TokenType.L_PAREN, TokenType.R_PAREN, TokenType.COMMA)
+
+
+class CompiledSetup:
+    """
+    A problem's `problem.sql`, compiled into the statements actually sent to MySQL.
+
+    Attributes:
+        statements (tuple[str]): Statements to execute, in order; consecutive INSERTs
+                                 into the same table are merged into multi-row INSERTs.
+        source_statements (int): Number of statements in the original script.
+
+    Example:
+        compiled = compile_setup_script(open("problems/001/problem.sql").read())
+        compiled.source_statements   # 7
+        len(compiled.statements)     # 3
+    """
+    __slots__ = ("statements", "source_statements")
+
+    def __init__(self, statements, source_statements):
+        self.statements = tuple(statements)
+        self.source_statements = source_statements
+
+    @property
+    def round_trips(self):
+        return len(self.statements)
+
+
+def _statement_chunks(sql):
+    """
+    Splits a script into statements with the sqlglot MySQL tokenizer, so semicolons in
+    string literals, quoted identifiers and comments do not end a statement.
+
+    Yields:
+        (str, list[Token]): The statement text (without its terminating semicolon,
+        leading or trailing comments) and its tokens.
+    """
+    tokens = MySQL().tokenize(sql)
+    start = 0
+    current = []
+    for token in tokens + [None]:
+        if token is not None and token.token_type != TokenType.SEMICOLON:
+            current.append(token)
+            continue
+        end = token.start if token is not None else len(sql)
+        if current:
+            yield sql[current[0].start:current[-1].end + 1], current
+        elif "/*!" in sql[start:end]:
+            # A MySQL executable comment on its own (e.g. from mysqldump) still runs
+            yield sql[start:end].strip(), current
+        current = []
+        start = end + 1
+
+
+def split_sql_statements(sql):
+    """
+    Returns the statements of a SQL script, split on real statement terminators only.
+
+    Example:
+        split_sql_statements("INSERT INTO t VALUES ('a;b'); SELECT 1;")
+        # ["INSERT INTO t VALUES ('a;b')", "SELECT 1"]
+    """
+    return [text for text, _ in _statement_chunks(sql)]
+
+
+def _insert_values(sql, tokens):
+    """
+    Splits a plain `INSERT ... VALUES (...), (...)` into its prefix (everything before
+    VALUES, whitespace-normalized), its row list text and its row count.
+    Returns None for any other statement, including INSERT ... SELECT and
+    INSERT ... ON DUPLICATE KEY UPDATE.
+    """
+    if tokens[0].token_type != TokenType.INSERT:
+        return None
+    depth = 0
+    values_at = None
+    for i, token in enumerate(tokens):
+        if token.token_type == TokenType.L_PAREN:
+            depth += 1
+        elif token.token_type == TokenType.R_PAREN:
+            depth -= 1
+        elif token.token_type == TokenType.VALUES and depth == 0:
+            values_at = i
+            break
+    if values_at is None or values_at + 1 >= len(tokens) or tokens[-1].token_type != TokenType.R_PAREN:
+        return None
+
+    rows = 0
+    for token in tokens[values_at + 1:]:
+        if depth == 0 and token.token_type not in _VALUES_LIST_TOKENS:
+            return None
+        if token.token_type == TokenType.L_PAREN:
+            rows += depth == 0
+            depth += 1
+        elif token.token_type == TokenType.R_PAREN:
+            depth -= 1
+
+    prefix = " ".join(sql[tokens[0].start:tokens[values_at].start].split())
+    values = sql[tokens[values_at + 1].start:tokens[-1].end + 1]
+    return prefix, values, rows
+
+
+def compile_setup_script(sql, max_batch_rows=None, max_batch_bytes=None):
+    """
+    Compiles a setup script into the statements to execute.
+
+    Steps:
+    1. Split the script with a real SQL tokenizer (see `split_sql_statements`).
+    2. Merge runs of consecutive INSERT ... VALUES statements with the same target
+       (identical text up to VALUES) into multi-row INSERTs of at most
+       `max_batch_rows` rows and roughly `max_batch_bytes` bytes each.
+    3. Leave every other statement (DDL, INSERT ... SELECT, ...) untouched and in order.
+
+    Parameters:
+        sql (str): Content of `problem.sql`.
+        max_batch_rows (int, optional): Rows per merged INSERT; defaults to SANDBOX_SETUP_BATCH_ROWS.
+        max_batch_bytes (int, optional): Size cap per merged INSERT; defaults to SANDBOX_SETUP_BATCH_BYTES.
+
+    Returns:
+        CompiledSetup
+    """
+    max_batch_rows = max_batch_rows or settings.SANDBOX_SETUP_BATCH_ROWS
+    max_batch_bytes = max_batch_bytes or settings.SANDBOX_SETUP_BATCH_BYTES
+
+    statements = []
+    source_statements = 0
+    batch_prefix, batch_values, batch_rows, batch_bytes = None, [], 0, 0
+
+    def flush():
+        if batch_values:
+            statements.append(f"{batch_prefix} VALUES {', '.join(batch_values)}")
+
+    for text, tokens in _statement_chunks(sql):
+        source_statements += 1
+        insert = _insert_values(sql, tokens) if tokens else None
+        if insert is None:
+            flush()
+            batch_prefix, batch_values, batch_rows, batch_bytes = None, [], 0, 0
+            statements.append(text)
+            continue
+
+        prefix, values, rows = insert
+        if prefix != batch_prefix or batch_rows + rows > max_batch_rows or batch_bytes + len(values) > max_batch_bytes:
+            flush()
+            batch_prefix, batch_values, batch_rows, batch_bytes = prefix, [], 0, len(prefix)
+        batch_values.append(values)
+        batch_rows += rows
+        batch_bytes += len(values) + 2
+    flush()
+
+    return CompiledSetup(statements, source_statements)
+
+
+_cache = LRUCache(max_entries=settings.SETUP_SCRIPT_CACHE_SIZE)
+
+
+def get_compiled_setup(problem_id, dataset_file="problem.sql"):
+    """
+    Returns the problem's compiled `problem.sql` (or hidden dataset `dataset_file`),
+    compiling it only once per version of the file (the cache key includes a hash of
+    its content). Packed problems use the statements precompiled in their bundle.
+
+    Example:
+        for stmt in get_compiled_setup(1).statements:
+            cursor.execute(stmt)
+    """
+    sql = load_problem_file(problem_id, dataset_file)
+    key = (problem_id, hashlib.sha256(sql.encode("utf-8")).hexdigest())
+    compiled = _cache.get(key)
+    if compiled is None:
+        bundle = load_problem_bundle(problem_id)
+        if bundle is not None:
+            compiled = bundle.compiled_setup(dataset_file, key[1])
+        if compiled is None:
+            compiled = compile_setup_script(sql)
+        _cache.set(key, compiled)
+    return compiled
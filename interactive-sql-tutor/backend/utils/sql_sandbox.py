@@ -1,14 +1,120 @@
+import contextvars
+import threading
+import time
 import uuid
-from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
 import mysql.connector
 import os
 from config.db_config import get_mysql_db_config
 from django.conf import settings
+from django.utils.module_loading import import_string
 import json
-from utils.problem_loader import load_problem_file
+from utils.problem_loader import (
+    SAMPLE_DATASET, dataset_name, list_problem_datasets, load_problem_file, load_problem_metadata,
+)
+from utils.query_precheck import precheck_query
+from utils.setup_compiler import get_compiled_setup
+from utils.expected_output import get_expected_result
+from utils.grading_timings import grading_timer, timed_stage
+from utils.result_compare import compare_cursor_to_expected, discard_rows
+from utils.result_limits import BoundedFetch, ResultLimitExceeded, record_transfer
+from utils.sandbox_hosts import get_sandbox_router
+from utils.query_watchdog import (
+    get_query_watchdog, get_time_limit_ms, is_time_limit_error, set_statement_time_budget,
+)
+
+VERDICT_CORRECT = "correct"
+VERDICT_WRONG = "wrong"
+VERDICT_TIME_LIMIT_EXCEEDED = "time_limit_exceeded"
+VERDICT_OUTPUT_LIMIT_EXCEEDED = "output_limit_exceeded"
+
+ENGINE_MYSQL = "mysql"
+
+# Grading backends other than the MySQL sandbox, by engine name. A backend is called as
+# `backend(problem_id, precheck, metadata)` and returns a QueryCheckResult, or None to have
+# the query graded in a MySQL sandbox instead. Entries may be dotted paths, imported on
+# first use so optional dependencies (e.g. duckdb) are only needed when selected.
+GRADING_BACKENDS = {
+    "sqlite": "utils.sqlite_engine.check_user_query_sqlite",
+    "duckdb": "utils.duckdb_engine.check_user_query_duckdb",
+}
+
+def register_grading_backend(name, backend):
+    """
+    Adds or replaces a grading backend (a callable or a dotted path to one).
+
+    Example:
+        register_grading_backend("postgres", "utils.pg_engine.check_user_query_pg")
+    """
+    GRADING_BACKENDS[name] = backend
+
+def get_grading_backend(name):
+    """
+    Returns the backend callable registered for an engine name, or None if there is none.
+    """
+    backend = GRADING_BACKENDS.get(name)
+    if isinstance(backend, str):
+        backend = import_string(backend)
+        GRADING_BACKENDS[name] = backend
+    return backend
+
+def select_grading_engine(metadata):
+    """
+    Returns the engine that grades a problem: its metadata.json `engine` field if set,
+    otherwise settings.GRADING_ENGINE.
+    """
+    return str(metadata.get("engine") or settings.GRADING_ENGINE).lower()
+
+class QueryCheckResult(tuple):
+    """
+    The `(correct, message)` pair returned by `check_user_query`, with the verdict attached.
+
+    It unpacks exactly like the plain tuple callers have always used, while also
+    exposing a `verdict` for outcomes that are more specific than right/wrong.
+
+    Attributes:
+        correct (bool): Whether the query output is correct.
+        message (str): Error or mismatch description (empty string if correct).
+        verdict (str): One of VERDICT_CORRECT, VERDICT_WRONG, VERDICT_TIME_LIMIT_EXCEEDED,
+                       VERDICT_OUTPUT_LIMIT_EXCEEDED.
+        rows_transferred (int): Result rows fetched from the sandbox for the user's statements.
+        cacheable (bool): Whether the outcome depends only on the query and the problem files
+                          (not on load or infrastructure), so it may be reused for an identical
+                          submission (see `utils.verdict_cache`).
+        engine (str): Which engine graded the query: 'mysql' or a GRADING_BACKENDS name.
+        datasets (list[dict] or None): Per-dataset outcome and timings of a MySQL grading
+                          run (see `grade_datasets`): dataset, verdict, setup_ms, query_ms,
+                          total_ms. None when the query was not graded in MySQL.
+        timings (dict or None): Milliseconds spent in each stage of the run that produced
+                          this result, plus "total" (see `utils.grading_timings`).
+
+    Example:
+        correct, message = check_user_query(1, "SELECT ...")
+        check_user_query(1, "SELECT ...").verdict   # "time_limit_exceeded"
+    """
+
+    def __new__(cls, correct, message="", verdict=None, rows_transferred=0, cacheable=False, engine=ENGINE_MYSQL,
+                datasets=None, timings=None):
+        result = super().__new__(cls, (correct, message))
+        result.verdict = verdict or (VERDICT_CORRECT if correct else VERDICT_WRONG)
+        result.rows_transferred = rows_transferred
+        result.cacheable = cacheable
+        result.engine = engine
+        result.datasets = datasets
+        result.timings = timings
+        return result
+
+    @property
+    def correct(self):
+        return self[0]
+
+    @property
+    def message(self):
+        return self[1]
 
 @contextmanager
-def sandbox_schema(db_config):
+def sandbox_schema(db_config, time_limit_ms=None, template_schema=None):
     """
     Context manager to create a temporary MySQL schema (database) 
     for isolated SQL execution (sandboxing).
@@ -21,12 +127,21 @@ def sandbox_schema(db_config):
     Behavior:
     1. Creates a uniquely named schema using UUID (e.g., 'sandbox_a1b2c3d4')
     2. Switches to that schema using 'USE'
+       - Clone mode (`template_schema` given): copies every table of the template into
+         it server-side (see `clone_schema_tables`)
     3. Yields a live database connection, cursor, and the schema name for use within the `with` block
     4. Automatically drops the schema after the block completes, even on error
 
+    Each step is timed as a grading stage (connect, create_schema, setup, drop_schema;
+    see `utils.grading_timings`) when called inside a grading run.
+
     Parameters:
         db_config (dict): A dictionary of MySQL database connection settings, 
                           typically containing host, user, password, and port.
+        time_limit_ms (int, optional): Per-statement budget for SELECTs on this session
+                          (sets `max_execution_time`, see `utils.query_watchdog`).
+        template_schema (str, optional): Populated schema to clone into the sandbox,
+                          e.g. the problem's golden schema from `utils.problem_schema`.
 
     Yields:
         tuple: (conn, cursor, schema_name)
@@ -44,19 +159,126 @@ def sandbox_schema(db_config):
         # After the block, the sandbox schema is dropped automatically.
     """
     schema_name = f"sandbox_{uuid.uuid4().hex[:8]}"  # Generate a unique schema name
-    conn = mysql.connector.connect(**db_config)
-    cursor = conn.cursor()
+    with timed_stage("connect"):
+        conn = mysql.connector.connect(**db_config)
+        cursor = conn.cursor()
 
     try:
-        cursor.execute(f"CREATE SCHEMA `{schema_name}`") # Create sandbox schema
-        cursor.execute(f"USE `{schema_name}`")           # Switch to sandbox schema
+        with timed_stage("create_schema"):
+            cursor.execute(f"CREATE SCHEMA `{schema_name}`") # Create sandbox schema
+            cursor.execute(f"USE `{schema_name}`")           # Switch to sandbox schema
+        if template_schema:
+            with timed_stage("setup"):
+                clone_schema_tables(cursor, template_schema)  # Copy the template's tables and rows
+        if time_limit_ms:
+            with timed_stage("create_schema"):
+                set_statement_time_budget(cursor, time_limit_ms)
         yield conn, cursor, schema_name                  # Provide context to caller
     finally:
-        cursor.execute(f"DROP SCHEMA IF EXISTS `{schema_name}`") # Clean up schema
-        cursor.close()
-        conn.close()
+        with timed_stage("drop_schema"):
+            discard_pending_results(conn)                            # Rows left by an early exit
+            cursor.execute(f"DROP SCHEMA IF EXISTS `{schema_name}`") # Clean up schema
+            cursor.close()
+            conn.close()
+
+def clone_schema_tables(cursor, template_schema):
+    """
+    Copies every base table of `template_schema` into the current schema, entirely
+    server-side: `CREATE TABLE ... LIKE` (columns, indexes, defaults) followed by
+    `INSERT ... SELECT`. No problem SQL is parsed or sent from Python.
+
+    Foreign keys, triggers and views are not copied (CREATE TABLE ... LIKE does not
+    carry them); problem datasets are plain tables.
+
+    Parameters:
+        cursor (MySQLCursor): Cursor whose current schema is the (empty) sandbox.
+        template_schema (str): Name of the populated template schema.
+    """
+    from utils.problem_schema import READY_MARKER_TABLE
+
+    cursor.execute(
+        "SELECT TABLE_NAME FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = %s AND TABLE_TYPE = 'BASE TABLE' AND TABLE_NAME <> %s",
+        (template_schema, READY_MARKER_TABLE),
+    )
+    for (table,) in cursor.fetchall():
+        cursor.execute(f"CREATE TABLE `{table}` LIKE `{template_schema}`.`{table}`")
+        cursor.execute(f"INSERT INTO `{table}` SELECT * FROM `{template_schema}`.`{table}`")
+
+def discard_pending_results(conn):
+    """
+    Drops any result rows still pending on the connection, e.g. after the comparator
+    stopped reading a large result early, so the connection can run the next statement.
+    """
+    if getattr(conn, "unread_result", False):
+        conn.consume_results()
+
+@contextmanager
+def problem_sandbox(problem_id, time_limit_ms=None, dataset_file=SAMPLE_DATASET):
+    """
+    Context manager yielding a sandbox that already contains the problem's tables and data.
+
+    This is the single entry point the grader uses to obtain a populated schema. How the
+    schema is provisioned depends on `settings.SQL_SANDBOX_MODE`:
+    - "ephemeral" (default): create a fresh schema with `sandbox_schema`, replay
+      `problem.sql` via `run_problem_setup`, and drop it afterwards.
+    - "clone": like "ephemeral", but the fresh schema is cloned server-side from the
+      problem's golden template schema (built once per version by `utils.problem_schema`)
+      instead of replaying `problem.sql`.
+    - "pool": check out a pre-populated schema from `utils.sandbox_pool`.
+    - "shared": run against the problem's persistent, read-only schema from
+      `utils.problem_schema`, using the SELECT-only sandbox account.
+
+    In "ephemeral" and "clone" modes the schema is created on the host picked by the
+    sandbox host router (`utils.sandbox_hosts`) when SANDBOX_HOSTS is set, and on the
+    application database server otherwise.
+
+    Hidden datasets (`tests/<name>.sql`) are always provisioned the "ephemeral" way;
+    the pool and the golden schemas only hold `problem.sql`.
+
+    Parameters:
+        problem_id (int): The ID of the SQL problem whose data should be loaded.
+        time_limit_ms (int, optional): Per-statement budget for SELECTs in the sandbox.
+        dataset_file (str, optional): Dataset to load (see `list_problem_datasets`),
+            `problem.sql` by default.
+
+    Yields:
+        tuple: (conn, cursor, schema_name), same as `sandbox_schema`.
 
-def run_problem_setup(cursor, problem_id):
+    Example:
+        with problem_sandbox(3) as (conn, cursor, schema_name):
+            cursor.execute("SELECT * FROM Employee")
+    """
+    mode = settings.SQL_SANDBOX_MODE if dataset_file == SAMPLE_DATASET else "ephemeral"
+
+    if mode == "pool":
+        from utils.sandbox_pool import get_sandbox_pool
+        with get_sandbox_pool().checkout(problem_id, time_limit_ms) as sandbox:
+            yield sandbox
+        return
+
+    if mode == "shared":
+        from utils.problem_schema import readonly_problem_schema
+        with readonly_problem_schema(problem_id, time_limit_ms) as sandbox:
+            yield sandbox
+        return
+
+    router = get_sandbox_router()
+    with (router.acquire() if router is not None else nullcontext()) as host:
+        db_config = host.config if host is not None else get_mysql_db_config()
+
+        if mode == "clone":
+            from utils.problem_schema import ensure_problem_schema
+            template_schema = ensure_problem_schema(problem_id, db_config)
+            with sandbox_schema(db_config, time_limit_ms, template_schema) as sandbox:
+                yield sandbox
+            return
+
+        with sandbox_schema(db_config, time_limit_ms) as (conn, cursor, schema_name):
+            run_problem_setup(cursor, problem_id, dataset_file)
+            yield conn, cursor, schema_name
+
+def run_problem_setup(cursor, problem_id, dataset_file=SAMPLE_DATASET):
     """
     Executes DDL and INSERT statements to set up the problem's database schema and test data.
 
@@ -64,13 +286,15 @@ def run_problem_setup(cursor, problem_id):
 
     Steps:
     1. Verifies that the provided SQL file exists.
-    2. Reads the SQL file content (UTF-8 encoded).
-    3. Splits the content by semicolon (`;`) to handle multiple SQL statements.
-    4. Executes each non-empty SQL statement using the provided cursor.
+    2. Gets the compiled script for the current version of `problem.sql` (see
+       `utils.setup_compiler`): split with a real SQL tokenizer, with consecutive
+       single-row INSERTs merged into multi-row INSERTs. Compiled once per version.
+    3. Executes each compiled statement using the provided cursor, one round trip each.
 
     Parameters:
         cursor (MySQLCursor): An active cursor connected to the sandbox schema.
         ddl_sql_path (str): The path to the .sql file containing table creation and test data insertion statements.
+        dataset_file (str, optional): Dataset file to load instead of `problem.sql`, e.g. "tests/large.sql".
 
     Raises:
         FileNotFoundError: If the specified SQL file does not exist.
@@ -79,11 +303,8 @@ def run_problem_setup(cursor, problem_id):
         with sandbox_schema(db_config) as (conn, cursor, schema_name):
             run_problem_setup(cursor, "problems/001/setup.sql")
     """
-    ddl_sql = load_problem_file(problem_id, "problem.sql")  # return as str
-
-    for statement in ddl_sql.split(';'):
-        stmt = statement.strip()
-        if stmt:
+    with timed_stage("setup"):
+        for stmt in get_compiled_setup(problem_id, dataset_file).statements:
             cursor.execute(stmt)
 
 def get_solution_output(cursor, problem_id):
@@ -97,7 +318,8 @@ def get_solution_output(cursor, problem_id):
     1. Verifies that the solution SQL file exists.
     2. Reads the SQL query from the file (UTF-8 encoded).
     3. Executes the query using the provided cursor.
-    4. Fetches all results and converts each row to a dictionary using column names as keys.
+    4. Fetches the results incrementally (bounded by QUERY_RESULT_MAX_ROWS/_BYTES) and converts
+       each row to a dictionary using column names as keys.
 
     Parameters:
         cursor (MySQLCursor): An active cursor connected to the sandbox schema.
@@ -108,6 +330,7 @@ def get_solution_output(cursor, problem_id):
 
     Raises:
         FileNotFoundError: If the specified SQL file does not exist.
+        ResultLimitExceeded: If the solution returns more rows/bytes than allowed.
 
     Example usage:
         with sandbox_schema(db_config) as (conn, cursor, schema_name):
@@ -117,92 +340,345 @@ def get_solution_output(cursor, problem_id):
 
     cursor.execute(solution_sql)
     columns = [col[0] for col in cursor.description]
-    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    fetch = BoundedFetch(cursor)
+    try:
+        return [dict(zip(columns, row)) for row in fetch]
+    finally:
+        record_transfer("solution", fetch)
+
+def warm_expected_result(problem_id):
+    """
+    Computes and caches the problem's expected result (see `utils.expected_output`)
+    ahead of the first submission, e.g. right after a problem is uploaded.
+
+    Hidden datasets are warmed too, each in its own sandbox.
+
+    Returns:
+        ExpectedResult: The canonicalized reference result on `problem.sql`.
+    """
+    for dataset_file in list_problem_datasets(problem_id)[1:]:
+        with problem_sandbox(problem_id, dataset_file=dataset_file) as (conn, cursor, _):
+            get_expected_result(problem_id, cursor, dataset_file)
+    with problem_sandbox(problem_id) as (conn, cursor, _):
+        return get_expected_result(problem_id, cursor)
+
+def grade_in_sandbox(conn, cursor, statements, expected, requires_order, time_limit_ms):
+    """
+    Runs a pre-checked submission in an already-populated sandbox and compares the
+    result of its final SELECT with the expected result.
 
-def check_user_query(problem_id, user_query):
+    This is the part of `check_user_query` that runs per submission; the batch grader
+    (`utils.batch_grading`) calls it repeatedly on one sandbox. The user's statements
+    are read-only (see `utils.query_precheck`), so the sandbox can be reused.
+
+    Parameters:
+        conn: Sandbox connection (watched by the query watchdog).
+        cursor (MySQLCursor): Cursor on `conn`, in the sandbox schema.
+        statements (list[str]): The submission's statements from the pre-check
+            (`PrecheckResult.executable`), never the raw text split on ';' naively.
+        expected (ExpectedResult): The problem's expected result.
+        requires_order (bool): Whether row order is graded.
+        time_limit_ms (int): Per-statement time budget.
+
+    Returns:
+        QueryCheckResult: Same values as `check_user_query`.
+    """
+    if not statements:
+        return QueryCheckResult(False, "No valid SQL statement provided.", cacheable=True)
+    # The pre-check only lets queries through, so every statement returns rows
+    final_select = len(statements) - 1
+
+    watchdog = get_query_watchdog()
+    kill_after_ms = time_limit_ms + settings.SANDBOX_WATCHDOG_GRACE_MS
+    matched = False
+    rows_transferred = 0
+    for i, stmt in enumerate(statements):
+        with watchdog.watch(conn, kill_after_ms) as watch:
+            fetch = None
+            try:
+                with timed_stage("query"):
+                    cursor.execute(stmt)
+                if i == final_select:
+                    # Stream and compare (order only matters if requires_order)
+                    fetch = BoundedFetch(cursor)
+                    with timed_stage("compare"):
+                        matched, _ = compare_cursor_to_expected(cursor, expected, requires_order, fetch)
+                    if not matched:
+                        break
+                else:
+                    fetch = BoundedFetch(cursor)
+                    with timed_stage("query"):
+                        discard_rows(cursor, fetch)
+            except ResultLimitExceeded as e:
+                return QueryCheckResult(
+                    False, f"Output limit exceeded: {e}", VERDICT_OUTPUT_LIMIT_EXCEEDED,
+                    rows_transferred + fetch.rows_transferred, cacheable=True,
+                )
+            except Exception as e:
+                if watch.killed or is_time_limit_error(e):
+                    return QueryCheckResult(
+                        False,
+                        f"Time limit exceeded: query ran longer than {time_limit_ms} ms.",
+                        VERDICT_TIME_LIMIT_EXCEEDED,
+                    )
+                # Syntax errors, unknown tables/columns and bad values are properties
+                # of the query; lost connections, deadlocks etc. are not.
+                return QueryCheckResult(
+                    False, f"Error in query execution: {str(e)}",
+                    cacheable=isinstance(e, (mysql.connector.ProgrammingError, mysql.connector.DataError)),
+                )
+            finally:
+                if fetch is not None:
+                    rows_transferred += fetch.rows_transferred
+                    record_transfer("grading", fetch)
+
+    if matched:
+        return QueryCheckResult(True, "", rows_transferred=rows_transferred, cacheable=True)
+    else:
+        return QueryCheckResult(False, "Output does not match expected result.",
+                                rows_transferred=rows_transferred, cacheable=True)
+
+def check_user_query(problem_id, user_query, precheck=None):
     """
     Validates a user's SQL query by comparing its result with the expected output.
 
     Features:
-    - Checks for forbidden SQL operations (e.g., INSERT, DELETE, DROP).
+    - Statically pre-checks the query with sqlglot before any connection is opened
+      (see `utils.query_precheck`): syntax errors, non-SELECT statements and unknown
+      tables are rejected without provisioning a sandbox.
     - Supports multiple SQL statements; only the result of the final SELECT is compared.
     - Runs the query in an isolated sandbox schema to ensure safety.
-    - Loads the expected output from `solution.sql` and compares it against the user's result.
+    - Compares against the cached expected result of `solution.sql` (see
+      `utils.expected_output`); the solution only runs on the first submission
+      for each version of the problem files.
     - Optionally considers result ordering, based on `metadata.json`.
+    - Enforces a per-statement time budget (`time_limit_ms` in `metadata.json`, default
+      SANDBOX_QUERY_TIME_LIMIT_MS) via `max_execution_time` and the query watchdog,
+      which issues KILL QUERY for statements that overrun.
+    - Grades on the problem's engine (metadata `engine`, default GRADING_ENGINE): a
+      registered backend such as SQLite (`utils.sqlite_engine`) or DuckDB
+      (`utils.duckdb_engine`) is tried first, and a MySQL sandbox is only provisioned
+      when there is no backend or it cannot give a trustworthy verdict.
+    - Caps every result it reads at QUERY_RESULT_MAX_ROWS rows / QUERY_RESULT_MAX_BYTES
+      bytes (see `utils.result_limits`); hitting a cap is its own verdict.
+    - Problems with hidden datasets (`tests/*.sql`, see `list_problem_datasets`) are
+      graded on every dataset concurrently, stopping at the first failure (see
+      `grade_datasets`); per-dataset timings are in `.datasets`.
+    - Times each stage (pre-check, connect, CREATE SCHEMA, setup, solution, user
+      query, comparison, DROP SCHEMA) with monotonic timers; the timings are in
+      `.timings` (see `utils.grading_timings`).
 
     Steps:
-    1. Block dangerous SQL operations for safety.
+    1. Pre-check the query against the problem's metadata.
     2. Set up the sandbox environment using the problem's DDL and test data.
-    3. Parse and execute the user's SQL statements.
+    3. Look up (or compute once) the expected result.
+    4. Parse and execute the user's SQL statements.
        - Only SELECT/CTE results are captured.
-    4. Fetch and compare the output against the reference solution.
-    5. Return a boolean for correctness and an optional message.
+    5. Stream the final SELECT's rows and compare them against the expected result,
+       stopping at the first mismatch (see `utils.result_compare`).
+    6. Return a boolean for correctness and an optional message.
 
     Parameters:
         problem_id (int): The ID of the SQL problem (e.g., 1, 2, 3...).
         user_query (str): The SQL code submitted by the user.
+        precheck (PrecheckResult, optional): Result of `precheck_query` when the caller
+            already ran it (e.g. the verdict cache, which reuses the parsed statements).
 
     Returns:
-        (bool, str): A tuple indicating:
+        QueryCheckResult: A `(bool, str)` tuple indicating:
             - Whether the query output is correct
             - A message describing the error or mismatch (empty string if correct)
+          with the verdict ('correct', 'wrong', 'time_limit_exceeded' or 'output_limit_exceeded')
+          in `.verdict`, the number of rows fetched in `.rows_transferred` and the
+          stage timings in `.timings`.
 
     Example return values:
         (True, "")                             # Query is correct
         (False, "Output does not match...")    # Result is wrong
-        (False, "Query contains forbidden...") # Dangerous SQL detected
+        (False, "Query contains forbidden...") # Non-SELECT statement detected
+        (False, "Syntax error at line 1...")   # Rejected by the pre-check
         (False, "Error in query execution: ...") # Runtime error
+        (False, "Time limit exceeded: ...")    # verdict == "time_limit_exceeded"
+        (False, "Output limit exceeded: ...")  # verdict == "output_limit_exceeded"
     """
-    forbidden_keywords = ['insert', 'delete', 'update', 'drop', 'alter']
+    with grading_timer() as timer:
+        result = _check_user_query(problem_id, user_query, precheck)
+    result.timings = timer.as_dict()
+    return result
 
-    # Check for forbidden operations
-    lowered = user_query.lower()
-    if any(kw in lowered for kw in forbidden_keywords):
-        return False, "Query contains forbidden SQL operation."
+def load_grading_metadata(problem_id):
+    """
+    Loads the problem's metadata.json for grading, turning failures (malformed JSON,
+    problem storage unreachable, ...) into an error result instead of an exception.
 
+    Returns:
+        (dict, None) on success, or (None, QueryCheckResult) when the metadata cannot
+        be loaded; the error result is not cacheable.
+    """
     try:
-        db_config = get_mysql_db_config()
-        with sandbox_schema(db_config) as (conn, cursor, _):
-            # 1. Setup sandbox: schema + test data
-            run_problem_setup(cursor, problem_id)
+        return load_problem_metadata(problem_id), None
+    except Exception as e:
+        return None, QueryCheckResult(False, f"Execution error: could not load problem {problem_id}: {str(e)}")
+
+def _check_user_query(problem_id, user_query, precheck):
+    # Load metadata.json: known tables, result ordering and the per-statement time budget
+    with timed_stage("precheck"):
+        metadata, error = load_grading_metadata(problem_id)
+        if error is not None:
+            return error
+
+        # Static pre-check: reject before any database connection is opened
+        if precheck is None:
+            precheck = precheck_query(user_query, metadata)
+    if not precheck.ok:
+        return QueryCheckResult(False, precheck.error, cacheable=True)
+
+    # Non-MySQL backend; returns None whenever the verdict must come from MySQL.
+    # Backends only load problem.sql, so problems with hidden datasets go to MySQL.
+    datasets = list_problem_datasets(problem_id, metadata)
+    engine = select_grading_engine(metadata)
+    backend = get_grading_backend(engine) if engine != ENGINE_MYSQL and len(datasets) == 1 else None
+    if backend is not None and precheck.parsed:
+        with timed_stage("engine"):
+            result = backend(problem_id, precheck, metadata)
+        if result is not None:
+            return result
+
+    requires_order = metadata.get("requires_order", False)
+    time_limit_ms = get_time_limit_ms(metadata)
+
+    result = grade_datasets(problem_id, precheck.executable, datasets, requires_order, time_limit_ms)
+    if not precheck.parsed:
+        result.cacheable = False  # only MySQL vouched for the query
+    return result
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 1)
+
+def _grade_dataset(problem_id, statements, dataset_file, requires_order, time_limit_ms, stop=None):
+    """
+    Grades a submission on one dataset, in a sandbox of its own.
 
-            # 2. Load metadata.json
-            try:
-                metadata = load_problem_file(problem_id, "metadata.json", parse_json=True)
-                requires_order = metadata.get("requires_order", False)
-            except FileNotFoundError:
-                requires_order = False
-
-            # 3. Execute user's query
-            statements = [stmt.strip() for stmt in user_query.strip().split(';') if stmt.strip()]
-            if not statements:
-                return False, "No valid SQL statement provided."
-
-            user_result = None
-            for stmt in statements:
-                try:
-                    cursor.execute(stmt)
-                    if stmt.lower().startswith("select") or stmt.lower().startswith("with"):
-                        columns = [col[0] for col in cursor.description]
-                        user_result = [dict(zip(columns, row)) for row in cursor.fetchall()]
-                except Exception as e:
-                    return False, f"Error in query execution: {str(e)}"
+    Returns:
+        (QueryCheckResult or None, dict): The result (None if `stop` was set before the
+        query ran) and the dataset's timings.
+    """
+    start = time.perf_counter()
+    timing = {"dataset": dataset_name(dataset_file), "verdict": "skipped",
+              "setup_ms": None, "query_ms": None, "total_ms": None}
+    result = None
+    try:
+        # 1. Setup sandbox: schema + test data
+        with problem_sandbox(problem_id, time_limit_ms, dataset_file) as (conn, cursor, _):
+            # 2. Get expected output (runs solution.sql only on a cache miss)
+            expected = get_expected_result(problem_id, cursor, dataset_file)
+            timing["setup_ms"] = _elapsed_ms(start)
+
+            # 3. Execute user's query and compare its result, unless another dataset failed
+            if stop is None or not stop.is_set():
+                query_start = time.perf_counter()
+                result = grade_in_sandbox(conn, cursor, statements, expected, requires_order, time_limit_ms)
+                timing["query_ms"] = _elapsed_ms(query_start)
 
-            if user_result is None:
-                return False, "No SELECT result found from user query."
+    except Exception as e:
+        result = QueryCheckResult(False, f"Execution error: {str(e)}")
+
+    if result is not None:
+        timing["verdict"] = result.verdict
+    timing["total_ms"] = _elapsed_ms(start)
+    return result, timing
+
+_dataset_executor = None
+_dataset_executor_lock = threading.Lock()
+
+def _get_dataset_executor():
+    global _dataset_executor
+    if _dataset_executor is None:
+        with _dataset_executor_lock:
+            if _dataset_executor is None:
+                _dataset_executor = ThreadPoolExecutor(
+                    max_workers=settings.DATASET_GRADING_WORKERS, thread_name_prefix="dataset-grader",
+                )
+    return _dataset_executor
+
+def grade_datasets(problem_id, statements, dataset_files, requires_order, time_limit_ms):
+    """
+    Grades a pre-checked submission on each of the problem's datasets and combines
+    the verdicts: correct only if it is correct on every dataset.
 
-            # 4. Get expected output
-            solution_result = get_solution_output(cursor, problem_id)
+    Features:
+    - Every dataset gets its own sandbox and its own cached expected result.
+    - With hidden datasets, all datasets are graded concurrently (on up to
+      DATASET_GRADING_WORKERS threads shared by the process, one connection each).
+    - Grading stops at the first failing dataset: datasets still being set up skip
+      the user's query, and ones not started yet are cancelled.
+    - The timings of each dataset are attached to the result (`.datasets`), so
+      instructors can see which dataset dominates grading cost.
 
-            # 5. Optional: ignore order
-            if not requires_order:
-                user_result = sorted(user_result, key=lambda x: tuple(x.values()))
-                solution_result = sorted(solution_result, key=lambda x: tuple(x.values()))
+    Parameters:
+        problem_id (int): The ID of the SQL problem.
+        statements (list[str]): The submission's statements (`PrecheckResult.executable`).
+        dataset_files (list[str]): From `list_problem_datasets`, `problem.sql` first.
+        requires_order (bool): Whether row order is graded.
+        time_limit_ms (int): Per-statement time budget, applied on every dataset.
 
-            if user_result == solution_result:
-                return True, ""
-            else:
-                return False, "Output does not match expected result."
+    Returns:
+        QueryCheckResult: With `.datasets` holding, per dataset in `dataset_files` order,
+        {"dataset", "verdict", "setup_ms", "query_ms", "total_ms"}; the verdict is
+        "skipped" for datasets that were cancelled or did not run the query.
 
-    except Exception as e:
-        return False, f"Execution error: {str(e)}"
\ No newline at end of file
+    Example:
+        result = grade_datasets(3, ["SELECT ..."], ["problem.sql", "tests/ties.sql"], False, 2000)
+        result.datasets
+        # [{"dataset": "sample", "verdict": "correct", "setup_ms": 18.2, "query_ms": 1.1, "total_ms": 24.0},
+        #  {"dataset": "ties", "verdict": "wrong", "setup_ms": 35.9, "query_ms": 2.4, "total_ms": 41.7}]
+    """
+    if len(dataset_files) == 1:
+        result, timing = _grade_dataset(problem_id, statements, dataset_files[0], requires_order, time_limit_ms)
+        result.datasets = [timing]
+        return result
+
+    stop = threading.Event()
+    executor = _get_dataset_executor()
+    # Each dataset thread runs in a copy of this context, so its stages reach the same timer
+    futures = {
+        executor.submit(contextvars.copy_context().run, _grade_dataset,
+                        problem_id, statements, dataset_file, requires_order, time_limit_ms, stop): dataset_file
+        for dataset_file in dataset_files
+    }
+    timings = {}
+    rows_transferred = 0
+    cacheable = True
+    failed_on, failure = None, None
+    for future in as_completed(futures):
+        result, timings[futures[future]] = future.result()
+        if result is None:
+            continue
+        rows_transferred += result.rows_transferred
+        cacheable = cacheable and result.cacheable
+        if not result.correct:
+            failed_on, failure = futures[future], result
+            stop.set()
+            for pending in futures:
+                pending.cancel()
+            break
+
+    datasets = [
+        timings.get(dataset_file) or {"dataset": dataset_name(dataset_file), "verdict": "skipped",
+                                      "setup_ms": None, "query_ms": None, "total_ms": None}
+        for dataset_file in dataset_files
+    ]
+    if failure is None:
+        return QueryCheckResult(True, "", rows_transferred=rows_transferred, cacheable=cacheable, datasets=datasets)
+
+    return QueryCheckResult(False, dataset_failure_message(failed_on, failure), failure.verdict,
+                            rows_transferred, failure.cacheable, datasets=datasets)
+
+def dataset_failure_message(dataset_file, result):
+    """
+    Feedback for a submission that failed on `dataset_file`: a wrong result on a hidden
+    dataset names the dataset, so students know the sample data is not the whole story.
+    """
+    if dataset_file != SAMPLE_DATASET and result.message == "Output does not match expected result.":
+        return f"Output does not match expected result on hidden dataset '{dataset_name(dataset_file)}'."
+    return result.message
\ No newline at end of file
@@ -0,0 +1,335 @@
+import logging
+import sqlite3
+import threading
+import time
+
+import sqlglot
+from django.conf import settings
+from sqlglot import exp
+from sqlglot.errors import ErrorLevel, SqlglotError
+
+from utils.expected_output import ExpectedResult
+from utils.lru_cache import LRUCache
+from utils.problem_loader import get_problem_content_hash, load_problem_file, load_problem_metadata
+from utils.query_watchdog import get_time_limit_ms
+from utils.result_compare import compare_cursor_to_expected, discard_rows
+from utils.result_fingerprint import canonicalize_result
+from utils.result_limits import BoundedFetch, ResultLimitExceeded, record_transfer
+from utils.setup_compiler import get_compiled_setup
+from utils.sql_sandbox import (
+    VERDICT_OUTPUT_LIMIT_EXCEEDED, VERDICT_TIME_LIMIT_EXCEEDED, VERDICT_WRONG, QueryCheckResult,
+    select_grading_engine,
+)
+
+logger = logging.getLogger(__name__)
+
+ENGINE_SQLITE = "sqlite"
+
+# MySQL text types compare case-insensitively under the default collation; their
+# SQLite counterparts get COLLATE NOCASE so WHERE/GROUP BY/DISTINCT behave alike.
+_TEXT_TYPES = tuple(exp.DataType.TEXT_TYPES) + ("tinytext", "mediumtext", "longtext")
+
+# Nodes whose result depends on how values sort. ENUM columns sort by declaration
+# index in MySQL but alphabetically as SQLite TEXT, so queries using them are lossy.
+_ORDER_SENSITIVE = (exp.Ordered, exp.Max, exp.Min, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Between)
+
+# How often (in SQLite VM instructions) the time budget is checked
+_PROGRESS_INTERVAL = 10_000
+
+
+class TranspileError(Exception):
+    """
+    Raised when a statement cannot be expressed in SQLite without changing its meaning.
+    """
+
+
+class SQLiteProblem:
+    """
+    One problem version loaded into an in-memory SQLite database.
+
+    Attributes:
+        expected (ExpectedResult): Result of `solution.sql` on the snapshot, verified
+                                   against the `expected_output` in metadata.json.
+        enum_columns (frozenset[str]): Lower-cased names of MySQL ENUM/SET columns.
+
+    Example:
+        problem = get_sqlite_problem(1)
+        conn = problem.clone()   # private copy for one submission
+    """
+    __slots__ = ("snapshot", "expected", "enum_columns", "_lock")
+
+    def __init__(self, snapshot, expected, enum_columns):
+        self.snapshot = snapshot
+        self.expected = expected
+        self.enum_columns = enum_columns
+        self._lock = threading.Lock()
+
+    def clone(self):
+        """
+        Returns a private in-memory copy of the snapshot, made with the SQLite
+        backup API (a page copy; no SQL is replayed).
+        """
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        with self._lock:
+            self.snapshot.backup(conn)
+        return conn
+
+
+def _scope_nodes(node):
+    """
+    Yields `node` and its descendants, without entering subqueries.
+    """
+    yield node
+    for child in node.iter_expressions():
+        if not isinstance(child, exp.Query):
+            yield from _scope_nodes(child)
+
+
+def _is_aggregate(node):
+    return isinstance(node, exp.AggFunc) and not isinstance(node.parent, exp.Window)
+
+
+def _has_ungrouped_columns(select):
+    """
+    Whether a SELECT reads columns that are neither grouped nor aggregated, e.g.
+    `SELECT player_id, event_date FROM Activity GROUP BY player_id`. MySQL rejects such
+    queries (ONLY_FULL_GROUP_BY) while SQLite takes the value of an arbitrary row of
+    each group. Columns functionally dependent on the grouped ones count as ungrouped,
+    so some queries MySQL accepts are flagged too; they are graded on MySQL.
+    """
+    projections = select.expressions
+    clauses = [select.args.get("having"), select.args.get("order")]
+    group = select.args.get("group")
+    if group is None and not any(
+        _is_aggregate(node) for part in projections + clauses if part for node in _scope_nodes(part)
+    ):
+        return False
+
+    aliases = {projection.alias: projection.unalias() for projection in projections if projection.alias}
+    grouped = set()
+    for expression in group.expressions if group else []:
+        if isinstance(expression, exp.Literal) and expression.is_int and 0 < int(expression.this) <= len(projections):
+            expression = projections[int(expression.this) - 1].unalias()
+        elif isinstance(expression, exp.Column) and not expression.table and expression.name in aliases:
+            expression = aliases[expression.name]
+        grouped.add(expression)
+    grouped_names = {node.name.lower() for node in grouped if isinstance(node, exp.Column)}
+
+    def ungrouped(node, names):
+        if node in grouped or _is_aggregate(node) or isinstance(node, exp.Query):
+            return False
+        if isinstance(node, exp.Column):
+            return node.name.lower() not in names
+        if isinstance(node, exp.Star):
+            return True
+        return any(ungrouped(child, names) for child in node.iter_expressions())
+
+    # HAVING and ORDER BY may also refer to the projections by alias
+    clause_names = grouped_names | {alias.lower() for alias in aliases}
+    return (any(ungrouped(projection.unalias(), grouped_names) for projection in projections)
+            or any(ungrouped(clause, clause_names) for clause in clauses if clause))
+
+
+def transpile_statement(statement, enum_columns=frozenset()):
+    """
+    Generates SQLite SQL for a parsed MySQL statement.
+
+    Raises:
+        TranspileError: If sqlglot reports an unsupported construct, the statement
+            orders or compares values of an ENUM column, or it selects columns that
+            are neither grouped nor aggregated (accepted by SQLite only).
+    """
+    for select in statement.find_all(exp.Select):
+        if _has_ungrouped_columns(select):
+            raise TranspileError("Columns outside GROUP BY and aggregates are rejected by MySQL only.")
+    if enum_columns:
+        for node in statement.find_all(*_ORDER_SENSITIVE):
+            if any(column.name.lower() in enum_columns for column in node.find_all(exp.Column)):
+                raise TranspileError("ENUM columns sort differently in SQLite.")
+    try:
+        return statement.sql(dialect="sqlite", unsupported_level=ErrorLevel.RAISE)
+    except SqlglotError as e:
+        raise TranspileError(str(e)) from e
+
+
+def _sqlite_table_definition(statement, enum_columns):
+    """
+    Rewrites MySQL column types SQLite cannot represent faithfully: ENUM/SET become
+    TEXT (their names are collected in `enum_columns`), and text columns get
+    COLLATE NOCASE.
+    """
+    for column in statement.find_all(exp.ColumnDef):
+        kind = column.args.get("kind")
+        if kind is None:
+            continue
+        if kind.is_type("enum", "set"):
+            enum_columns.add(column.name.lower())
+            kind = exp.DataType.build("text")
+            column.set("kind", kind)
+        if kind.is_type(*_TEXT_TYPES):
+            column.append("constraints", exp.ColumnConstraint(kind=exp.CollateColumnConstraint(this=exp.var("NOCASE"))))
+    return statement
+
+
+def _run_statements(cursor, statements, enum_columns=frozenset()):
+    """
+    Runs parsed MySQL statements on SQLite and leaves the cursor on the last result.
+    """
+    sql = [transpile_statement(stmt, enum_columns) for stmt in statements]
+    for i, text in enumerate(sql):
+        cursor.execute(text)
+        if i < len(sql) - 1 and cursor.description:
+            discard_rows(cursor)
+
+
+def build_sqlite_problem(problem_id):
+    """
+    Loads the current version of a problem into an in-memory SQLite snapshot.
+
+    Steps:
+    1. Refuse problems assigned to another engine (e.g. `"engine": "mysql"` in
+       metadata.json) or without an `expected_output` to verify against.
+    2. Transpile and run each compiled `problem.sql` statement (see `utils.setup_compiler`).
+    3. Run the transpiled `solution.sql` and check its result against `expected_output`;
+       any difference means the transpilation is lossy for this problem.
+
+    Returns:
+        SQLiteProblem
+
+    Raises:
+        TranspileError: If the problem cannot be graded on SQLite.
+    """
+    metadata = load_problem_metadata(problem_id)
+    if select_grading_engine(metadata) != ENGINE_SQLITE:
+        raise TranspileError(f"Problem is assigned to the {select_grading_engine(metadata)} engine.")
+    expected_output = metadata.get("expected_output")
+    if not expected_output:
+        raise TranspileError("No expected_output in metadata to verify against.")
+
+    snapshot = sqlite3.connect(":memory:", check_same_thread=False)
+    cursor = snapshot.cursor()
+    enum_columns = set()
+    try:
+        for text in get_compiled_setup(problem_id).statements:
+            statement = sqlglot.parse_one(text, read="mysql")
+            if isinstance(statement, exp.Create):
+                statement = _sqlite_table_definition(statement, enum_columns)
+            cursor.execute(transpile_statement(statement))
+        snapshot.commit()
+
+        solution = [stmt for stmt in sqlglot.parse(load_problem_file(problem_id, "solution.sql"), read="mysql") if stmt]
+        _run_statements(cursor, solution, enum_columns)
+        columns = [col[0] for col in cursor.description]
+        expected = ExpectedResult(*canonicalize_result(columns, cursor.fetchall()))
+    except (SqlglotError, sqlite3.Error, TranspileError) as e:
+        snapshot.close()
+        raise TranspileError(str(e)) from e
+    finally:
+        cursor.close()
+
+    reference = ExpectedResult(*canonicalize_result(expected_output[0], expected_output[1:]))
+    if not reference.matches(expected.columns, expected.rows, metadata.get("requires_order", False)):
+        snapshot.close()
+        raise TranspileError("Solution result on SQLite differs from expected_output.")
+
+    return SQLiteProblem(snapshot, expected, frozenset(enum_columns))
+
+
+_problems = LRUCache(max_entries=settings.SQLITE_ENGINE_CACHE_SIZE)
+
+
+def get_sqlite_problem(problem_id):
+    """
+    Returns the cached `SQLiteProblem` for the problem's current version, or None if
+    it cannot be graded on SQLite (the reason is cached too, so it is tried once).
+    """
+    key = (problem_id, get_problem_content_hash(problem_id))
+    problem = _problems.get(key)
+    if problem is None:
+        try:
+            problem = build_sqlite_problem(problem_id)
+        except TranspileError as e:
+            logger.info("Problem %s is graded on MySQL: %s", problem_id, e)
+            problem = str(e)
+        _problems.set(key, problem)
+    return problem if isinstance(problem, SQLiteProblem) else None
+
+
+def check_user_query_sqlite(problem_id, precheck, metadata):
+    """
+    Grades a pre-checked submission on the problem's SQLite snapshot.
+
+    Features:
+    - Sandbox provisioning is a backup-API copy of an in-memory database: no network
+      round trip and no MySQL server involved.
+    - The time budget (`time_limit_ms`) is enforced with a SQLite progress handler.
+    - Results go through the same row/byte caps and streaming comparator as on MySQL.
+
+    Returns None whenever the answer cannot be trusted, and the caller grades on MySQL:
+    - the problem is not eligible (see `build_sqlite_problem`),
+    - a statement does not transpile losslessly,
+    - SQLite raises an error (it may not support something MySQL does),
+    - the result is wrong and SQLITE_ENGINE_CONFIRM_ON_MYSQL is set.
+
+    "correct" and "wrong" verdicts given by SQLite alone are not cacheable, so a later
+    identical submission is graded again instead of reusing an unconfirmed verdict.
+
+    Parameters:
+        problem_id (int): The ID of the SQL problem.
+        precheck (PrecheckResult): Passed pre-check, with the parsed statements.
+        metadata (dict): The problem's metadata.json.
+
+    Returns:
+        QueryCheckResult (with `engine` 'sqlite') or None.
+    """
+    problem = get_sqlite_problem(problem_id)
+    if problem is None:
+        return None
+    try:
+        statements = [transpile_statement(stmt, problem.enum_columns) for stmt in precheck.statements]
+    except TranspileError:
+        return None
+
+    time_limit_ms = get_time_limit_ms(metadata)
+    deadline = time.monotonic() + time_limit_ms / 1000.0
+    conn = problem.clone()
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, _PROGRESS_INTERVAL)
+    cursor = conn.cursor()
+    fetch = None
+    try:
+        for i, stmt in enumerate(statements):
+            cursor.execute(stmt)
+            fetch = BoundedFetch(cursor)
+            if i == len(statements) - 1:
+                matched, _ = compare_cursor_to_expected(cursor, problem.expected, metadata.get("requires_order", False), fetch)
+            else:
+                discard_rows(cursor, fetch)
+            record_transfer("grading", fetch)
+    except ResultLimitExceeded as e:
+        record_transfer("grading", fetch)
+        return QueryCheckResult(
+            False, f"Output limit exceeded: {e}", VERDICT_OUTPUT_LIMIT_EXCEEDED,
+            fetch.rows_transferred, cacheable=True, engine=ENGINE_SQLITE,
+        )
+    except sqlite3.OperationalError:
+        if time.monotonic() > deadline:
+            return QueryCheckResult(
+                False, f"Time limit exceeded: query ran longer than {time_limit_ms} ms.",
+                VERDICT_TIME_LIMIT_EXCEEDED, engine=ENGINE_SQLITE,
+            )
+        return None
+    except sqlite3.Error:
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+    # Verdicts MySQL has not confirmed are not cached: a dialect difference the
+    # transpiler misses must not outlive the submission that hit it.
+    if matched:
+        return QueryCheckResult(True, "", rows_transferred=fetch.rows_transferred, engine=ENGINE_SQLITE)
+    if settings.SQLITE_ENGINE_CONFIRM_ON_MYSQL:
+        return None
+    return QueryCheckResult(
+        False, "Output does not match expected result.", VERDICT_WRONG, fetch.rows_transferred, engine=ENGINE_SQLITE,
+    )
@@ -0,0 +1,295 @@
+import hashlib
+import threading
+
+import sqlglot
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+from utils.async_sandbox import async_check_user_query
+from utils.grading_timings import timed_stage
+from utils.lru_cache import LRUCache
+from utils.problem_loader import PROBLEM_FILES, get_problem_content_hash, list_problem_datasets
+from utils.query_precheck import precheck_query
+from utils.setup_compiler import split_sql_statements
+from utils.sql_sandbox import check_user_query, load_grading_metadata
+
+# Functions whose value depends on when/where the query runs; queries using them are
+# never answered from the cache.
+NONDETERMINISTIC_FUNCTIONS = frozenset({
+    "BENCHMARK", "CONNECTION_ID", "CURDATE", "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP",
+    "CURRENT_USER", "CURTIME", "DATABASE", "FOUND_ROWS", "LAST_INSERT_ID", "LOCALTIME",
+    "LOCALTIMESTAMP", "NOW", "RAND", "RANDOM_BYTES", "ROW_COUNT", "SCHEMA", "SESSION_USER",
+    "SLEEP", "SYSDATE", "SYSTEM_USER", "UNIX_TIMESTAMP", "USER", "UTC_DATE", "UTC_TIME",
+    "UTC_TIMESTAMP", "UUID", "UUID_SHORT",
+})
+
+_ALIAS_PREFIX = "_t"
+
+
+def _function_name(node):
+    if isinstance(node, exp.Anonymous):
+        return node.name.upper()
+    return node.sql_name().upper()
+
+
+def _is_deterministic(statement):
+    return not any(
+        _function_name(node) in NONDETERMINISTIC_FUNCTIONS for node in statement.find_all(exp.Func)
+    )
+
+
+def _names_columns_by_text(statement):
+    """
+    Whether a statement has unaliased computed result columns (`count(*)`,
+    `ROUND(AVG(x),2)`, ...). MySQL names those after their text exactly as written,
+    and result columns are graded by name.
+    """
+    selects = statement.selects if isinstance(statement, exp.Query) else []
+    return any(not isinstance(projection, (exp.Alias, exp.Column, exp.Star)) for projection in selects)
+
+
+def _normalize_table_aliases(statement):
+    """
+    Renames table and derived-table aliases to positional names (_t1, _t2, ...) and
+    rewrites the column qualifiers that refer to them, so `FROM Employee e` and
+    `FROM Employee AS emp` produce the same tree.
+
+    Column aliases are left alone: they name the result columns, which are graded.
+    When an alias could be confused with a real table or CTE name (or a positional name
+    is already in use) the statement is returned unchanged.
+    """
+    aliases = [
+        alias for alias in statement.find_all(exp.TableAlias)
+        if alias.name and not isinstance(alias.parent, exp.CTE)
+    ]
+    if not aliases:
+        return statement
+
+    names = list(dict.fromkeys(alias.name for alias in aliases))
+    table_names = {table.name.lower() for table in statement.find_all(exp.Table)}
+    table_names |= {cte.alias_or_name.lower() for cte in statement.find_all(exp.CTE)}
+    identifiers = {identifier.name.lower() for identifier in statement.find_all(exp.Identifier)}
+    mapping = {name: f"{_ALIAS_PREFIX}{i}" for i, name in enumerate(names, start=1)}
+    if any(name.lower() in table_names for name in names) or identifiers & set(mapping.values()):
+        return statement
+
+    statement = statement.copy()
+    for alias in statement.find_all(exp.TableAlias):
+        if alias.name in mapping and not isinstance(alias.parent, exp.CTE):
+            alias.set("this", exp.to_identifier(mapping[alias.name]))
+    for column in statement.find_all(exp.Column):
+        if column.table in mapping:
+            column.set("table", exp.to_identifier(mapping[column.table]))
+    return statement
+
+
+def canonical_query(user_query, statements=None):
+    """
+    Returns a canonical text form of a submission, or None when it must not be cached.
+
+    The query is parsed with sqlglot (MySQL dialect) and regenerated without comments,
+    which normalizes whitespace and keyword case; table aliases are renamed positionally
+    (see `_normalize_table_aliases`). Identifier case and column aliases are kept,
+    because they are visible in the graded result. So is the exact text of the final
+    statement when it has unaliased computed columns, whose names MySQL takes from
+    the text (`count(*)` and `COUNT(*)` are different columns).
+
+    Not cacheable:
+    - queries sqlglot cannot parse,
+    - MySQL executable comments (`/*! ... */`), which sqlglot drops but MySQL runs,
+    - queries calling a function in NONDETERMINISTIC_FUNCTIONS.
+
+    The canonical form must describe what actually runs: submissions are graded by
+    executing the original text of their pre-checked statements
+    (`PrecheckResult.executable`), and the pre-check rejects comments MySQL would read
+    differently from sqlglot, so the parsed statements are the ones MySQL runs.
+
+    Parameters:
+        user_query (str): The SQL code submitted by the user.
+        statements (list[sqlglot.Expression], optional): The pre-checked statements of
+            `user_query` (`PrecheckResult.statements`), the ones that are executed.
+
+    Example:
+        canonical_query("select e.name from Employee e")
+        # 'SELECT _t1.name FROM Employee AS _t1'
+    """
+    if "/*!" in user_query:
+        return None
+    if statements is None:
+        try:
+            statements = sqlglot.parse(user_query, read="mysql")
+        except SqlglotError:
+            return None
+    statements = [stmt for stmt in statements if stmt is not None]
+    if not statements or not all(_is_deterministic(stmt) for stmt in statements):
+        return None
+    canonical = ";\n".join(
+        _normalize_table_aliases(stmt).sql(dialect="mysql", comments=False) for stmt in statements
+    )
+    if _names_columns_by_text(statements[-1]):
+        try:
+            canonical += "\n" + split_sql_statements(user_query)[-1]
+        except (SqlglotError, IndexError):
+            return None
+    return canonical
+
+
+def verdict_cache_key(problem_id, user_query, statements=None):
+    """
+    Cache key for a submission: (problem_id, content hash of the problem files,
+    digest of the canonical query), or None when the submission is not cacheable.
+    Editing any of the problem's files (hidden datasets included) changes the key, so
+    stale verdicts are never served.
+    """
+    canonical = canonical_query(user_query, statements)
+    if canonical is None:
+        return None
+    hidden_datasets = tuple(list_problem_datasets(problem_id)[1:])
+    return (
+        problem_id,
+        get_problem_content_hash(problem_id, PROBLEM_FILES + hidden_datasets),
+        hashlib.sha256(canonical.encode("utf-8")).hexdigest(),
+    )
+
+
+class _Flight:
+    """
+    One in-progress check that identical concurrent submissions wait on.
+    """
+    __slots__ = ("done", "result")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+_cache = LRUCache(max_entries=settings.VERDICT_CACHE_SIZE)
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def cached_check_user_query(problem_id, user_query):
+    """
+    `check_user_query` behind a verdict cache with single-flight coalescing.
+
+    Features:
+    - The static pre-check (`utils.query_precheck`) runs first; its parsed statements
+      are both the source of the cache key and what `check_user_query` executes (as
+      their original text), so a key always describes the SQL that ran. Rejected queries never reach the cache or MySQL.
+    - Submissions that differ only in whitespace, keyword case, comments or table alias
+      names share one cache entry (see `canonical_query`).
+    - Bounded LRU (VERDICT_CACHE_SIZE entries); keys include the problem's content hash.
+    - Only deterministic outcomes are stored (`QueryCheckResult.cacheable`): time limits
+      and infrastructure errors are always re-checked.
+    - Concurrent identical submissions are coalesced: the first runs the sandbox, the
+      others wait for and share its result.
+
+    Parameters:
+        problem_id (int): The ID of the SQL problem.
+        user_query (str): The SQL code submitted by the user.
+
+    Returns:
+        QueryCheckResult: Same as `check_user_query`.
+
+    Example:
+        cached_check_user_query(1, "SELECT name FROM Employee e")    # runs the sandbox
+        cached_check_user_query(1, "select name from Employee AS x") # cache hit
+    """
+    with timed_stage("precheck"):
+        metadata, error = load_grading_metadata(problem_id)
+        if error is not None:
+            return error
+        precheck = precheck_query(user_query, metadata)
+        key = verdict_cache_key(problem_id, user_query, precheck.statements) if precheck.ok else None
+    if not precheck.ok:
+        return check_user_query(problem_id, user_query, precheck)
+
+    if key is None:
+        return check_user_query(problem_id, user_query, precheck)
+
+    result = _cache.get(key)
+    if result is not None:
+        return result
+
+    with _inflight_lock:
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            # Re-check under the lock: a leader may have finished since the lookup above
+            result = _cache.get(key)
+            if result is not None:
+                return result
+            flight = _inflight[key] = _Flight()
+
+    if not leader:
+        with timed_stage("coalesced_wait"):
+            flight.done.wait()
+        if flight.result is not None:
+            return flight.result
+        return check_user_query(problem_id, user_query, precheck)
+
+    try:
+        result = check_user_query(problem_id, user_query, precheck)
+        flight.result = result
+        if result.cacheable:
+            _cache.set(key, result)
+        return result
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        flight.done.set()
+
+
+def _prepare_async_check(problem_id, user_query):
+    with timed_stage("precheck"):
+        metadata, error = load_grading_metadata(problem_id)
+        if error is not None:
+            return None, None, None, error
+        precheck = precheck_query(user_query, metadata)
+        key = verdict_cache_key(problem_id, user_query, precheck.statements) if precheck.ok else None
+    return metadata, precheck, key, (_cache.get(key) if key is not None else None)
+
+
+async def acached_check_user_query(problem_id, user_query):
+    """
+    Asyncio counterpart of `cached_check_user_query`, grading misses with
+    `async_check_user_query`. Shares the same verdict cache. Identical concurrent
+    submissions are not coalesced on this path.
+    """
+    metadata, precheck, key, result = await sync_to_async(_prepare_async_check, thread_sensitive=False)(
+        problem_id, user_query,
+    )
+    if result is not None:
+        return result
+    result = await async_check_user_query(problem_id, user_query, precheck, metadata)
+    if key is not None and result.cacheable:
+        _cache.set(key, result)
+    return result
+
+
+def get_cached_verdict(key):
+    """
+    Returns the cached QueryCheckResult for a `verdict_cache_key`, or None.
+    """
+    return _cache.get(key)
+
+
+def store_verdict(key, result):
+    """
+    Caches a QueryCheckResult under a `verdict_cache_key` if it is cacheable.
+    """
+    if result.cacheable:
+        _cache.set(key, result)
+
+
+def invalidate_verdicts(problem_id):
+    """
+    Removes every cached verdict of a problem, whatever its content hash.
+    """
+    _cache.discard_where(lambda key: key[0] == problem_id)
+
+
+def verdict_cache_stats():
+    return _cache.stats()